@@ -0,0 +1,264 @@
+"""
+In-process caches for read endpoints.
+
+Every write that can change what a device's profile looks like bumps that
+device's version. Cached renders are keyed by version, so a bump makes the old
+entry unreachable instead of requiring explicit invalidation.
+
+With several worker processes a write and the next read can land on different
+workers, so versions must be shared: set CACHE_VERSIONS_PATH to a SQLite file
+all workers on the host can reach (gunicorn.conf.py does this). The rendered
+payloads themselves stay per-process.
+
+With several hosts each one has its own versions, so a bump must reach the
+others: main.py sets `broadcast` to the redis pub/sub broker's invalidate
+when PUBSUB_URL is redis://, and every host applies what it receives with
+bump_local_version. Without it, run the API on one host.
+
+Writers outside the servers (the scripts in backend/scripts) can't reach
+these versions, so they record the devices they touched in the database
+(db.invalidate_profiles, migration 017). InvalidationPoller follows that
+feed and bumps each listed device here within INVALIDATION_POLL_SECONDS.
+"""
+import os
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_POLL_SECONDS = float(os.environ.get("INVALIDATION_POLL_SECONDS", "5"))
+
+
+class _MemoryVersions:
+    """Versions for a single process."""
+
+    def __init__(self):
+        # Versions restart at 0 in a fresh process; the epoch keeps ETags issued
+        # by a previous process from matching a different profile state in this one.
+        self.epoch = os.urandom(4).hex()
+        self._versions: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, device_id: str) -> int:
+        return self._versions.get(device_id, 0)
+
+    def bump(self, device_id: str) -> int:
+        with self._lock:
+            version = self._versions.get(device_id, 0) + 1
+            self._versions[device_id] = version
+        return version
+
+
+class _SQLiteVersions:
+    """Versions in a SQLite file shared by every worker on the host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+        # The epoch lives in the file too, so every worker issues the same ETags.
+        db = self._db()
+        db.execute("INSERT OR IGNORE INTO meta (k, v) VALUES ('epoch', ?)", (os.urandom(4).hex(),))
+        self.epoch = db.execute("SELECT v FROM meta WHERE k = 'epoch'").fetchone()[0]
+
+    def _db(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():   # never share a connection across a fork
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")   # a lost bump only costs one stale-cache miss after a crash
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (device_id TEXT PRIMARY KEY, v INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT NOT NULL)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, device_id: str) -> int:
+        with self._lock:
+            row = self._db().execute("SELECT v FROM versions WHERE device_id = ?", (device_id,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, device_id: str) -> int:
+        with self._lock:
+            return self._db().execute(
+                "INSERT INTO versions (device_id, v) VALUES (?, 1) "
+                "ON CONFLICT (device_id) DO UPDATE SET v = v + 1 RETURNING v",
+                (device_id,),
+            ).fetchone()[0]
+
+
+_VERSIONS_PATH = os.environ.get("CACHE_VERSIONS_PATH")
+_versions = _SQLiteVersions(_VERSIONS_PATH) if _VERSIONS_PATH else _MemoryVersions()
+
+
+def get_version(device_id: str) -> int:
+    return _versions.get(device_id)
+
+
+# Called with every device bumped by this host, to tell the other hosts
+# (see the module docstring). None when there is only one host.
+broadcast: Callable[[str], None] | None = None
+
+
+def bump_version(device_id: str) -> int:
+    """Mark every cached view of this device as stale, on every host. Returns the new version."""
+    version = _versions.bump(device_id)
+    if broadcast is not None:
+        try:
+            broadcast(device_id)
+        except Exception as e:
+            logger.warning("Could not broadcast cache invalidation for %s...: %s", device_id[:8], e)
+    return version
+
+
+def bump_local_version(device_id: str) -> int:
+    """bump_version for this host only: for bumps every host learns about itself."""
+    return _versions.bump(device_id)
+
+
+class InvalidationPoller:
+    """
+    Follows the database's profile_invalidations feed and bumps the local
+    version of every device in it. `fetch(after_seq)` returns rows of
+    {device_id, seq} in seq order; `fetch(None)` returns just the newest row,
+    so a fresh process starts from now instead of replaying the history.
+    """
+
+    def __init__(self, fetch: Callable[[int | None], list[dict]]):
+        self.fetch = fetch
+        self.cursor: int | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="cache-invalidations", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning("Could not read profile invalidations: %s", e)
+            if self._stop.wait(INVALIDATION_POLL_SECONDS):
+                return
+
+    def poll(self) -> int:
+        """Apply everything new in the feed. Returns how many devices were bumped."""
+        if self.cursor is None:
+            rows = self.fetch(None)
+            self.cursor = rows[-1]["seq"] if rows else 0
+            return 0
+        bumped = 0
+        while rows := self.fetch(self.cursor):
+            for row in rows:
+                bump_local_version(row["device_id"])   # every host polls the feed
+            bumped += len(rows)
+            self.cursor = rows[-1]["seq"]
+        return bumped
+
+
+def make_etag(version: int, day: str) -> str:
+    return f'W/"{_versions.epoch}-{version}-{day}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [t.strip() for t in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class LRUCache:
+    """Thread-safe fixed-size LRU mapping."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every key the predicate accepts; a full scan, for rare events. Returns how many."""
+        with self._lock:
+            doomed = [key for key in self._data if predicate(key)]
+            for key in doomed:
+                del self._data[key]
+            return len(doomed)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# (device_id, version, day) -> rendered profile payload
+profile_cache = LRUCache(maxsize=int(os.environ.get("PROFILE_CACHE_SIZE", "2048")))
+
+# (device_id, extension) pairs already recorded in user_stats.file_extensions.
+# Extensions are only ever added while the device exists; forget_device drops
+# them when it is deleted.
+known_extensions = LRUCache(maxsize=int(os.environ.get("KNOWN_EXTENSIONS_CACHE_SIZE", "65536")))
+
+# device_id -> the unique extension count add_file_extensions last returned
+# in this process. The count only grows, so an unchanged one means the set
+# was unchanged and the profile version need not move.
+extension_counts = LRUCache(maxsize=int(os.environ.get("KNOWN_EXTENSIONS_CACHE_SIZE", "65536")))
+
+# (period, period_start, after, limit, time bucket) -> leaderboard page. Pages
+# change with every award anywhere, so they are only reused within a
+# LEADERBOARD_CACHE_SECONDS bucket; a new period_start rolls the key over.
+leaderboard_cache = LRUCache(maxsize=int(os.environ.get("LEADERBOARD_CACHE_SIZE", "256")))
+
+# (device_id, from, last past day, today) -> {source: [entries per day]} for
+# the days before today. Past days only change when xp_log history is
+# rewritten (cleanup-xp, reprocess), which drop the device's entries, as
+# does forget_device; today's bucket is always read live. Writes from the
+# scripts show from the next day on.
+activity_cache = LRUCache(maxsize=int(os.environ.get("ACTIVITY_CACHE_SIZE", "1024")))
+
+# device_id -> True for devices this process has seen registered. While the
+# DB is unreachable ingest accepts events only from these (accept_device),
+# so an outage doesn't let any bearer token fill the spool.
+known_devices = LRUCache(maxsize=int(os.environ.get("KNOWN_DEVICES_CACHE_SIZE", "65536")))
+
+# (device_id, session_id) -> the sync-session response for that session, so a
+# client retry is answered without touching the database. Results never
+# change once written; session_results (migration 016) backs this up.
+session_results = LRUCache(maxsize=int(os.environ.get("SESSION_RESULT_CACHE_SIZE", "4096")))
+
+
+def forget_device(device_id: str) -> None:
+    """
+    After DELETE /api/me: invalidate the device's versioned entries and drop
+    the ones keyed only by device_id, which a re-registered device with the
+    same id would otherwise inherit. Covers this process; other workers'
+    entries age out of their LRUs.
+    """
+    bump_version(device_id)
+    for cache in (known_devices, extension_counts):
+        cache.discard_where(lambda key: key == device_id)
+    for cache in (known_extensions, session_results, activity_cache):
+        cache.discard_where(lambda key: key[0] == device_id)
@@ -1,10 +1,13 @@
 import os
 import logging
 import hashlib
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from functools import lru_cache
+from typing import Iterator
 from supabase import create_client, Client
 
+from .cache import bump_version, extension_counts
+
 logger = logging.getLogger(__name__)
 
 
@@ -30,8 +33,10 @@ def is_already_processed(db: Client, source_key: str) -> bool:
         err_str = str(e).lower()
         if "duplicate" in err_str or "unique" in err_str or "23505" in err_str:
             return True
+        # Anything else (DB down, timeout) must not be mistaken for a duplicate —
+        # that would drop the event for good. The caller spools it instead.
         logger.error("Unexpected deduplication error for key=%s: %s", source_key, e)
-        return True  # treat as duplicate to avoid double-XP on transient errors
+        raise
 
 
 def get_device(db: Client, device_id: str) -> dict | None:
@@ -49,34 +54,214 @@ def get_quest_progress(db: Client, device_id: str) -> dict[str, dict]:
     return {row["quest_id"]: row for row in (res.data or [])}
 
 
+# Set-based variants of the reads above, for many devices in one query each.
+# Callers cap the id list (MAX_BATCH_PROFILES) so one row per device fits
+# under PostgREST's max-rows; quest_progress has several and is paged.
+
+def get_device_batch(db: Client, device_ids: list[str]) -> dict[str, dict]:
+    res = db.table("devices").select("*").in_("device_id", device_ids).execute()
+    return {row["device_id"]: row for row in (res.data or [])}
+
+
+def get_stats_batch(db: Client, device_ids: list[str]) -> dict[str, dict]:
+    res = db.table("user_stats").select("*").in_("device_id", device_ids).execute()
+    return {row["device_id"]: row for row in (res.data or [])}
+
+
+def get_quest_progress_batch(db: Client, device_ids: list[str],
+                             page_size: int | None = None) -> dict[str, dict[str, dict]]:
+    """device_id -> quest_id -> row, paged on (device_id, quest_id)."""
+    page_size = page_size or DEFAULT_PAGE_SIZE
+    progress: dict[str, dict[str, dict]] = {device_id: {} for device_id in device_ids}
+    cursor: tuple[str, str] | None = None
+    while True:
+        query = db.table("quest_progress").select("*").in_("device_id", device_ids)
+        if cursor:
+            device_id, quest_id = cursor
+            query = query.or_(
+                f'device_id.gt."{device_id}",and(device_id.eq."{device_id}",quest_id.gt."{quest_id}")'
+            )
+        rows = query.order("device_id").order("quest_id").limit(page_size).execute().data or []
+        if not rows:
+            return progress
+        for row in rows:
+            progress.setdefault(row["device_id"], {})[row["quest_id"]] = row
+        cursor = (rows[-1]["device_id"], rows[-1]["quest_id"])
+
+
+def get_today_counts_batch(db: Client, device_ids: list[str]) -> dict[str, tuple[int, int]]:
+    """device_id -> (commits today, sessions started today), in one call (migration 010)."""
+    res = db.rpc("today_counts", {
+        "p_device_ids": device_ids,
+        "p_since": date.today().isoformat(),
+    }).execute()
+    return {row["device_id"]: (row["commits"], row["sessions"]) for row in (res.data or [])}
+
+
+# Leaderboards. Each page is one query ordered by (score DESC, device_id), with
+# names and the opt-out embedded from devices; `after` is the last row's
+# (score, device_id) from the previous page. The indexes are in migration 012.
+LEADERBOARD_PERIODS = ("day", "week", "month")
+
+
+def period_start(period: str, today: date) -> date:
+    """First day of the day/week/month bucket containing `today` (as migration 012 buckets)."""
+    if period == "week":
+        return today - timedelta(days=today.weekday())
+    if period == "month":
+        return today.replace(day=1)
+    return today
+
+
+def get_leaderboard_page(db: Client, period: str, start: date | None, limit: int,
+                         after: tuple[int, str] | None = None) -> list[dict]:
+    """
+    Rows of {device_id, score, devices: {...}} for lifetime XP (period "all")
+    or XP earned in the bucket starting `start`.
+    """
+    if period == "all":
+        query = db.table("user_stats").select(
+            "device_id, score:total_xp, total_xp, current_streak, "
+            "devices!inner(character_name, show_on_leaderboard)"
+        )
+        score_col = "total_xp"
+    else:
+        query = db.table("xp_period_totals").select(
+            "device_id, score:xp, "
+            "devices!inner(character_name, show_on_leaderboard, user_stats(total_xp, current_streak))"
+        ).eq("period", period).eq("period_start", start.isoformat()).gt("xp", 0)
+        score_col = "xp"
+    query = query.eq("devices.show_on_leaderboard", True)
+    if after:
+        score, device_id = after
+        query = query.or_(f'{score_col}.lt.{score},and({score_col}.eq.{score},device_id.gt."{device_id}")')
+    return query.order(score_col, desc=True).order("device_id").limit(limit).execute().data or []
+
+
 def award_xp(db: Client, device_id: str, source: str, amount: int) -> None:
     db.table("xp_log").insert({"device_id": device_id, "source": source, "amount": amount}).execute()
+    bump_version(device_id)
 
 
 def upsert_stats(db: Client, device_id: str, updates: dict) -> None:
     db.table("user_stats").upsert({"device_id": device_id, **updates}).execute()
+    bump_version(device_id)
+
+
+def add_file_extensions(db: Client, device_id: str, extensions) -> int:
+    """Set-add extensions to user_stats.file_extensions; returns the unique count (migration 008)."""
+    res = db.rpc("add_file_extensions", {
+        "p_device_id": device_id,
+        "p_exts": sorted(set(extensions)),
+    }).execute()
+    unique_count = res.data if isinstance(res.data, int) else 0
+    last = extension_counts.get(device_id)
+    if last is None or unique_count > last:   # unknown here, or the set grew
+        bump_version(device_id)
+    extension_counts.put(device_id, unique_count)
+    return unique_count
 
 
 def upsert_quest_progress(db: Client, device_id: str, quest_id: str, updates: dict) -> None:
     db.table("quest_progress").upsert({"device_id": device_id, "quest_id": quest_id, **updates}).execute()
+    bump_version(device_id)
+
+
+def claim_quest(db: Client, device_id: str, quest_id: str, since: str | None = None) -> bool:
+    """Mark a quest completed unless it already is (since today, for dailies). True if this call won."""
+    res = db.rpc("claim_quest", {
+        "p_device_id": device_id,
+        "p_quest_id": quest_id,
+        "p_since": since,
+    }).execute()
+    if res.data is not True:
+        return False   # already claimed: nothing changed
+    bump_version(device_id)
+    return True
+
+
+def invalidate_profiles(db: Client, device_ids) -> None:
+    """
+    For writers outside the API servers: mark these devices' cached profiles
+    stale on every server (migration 017). Server code calls bump_version.
+    """
+    device_ids = sorted(set(device_ids))
+    if device_ids:
+        db.rpc("invalidate_profiles", {"p_device_ids": device_ids}).execute()
+
+
+def get_profile_invalidations(db: Client, after_seq: int | None, limit: int = 1000) -> list[dict]:
+    """Feed rows after `after_seq` in seq order; with None, only the newest row."""
+    query = db.table("profile_invalidations").select("device_id, seq")
+    if after_seq is None:
+        return query.order("seq", desc=True).limit(1).execute().data or []
+    return query.gt("seq", after_seq).order("seq").limit(limit).execute().data or []
+
+
+def get_session_result(db: Client, device_id: str, session_id: str) -> dict | None:
+    """The stored sync-session response for this session, if it was processed (migration 016)."""
+    res = (
+        db.table("session_results")
+        .select("result")
+        .eq("device_id", device_id)
+        .eq("session_id", session_id)
+        .limit(1)
+        .execute()
+    )
+    return res.data[0]["result"] if res.data else None
+
+
+def save_session_result(db: Client, device_id: str, session_id: str, result: dict) -> None:
+    db.table("session_results").upsert({"device_id": device_id, "session_id": session_id, "result": result}).execute()
 
 
 def log_raw_event(db: Client, device_id: str, session_id: str | None, event_type: str, data: dict) -> None:
     db.table("events").insert({"device_id": device_id, "session_id": session_id, "event_type": event_type, "data": data}).execute()
 
 
-def get_recent_events(db: Client, device_id: str, days: int = 30) -> list[dict]:
-    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+# Keep in step with coding_stats_retention_days() in migration 013.
+CODING_STATS_DAYS = 30
+
+
+def get_coding_stats_days(db: Client, device_id: str) -> list[dict]:
+    """The device's per-day coding-stats buckets (at most CODING_STATS_DAYS, today included)."""
+    since = datetime.now(timezone.utc).date() - timedelta(days=CODING_STATS_DAYS - 1)
     res = (
-        db.table("events")
-        .select("data, received_at")
+        db.table("coding_stats_daily")
+        .select("projects, tools, hours")
         .eq("device_id", device_id)
-        .gte("received_at", since)
+        .gte("day", since.isoformat())
         .execute()
     )
     return res.data or []
 
 
+def get_activity_series(db: Client, device_id: str, start: date, end: date) -> dict[str, list[int]]:
+    """
+    xp_log entries per source and day over [start, end], one dense array per
+    source with element 0 = start (migration 015). Sources with no entries
+    in the range are absent.
+    """
+    res = db.rpc("activity_series", {
+        "p_device_id": device_id,
+        "p_from": start.isoformat(),
+        "p_to": end.isoformat(),
+    }).execute()
+    return {row["source"]: row["counts"] for row in res.data or []}
+
+
+def get_activity_day(db: Client, device_id: str, day: date) -> dict[str, int]:
+    """xp_log entries per source on a single day."""
+    res = (
+        db.table("xp_activity_daily")
+        .select("source, entries")
+        .eq("device_id", device_id)
+        .eq("day", day.isoformat())
+        .execute()
+    )
+    return {row["source"]: row["entries"] for row in res.data or []}
+
+
 def count_today_xp_source(db: Client, device_id: str, source: str) -> int:
     from datetime import date
     res = (
@@ -94,29 +279,89 @@ def get_today_session_count(db: Client, device_id: str) -> int:
     """Count distinct sessions that started today."""
     from datetime import date
     res = (
-        db.table("events")
-        .select("session_id")
+        db.table("sessions")
+        .select("session_id", count="exact", head=True)
         .eq("device_id", device_id)
-        .eq("event_type", "SessionStart")
-        .gte("received_at", date.today().isoformat())
+        .gte("started_at", date.today().isoformat())
         .execute()
     )
-    unique = {r["session_id"] for r in (res.data or []) if r.get("session_id")}
-    return len(unique)
+    return res.count or 0
 
 
-def get_all_events(db: Client, device_id: str) -> list[dict]:
-    """Return every raw event for a device in chronological order."""
-    res = (
-        db.table("events")
-        .select("event_type, received_at, data")
-        .eq("device_id", device_id)
-        .order("received_at")
-        .execute()
-    )
+# PostgREST silently caps unpaginated selects at its max-rows setting, so
+# full-history reads page through keyset cursors instead. Keep page sizes at
+# or below that cap; iteration stops on the first empty page, not a short one.
+DEFAULT_PAGE_SIZE = 1000
+
+
+def _iter_keyset(db: Client, table: str, columns: str, device_id: str, order_col: str,
+                 since: str | None = None, page_size: int = DEFAULT_PAGE_SIZE,
+                 tie_col: str = "id", after: tuple[str, str] | None = None) -> Iterator[dict]:
+    """
+    Yield a device's rows ordered by (order_col, tie_col), one page in memory
+    at a time, starting after the (order_col, tie_col) cursor `after` if given.
+    """
+    cursor = after
+    while True:
+        query = db.table(table).select(f"{tie_col}, {columns}").eq("device_id", device_id)
+        if since:
+            query = query.gte(order_col, since)
+        if cursor:
+            ts, tie = cursor
+            query = query.or_(
+                f'{order_col}.gt."{ts}",and({order_col}.eq."{ts}",{tie_col}.gt."{tie}")'
+            )
+        rows = query.order(order_col).order(tie_col).limit(page_size).execute().data or []
+        if not rows:
+            return
+        yield from rows
+        cursor = (rows[-1][order_col], rows[-1][tie_col])
+
+
+def iter_events(db: Client, device_id: str, since: str | None = None,
+                page_size: int = DEFAULT_PAGE_SIZE,
+                columns: str = "event_type, received_at, data",
+                after: tuple[str, str] | None = None) -> Iterator[dict]:
+    """Yield a device's raw events in chronological order."""
+    return _iter_keyset(db, "events", columns, device_id, "received_at", since, page_size, after=after)
+
+
+def iter_xp_log(db: Client, device_id: str, since: str | None = None,
+                page_size: int = DEFAULT_PAGE_SIZE,
+                columns: str = "source, amount, created_at",
+                after: tuple[str, str] | None = None) -> Iterator[dict]:
+    """Yield a device's xp_log entries in chronological order."""
+    return _iter_keyset(db, "xp_log", columns, device_id, "created_at", since, page_size, after=after)
+
+
+def iter_sessions(db: Client, device_id: str, since: str | None = None,
+                  page_size: int = DEFAULT_PAGE_SIZE,
+                  columns: str = "started_at, ended_at, minutes, started_by_hook") -> Iterator[dict]:
+    """Yield a device's sessions in start order."""
+    return _iter_keyset(db, "sessions", columns, device_id, "started_at", since, page_size,
+                        tie_col="session_id")
+
+
+def get_event_counts(db: Client, device_id: str, since: str) -> list[dict]:
+    """Events per (UTC day, event_type) since `since`, grouped in the database (migration 014)."""
+    res = db.rpc("debug_event_counts", {"p_device_id": device_id, "p_since": since}).execute()
     return res.data or []
 
 
+def get_xp_summary(db: Client, device_id: str) -> list[dict]:
+    """xp_log entries and XP per (UTC day, source), grouped in the database (migration 014)."""
+    res = db.rpc("debug_xp_summary", {"p_device_id": device_id}).execute()
+    return res.data or []
+
+
+def get_all_events(db: Client, device_id: str) -> list[dict]:
+    """Return every raw event for a device in chronological order.
+
+    Materializes the whole history — prefer iter_events for large accounts.
+    """
+    return list(iter_events(db, device_id))
+
+
 def award_xp_at(db: Client, device_id: str, source: str, amount: int, created_at: str) -> None:
     """Insert an xp_log entry with a specific timestamp (used for backfilling)."""
     db.table("xp_log").insert({
@@ -125,25 +370,100 @@ def award_xp_at(db: Client, device_id: str, source: str, amount: int, created_at
         "amount": amount,
         "created_at": created_at,
     }).execute()
+    bump_version(device_id)
 
 
 def get_session_start_time(db: Client, device_id: str, session_id: str | None) -> datetime | None:
-    """Return the received_at timestamp of the SessionStart for this session."""
+    """Return when this session started, from the sessions table."""
     if not session_id:
         return None
     res = (
-        db.table("events")
-        .select("received_at")
+        db.table("sessions")
+        .select("started_at")
         .eq("device_id", device_id)
         .eq("session_id", session_id)
-        .eq("event_type", "SessionStart")
         .limit(1)
         .execute()
     )
     if not res.data:
         return None
-    ts = res.data[0]["received_at"]
+    ts = res.data[0]["started_at"]
     try:
         return datetime.fromisoformat(ts.replace("Z", "+00:00"))
     except Exception:
         return None
+
+
+def start_session(db: Client, device_id: str, session_id: str) -> None:
+    """Record a SessionStart. A retried or late duplicate keeps the first start time."""
+    db.table("sessions").upsert(
+        {"device_id": device_id, "session_id": session_id, "started_by_hook": True},
+        on_conflict="device_id,session_id",
+        ignore_duplicates=True,
+    ).execute()
+    bump_version(device_id)   # sessions_today changed
+
+
+def end_session(db: Client, device_id: str, session_id: str, updates: dict) -> None:
+    """Fill in ended_at / minutes / counters on a session that has already started."""
+    db.table("sessions").update(updates).eq("device_id", device_id).eq("session_id", session_id).execute()
+
+
+def upsert_session(db: Client, device_id: str, session_id: str, row: dict) -> None:
+    """
+    Write a synced session's totals (transcript sync). An existing row keeps
+    its started_at, which the SessionStart hook recorded (migration 018).
+    """
+    db.rpc("upsert_synced_session", {
+        "p_device_id": device_id,
+        "p_session_id": session_id,
+        "p_started_at": row.get("started_at"),
+        "p_ended_at": row.get("ended_at"),
+        "p_minutes": row["minutes"],
+        "p_commits": row["commits"],
+        "p_test_passes": row["test_passes"],
+    }).execute()
+    bump_version(device_id)
+
+
+# Teams (migration 011). team_stats is maintained by triggers on user_stats,
+# team_members and xp_log; nothing here writes it.
+
+def create_team(db: Client, team_id: str, name: str, join_code: str, owner_device_id: str) -> None:
+    db.rpc("create_team", {
+        "p_team_id": team_id,
+        "p_name": name,
+        "p_join_code": join_code,
+        "p_owner": owner_device_id,
+    }).execute()
+
+
+def get_team(db: Client, team_id: str) -> dict | None:
+    """The team and its precomputed team_stats row (embedded as "team_stats")."""
+    res = db.table("teams").select(
+        "team_id, name, join_code, created_at, team_stats(*)"
+    ).eq("team_id", team_id).execute()
+    return res.data[0] if res.data else None
+
+
+def add_team_member(db: Client, team_id: str, device_id: str) -> None:
+    db.table("team_members").upsert(
+        {"team_id": team_id, "device_id": device_id},
+        on_conflict="team_id,device_id", ignore_duplicates=True,
+    ).execute()
+
+
+def remove_team_member(db: Client, team_id: str, device_id: str) -> bool:
+    res = db.table("team_members").delete().eq("team_id", team_id).eq("device_id", device_id).execute()
+    return bool(res.data)
+
+
+def get_team_leaderboard(db: Client, limit: int = 20) -> list[dict]:
+    res = (
+        db.table("team_stats")
+        .select("*, teams!inner(name)")
+        .order("total_xp", desc=True)
+        .limit(limit)
+        .execute()
+    )
+    return res.data or []
@@ -0,0 +1,266 @@
+"""
+Request and response encoding: the JSON serializer and HTTP compression.
+
+JSON_ENCODER picks the class every route renders through:
+    orjson   (default) several times faster than the stdlib on large payloads
+    json     the stdlib, via Starlette's JSONResponse
+If orjson is not installed the stdlib is used and a warning is logged.
+
+CompressionMiddleware gzips or brotli-compresses responses of at least
+COMPRESS_MIN_BYTES when the client accepts it, preferring br. Brotli comes
+from the 'brotli' package; without it only gzip is offered. Streams are
+compressed chunk by chunk, except
+SSE (every event must reach the browser as it happens) and bodies that are
+already compressed.
+
+DecompressionMiddleware accepts request bodies sent with Content-Encoding
+gzip or zstd (the 'zstandard' package; without it only gzip). Routes see
+plain JSON.
+Output is capped at MAX_REQUEST_BODY_BYTES while decompressing, so a
+small compressed body cannot expand into gigabytes (413). Anything else
+gets 415.
+"""
+import io
+import logging
+import os
+import zlib
+from typing import Callable
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+JSON_ENCODER = os.environ.get("JSON_ENCODER", "orjson")
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "4"))   # 4-5 suit dynamic responses; 11 is for static assets
+MAX_REQUEST_BODY_BYTES = int(float(os.environ.get("MAX_REQUEST_BODY_MB", "8")) * 1024 * 1024)
+
+# Never compressed: SSE must not be buffered, and the rest already are.
+UNCOMPRESSED_TYPES = {"text/event-stream", "application/gzip", "application/zstd", "application/zip"}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _json_response_class() -> type[JSONResponse]:
+    if JSON_ENCODER == "json":
+        return JSONResponse
+    if JSON_ENCODER != "orjson":
+        raise RuntimeError(f"Unknown JSON_ENCODER {JSON_ENCODER!r} (use 'orjson' or 'json')")
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        logger.warning("JSON_ENCODER=orjson but orjson is not installed; using the stdlib encoder")
+        return JSONResponse
+    return ORJSONResponse
+
+
+DefaultJSONResponse = _json_response_class()
+
+
+# encoding -> factory of (compress(chunk), finish()) for one response
+def _gzip() -> tuple[Callable[[bytes], bytes], Callable[[], bytes]]:
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def _brotli() -> tuple[Callable[[bytes], bytes], Callable[[], bytes]]:
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return compressor.process, compressor.finish
+
+
+ENCODERS = {"br": _brotli, "gzip": _gzip} if brotli else {"gzip": _gzip}
+
+
+def negotiate(accept_encoding: str) -> str | None:
+    """The encoding to use for this Accept-Encoding header, br over gzip at equal q; None for identity."""
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    best = None
+    for encoding in ENCODERS:   # preference order
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best else None
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_BYTES) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Message | None = None
+        compress = finish = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, compress, finish
+            if message["type"] == "http.response.start":
+                start = message   # held back until the first body chunk shows what we're sending
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+                if not ("content-encoding" in headers or media_type in UNCOMPRESSED_TYPES
+                        or (not more_body and len(body) < self.minimum_size)):
+                    compress, finish = ENCODERS[encoding]()
+                    headers["Content-Encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                    if "content-length" in headers:
+                        del headers["Content-Length"]
+                    if not more_body:
+                        body = compress(body) + finish()
+                        headers["Content-Length"] = str(len(body))
+                        compress = None
+                        message = {**message, "body": body}
+                await send(start)
+                start = None
+                if compress is None:
+                    await send(message)
+                    return
+
+            if compress is not None:
+                out = compress(body)
+                if not more_body:
+                    out += finish()
+                message = {**message, "body": out}
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+def gunzip(data: bytes, limit: int) -> bytes:
+    """Decompress one or more gzip members, never producing more than `limit` bytes."""
+    out: list[bytes] = []
+    size = 0
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunk = decompressor.decompress(data, limit + 1 - size)
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge(f"decompressed body exceeds {limit} bytes")
+        if not decompressor.eof:
+            raise zlib.error("truncated gzip stream")
+        out.append(chunk)
+        data = decompressor.unused_data
+    return b"".join(out)
+
+
+def unzstd(data: bytes, limit: int) -> bytes:
+    """Decompress a zstd stream, never producing more than `limit` bytes."""
+    out: list[bytes] = []
+    size = 0
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True) as reader:
+        while chunk := reader.read(64 * 1024):
+            size += len(chunk)
+            if size > limit:
+                raise BodyTooLarge(f"decompressed body exceeds {limit} bytes")
+            out.append(chunk)
+    return b"".join(out)
+
+
+DECODERS = {"gzip": gunzip}
+if zstandard:
+    DECODERS["zstd"] = unzstd
+
+
+class DecompressionMiddleware:
+    def __init__(self, app: ASGIApp, max_size: int = MAX_REQUEST_BODY_BYTES) -> None:
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        encoding = headers.get("content-encoding", "identity").strip().lower()
+        encoding = {"x-gzip": "gzip"}.get(encoding, encoding)
+        if encoding == "identity":
+            await self.app(scope, receive, send)
+            return
+        if encoding not in DECODERS:
+            await self._reject(scope, receive, send, 415, f"Unsupported Content-Encoding {encoding!r}")
+            return
+        if int(headers.get("content-length") or 0) > self.max_size:
+            await self._reject(scope, receive, send, 413, "Request body too large")
+            return
+
+        # Buffer the compressed body (at most max_size) and hand the app the
+        # decompressed one; every route here parses the whole body anyway.
+        compressed = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            compressed += message.get("body", b"")
+            if len(compressed) > self.max_size:
+                await self._reject(scope, receive, send, 413, "Request body too large")
+                return
+            if not message.get("more_body", False):
+                break
+        try:
+            body = DECODERS[encoding](bytes(compressed), self.max_size)
+        except BodyTooLarge:
+            await self._reject(scope, receive, send, 413, "Request body too large")
+            return
+        except Exception as e:
+            logger.info("Undecodable %s request body on %s: %s", encoding, scope.get("path"), e)
+            await self._reject(scope, receive, send, 400, f"Malformed {encoding} body")
+            return
+
+        raw = [(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")]
+        raw.append((b"content-length", str(len(body)).encode()))
+        delivered = False
+
+        async def receive_decompressed() -> Message:
+            nonlocal delivered
+            if delivered:
+                return await receive()
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app({**scope, "headers": raw}, receive_decompressed, send)
+
+    @staticmethod
+    async def _reject(scope: Scope, receive: Receive, send: Send, status: int, detail: str) -> None:
+        headers = {"Accept-Encoding": ", ".join(["identity", *DECODERS])} if status == 415 else None
+        await JSONResponse({"detail": detail}, status_code=status, headers=headers)(scope, receive, send)
@@ -55,6 +55,9 @@ def get_counter_value(stats: dict, progress_row: dict | None, quest: Quest, toda
         return progress_row.get("current_value", 0)
     else:
         if quest.counter == "unique_extensions":
+            # Callers holding the count from add_file_extensions pass it directly
+            if "unique_extensions" in stats:
+                return stats["unique_extensions"]
             return len(stats.get("file_extensions") or [])
         return stats.get(quest.counter, 0)
 
@@ -3,6 +3,8 @@ XP computation rules — pure functions, no DB access.
 """
 import re
 import math
+from bisect import bisect_right
+from typing import Iterable, NamedTuple
 
 TEST_PATTERNS = re.compile(
     r"\b(pytest|python\s+-m\s+pytest|"
@@ -109,27 +111,86 @@ def compute_xp(event: dict) -> tuple[int, str]:
     return 0, ""
 
 
-def compute_level(total_xp: int) -> int:
-    """level = floor(sqrt(total_xp / 50))"""
-    return int(math.floor(math.sqrt(max(total_xp, 0) / 50)))
-
-
 def xp_for_level(level: int) -> int:
     """Minimum XP needed to reach this level."""
     return level * level * 50
 
 
-def level_title(level: int) -> str:
-    titles = [
-        (30, "Legendary Promptsmith"),
-        (20, "Architecture Overlord"),
-        (15, "Refactor Mage"),
-        (10, "Code Conjurer"),
-        (5,  "Context Crafter"),
-        (1,  "Prompt Padawan"),
-        (0,  "New Recruit"),
-    ]
-    for threshold, title in titles:
+# Titles by minimum level, highest first.
+LEVEL_TITLES: list[tuple[int, str]] = [
+    (30, "Legendary Promptsmith"),
+    (20, "Architecture Overlord"),
+    (15, "Refactor Mage"),
+    (10, "Code Conjurer"),
+    (5,  "Context Crafter"),
+    (1,  "Prompt Padawan"),
+    (0,  "New Recruit"),
+]
+
+# Lookup tables up to LEVEL_CAP. LEVEL_THRESHOLDS[n] is the cumulative XP at
+# which level n starts; XP past the last entry falls back to integer sqrt.
+LEVEL_CAP = 200
+LEVEL_THRESHOLDS: list[int] = [xp_for_level(n) for n in range(LEVEL_CAP + 2)]
+
+
+def _title_for(level: int) -> str:
+    for threshold, title in LEVEL_TITLES:
         if level >= threshold:
             return title
     return "New Recruit"
+
+
+_TITLE_BY_LEVEL: list[str] = [_title_for(n) for n in range(LEVEL_CAP + 1)]
+
+
+class LevelProgress(NamedTuple):
+    level: int
+    title: str
+    xp_in_level: int
+    xp_to_next: int     # size of the current level, i.e. XP from its start to the next
+
+
+def compute_level(total_xp: int) -> int:
+    """level = floor(sqrt(total_xp / 50))"""
+    total_xp = max(int(total_xp), 0)
+    if total_xp < LEVEL_THRESHOLDS[-1]:
+        return bisect_right(LEVEL_THRESHOLDS, total_xp) - 1
+    return math.isqrt(total_xp // 50)
+
+
+def level_title(level: int) -> str:
+    if 0 <= level <= LEVEL_CAP:
+        return _TITLE_BY_LEVEL[level]
+    return _title_for(level)
+
+
+def _progress_at(total_xp: int, level: int) -> LevelProgress:
+    start = xp_for_level(level)
+    return LevelProgress(level, level_title(level), total_xp - start, xp_for_level(level + 1) - start)
+
+
+def level_progress(total_xp: int) -> LevelProgress:
+    """Level, title and position within the level for an XP total."""
+    total_xp = max(int(total_xp or 0), 0)
+    return _progress_at(total_xp, compute_level(total_xp))
+
+
+def level_progress_many(totals: Iterable[int]) -> list[LevelProgress]:
+    """
+    level_progress for many XP totals at once, in input order.
+
+    Sorts the totals and sweeps the threshold table once instead of searching
+    it per total — the shape of leaderboard and export workloads.
+    """
+    values = [max(int(x or 0), 0) for x in totals]
+    out: list[LevelProgress | None] = [None] * len(values)
+    level = 0
+    for i in sorted(range(len(values)), key=values.__getitem__):
+        xp = values[i]
+        if xp >= LEVEL_THRESHOLDS[-1]:
+            out[i] = level_progress(xp)
+            continue
+        while LEVEL_THRESHOLDS[level + 1] <= xp:
+            level += 1
+        out[i] = _progress_at(xp, level)
+    return out  # type: ignore[return-value]
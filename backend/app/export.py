@@ -0,0 +1,182 @@
+"""
+Streaming export of one device's history as NDJSON, and the matching import.
+
+The first line is a header and the last is an end marker with row counts,
+so a truncated stream is detected. Every line between is
+{"table": ..., "row": ...}. Tables come in EXPORT_ORDER, which is also the
+order a restore needs: xp_log goes before user_stats because the xp_log
+trigger (migration 006) rebuilds total_xp and level, so those columns are
+never imported. Large tables are read through the keyset iterators in
+app.db and written in batches, so memory on either side stays flat however
+long the history is.
+"""
+import json
+import logging
+import zlib
+from datetime import datetime, timezone
+from typing import Iterable, Iterator
+
+from supabase import Client
+
+from .db import invalidate_profiles, iter_events, iter_sessions, iter_xp_log
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMAT = "game-of-claude-export"
+EXPORT_VERSION = 1
+EXPORT_ORDER = ("devices", "xp_log", "user_stats", "quest_progress", "sessions", "events")
+
+CHUNK_BYTES = 64 * 1024
+
+# Columns that belong to the source database or are derived by triggers.
+_NOT_IMPORTED = {
+    "devices": {"id"},
+    "user_stats": {"total_xp", "level"},
+}
+
+# How each table is written on import. Rows whose key already exists are
+# skipped (append-only logs) or overwritten (state), so re-running an import
+# is safe.
+_UPSERT = {
+    "devices": ("device_id", False),
+    "xp_log": ("id", True),
+    "user_stats": ("device_id", False),
+    "quest_progress": ("device_id,quest_id", False),
+    "sessions": ("device_id,session_id", False),
+    "events": ("id", True),
+}
+
+
+class ExportFormatError(ValueError):
+    pass
+
+
+def _line(obj: dict) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), default=str).encode() + b"\n"
+
+
+def _rows(db: Client, device_id: str, table: str) -> Iterator[dict]:
+    if table == "xp_log":
+        return iter_xp_log(db, device_id, columns="source, amount, created_at")
+    if table == "sessions":
+        return iter_sessions(db, device_id, columns="started_at, ended_at, minutes, commits, "
+                                                    "test_passes, started_by_hook")
+    if table == "events":
+        return iter_events(db, device_id, columns="session_id, event_type, data, received_at")
+    # One row per device, or one per quest: small enough for a single read.
+    return iter(db.table(table).select("*").eq("device_id", device_id).execute().data or [])
+
+
+def iter_export(db: Client, device_id: str) -> Iterator[bytes]:
+    """Yield the device's export one NDJSON line at a time."""
+    yield _line({
+        "format": EXPORT_FORMAT,
+        "version": EXPORT_VERSION,
+        "device_id": device_id,
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "tables": list(EXPORT_ORDER),
+    })
+    counts: dict[str, int] = {}
+    for table in EXPORT_ORDER:
+        counts[table] = 0
+        for row in _rows(db, device_id, table):
+            row.pop("device_id", None)
+            yield _line({"table": table, "row": row})
+            counts[table] += 1
+    yield _line({"end": True, "counts": counts})
+
+
+def chunked(lines: Iterable[bytes], size: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """Coalesce small lines into ~`size`-byte writes."""
+    buf: list[bytes] = []
+    buffered = 0
+    for line in lines:
+        buf.append(line)
+        buffered += len(line)
+        if buffered >= size:
+            yield b"".join(buf)
+            buf, buffered = [], 0
+    if buf:
+        yield b"".join(buf)
+
+
+def gzipped(lines: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Stream `lines` as one gzip member, compressing a chunk at a time."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunked(lines):
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def read_export(lines: Iterable[bytes | str]) -> Iterator[tuple[str, dict]]:
+    """
+    Parse an export stream into (table, row) pairs. The header is returned
+    first as ("header", {...}). Raises ExportFormatError if the header is
+    wrong or the end marker never arrives.
+    """
+    it = iter(lines)
+    try:
+        header = json.loads(next(it))
+    except StopIteration:
+        raise ExportFormatError("empty export")
+    if header.get("format") != EXPORT_FORMAT or header.get("version") != EXPORT_VERSION:
+        raise ExportFormatError(f"not a {EXPORT_FORMAT} v{EXPORT_VERSION} stream")
+    yield "header", header
+    for raw in it:
+        if not raw.strip():
+            continue
+        record = json.loads(raw)
+        if record.get("end"):
+            return
+        if record.get("table") not in _UPSERT:
+            raise ExportFormatError(f"unknown table {record.get('table')!r}")
+        yield record["table"], record["row"]
+    raise ExportFormatError("export is truncated (no end marker)")
+
+
+def import_device(db: Client, lines: Iterable[bytes | str], device_id: str | None = None,
+                  batch_size: int = 500) -> dict[str, int]:
+    """
+    Restore an export into `device_id` (default: the device it was exported
+    from) with batched upserts. Returns rows written per table.
+
+    Restoring into the same device keeps xp_log and event ids, so a re-run
+    skips what is already there. Restoring into a different device lets the
+    database assign new ids, since the originals may still be in use.
+    """
+    counts = {table: 0 for table in EXPORT_ORDER}
+    batch: list[dict] = []
+    batch_table: str | None = None
+    keep_ids = True
+
+    def flush() -> None:
+        nonlocal batch
+        if not batch:
+            return
+        on_conflict, ignore_duplicates = _UPSERT[batch_table]
+        if batch_table in ("xp_log", "events") and not keep_ids:
+            db.table(batch_table).insert(batch).execute()
+        else:
+            db.table(batch_table).upsert(batch, on_conflict=on_conflict,
+                                         ignore_duplicates=ignore_duplicates).execute()
+        counts[batch_table] += len(batch)
+        batch = []
+
+    for table, row in read_export(lines):
+        if table == "header":
+            device_id = device_id or row["device_id"]
+            keep_ids = device_id == row["device_id"]
+            continue
+        if table != batch_table or len(batch) >= batch_size:
+            flush()
+            batch_table = table
+        row = {k: v for k, v in row.items() if k not in _NOT_IMPORTED.get(table, ())}
+        if not keep_ids:
+            row.pop("id", None)
+        batch.append({**row, "device_id": device_id})
+    flush()
+    invalidate_profiles(db, [device_id])   # servers may hold a cached profile of the old state
+    logger.info("Imported into %s...: %s", device_id[:8], counts)
+    return counts
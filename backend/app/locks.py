@@ -0,0 +1,133 @@
+"""
+Per-device serialization for endpoints that read-modify-write user_stats
+and quest_progress.
+
+Requests for one device run one at a time; requests for different devices
+never wait on each other. Within a process this is a keyed lock (endpoints
+run on the threadpool). DEVICE_LOCKS widens it:
+    local  this process only (default; one worker)
+    host   plus an flock on a striped lock file, for several workers on one host
+    db     plus a short-lived lease row in Postgres (migration 009), across hosts
+Writers outside the servers (backend/scripts) take all of them at once with
+offline_lock, since they can't know which mode the servers run in.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+LOCK_MODE = os.environ.get("DEVICE_LOCKS", "local")        # "local" | "host" | "db"
+LOCK_TIMEOUT = float(os.environ.get("DEVICE_LOCK_TIMEOUT", "10"))
+LEASE_TTL_MS = int(os.environ.get("DEVICE_LEASE_TTL_MS", "30000"))  # outlives any request
+LOCK_DIR = os.environ.get("DEVICE_LOCK_DIR", os.path.join(tempfile.gettempdir(), "goc-device-locks"))
+# Devices hash onto this many lock files. Two devices sharing a stripe only
+# wait on each other while both are mid-request.
+LOCK_STRIPES = 1024
+
+# device_id -> [lock, number of requests holding or waiting for it]
+_locks: dict[str, list] = {}
+_locks_guard = threading.Lock()
+
+
+class DeviceBusy(TimeoutError):
+    """The device's lock could not be taken within DEVICE_LOCK_TIMEOUT."""
+
+
+@contextmanager
+def _local_lock(device_id: str, deadline: float) -> Iterator[None]:
+    with _locks_guard:
+        entry = _locks.setdefault(device_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        if not entry[0].acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise DeviceBusy(device_id)
+        try:
+            yield
+        finally:
+            entry[0].release()
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _locks[device_id]   # keep the map sized to in-flight devices
+
+
+@contextmanager
+def _host_lock(device_id: str, deadline: float) -> Iterator[None]:
+    stripe = int.from_bytes(hashlib.blake2b(device_id.encode(), digest_size=4).digest(), "big") % LOCK_STRIPES
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    fd = os.open(os.path.join(LOCK_DIR, f"{stripe:04d}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() + delay > deadline:
+                    raise DeviceBusy(device_id)
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def _db_lease(db, device_id: str, deadline: float) -> Iterator[None]:
+    holder = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+    params = {"p_device_id": device_id, "p_holder": holder}
+    delay = 0.01
+    while not db.rpc("acquire_device_lease", {**params, "p_ttl_ms": LEASE_TTL_MS}).execute().data:
+        if time.monotonic() + delay > deadline:
+            raise DeviceBusy(device_id)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+    try:
+        yield
+    finally:
+        try:
+            db.rpc("release_device_lease", params).execute()
+        except Exception as e:
+            # The lease expires on its own; the next request just waits for it.
+            logger.warning("Could not release lease for %s: %s", device_id[:8], e)
+
+
+@contextmanager
+def device_lock(db, device_id: str) -> Iterator[None]:
+    """Hold the device's lock for the duration of the block; raises DeviceBusy on timeout."""
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    # The local lock comes first so one process never has two requests
+    # polling for the same lease or lock file.
+    with _local_lock(device_id, deadline):
+        if LOCK_MODE == "db":
+            with _db_lease(db, device_id, deadline):
+                yield
+        elif LOCK_MODE == "host":
+            with _host_lock(device_id, deadline):
+                yield
+        else:
+            yield
+
+
+@contextmanager
+def offline_lock(db, device_id: str) -> Iterator[None]:
+    """
+    device_lock in every mode at once, for scripts: excludes servers running
+    DEVICE_LOCKS=db anywhere and DEVICE_LOCKS=host on this host (sharing
+    DEVICE_LOCK_DIR). A server in local mode can't be excluded.
+    """
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    with _local_lock(device_id, deadline), _db_lease(db, device_id, deadline), _host_lock(device_id, deadline):
+        yield
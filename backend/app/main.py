@@ -1,43 +1,71 @@
 """
 Game of Claude — FastAPI backend
 """
+import asyncio
+import base64
+import binascii
+import json
 import logging
 import os
-from datetime import date, datetime, timezone
-from typing import Any
+import secrets
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, Literal
 
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Header, HTTPException, Depends, Request
+from fastapi import FastAPI, Header, HTTPException, Depends, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.errors import RateLimitExceeded
-from slowapi.util import get_remote_address
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
 
 from .db import (
     get_client, get_device, get_stats, get_quest_progress,
     award_xp, upsert_stats, upsert_quest_progress,
     log_raw_event, is_already_processed, make_source_key,
-    get_recent_events, get_today_session_count, count_today_xp_source,
-    get_session_start_time, get_all_events, award_xp_at,
+    get_coding_stats_days, get_today_session_count, count_today_xp_source,
+    get_session_start_time, iter_events, iter_xp_log, award_xp_at,
+    iter_sessions, start_session, end_session, upsert_session, add_file_extensions,
+    claim_quest, get_device_batch, get_stats_batch, get_quest_progress_batch, get_today_counts_batch,
+    create_team, get_team, add_team_member, remove_team_member, get_team_leaderboard,
+    period_start, get_leaderboard_page, get_event_counts, get_xp_summary,
+    get_activity_series, get_activity_day, get_session_result, save_session_result,
+    get_profile_invalidations,
 )
+from .cache import (
+    get_version, bump_version, make_etag, etag_matches, profile_cache, known_extensions,
+    leaderboard_cache, activity_cache, session_results, known_devices, InvalidationPoller, forget_device,
+    bump_local_version,
+)
+from .pubsub import broker, publish, format_sse, RedisBroker
+from .locks import device_lock, DeviceBusy
+from .spool import spool, breaker, is_transient, Replayer
+from .export import iter_export, chunked, gzipped
+from .encoding import DefaultJSONResponse, CompressionMiddleware, DecompressionMiddleware
+from . import cache, ratelimit
 from .engine.xp import (
-    compute_xp, compute_level, xp_for_level, level_title,
+    compute_xp, compute_level, level_title, level_progress, level_progress_many,
     parse_commit_stats, extract_file_extension,
 )
 from .engine.streak import compute_streak_xp
 from .engine.quests import QUESTS, QUEST_BY_ID, get_counter_value, quests_to_check_for_event
-from .models import HookEvent, DeviceRegister, ProfilePatch, GitSync, SessionSummary
+from .models import (
+    UUID4_RE, MAX_EVENT_BYTES, HookEvent, DeviceRegister, ProfilePatch, ProfileBatch, TeamCreate, TeamJoin,
+    GitSync, SessionSummary,
+)
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
 logger = logging.getLogger(__name__)
 
-limiter = Limiter(key_func=get_remote_address)
-
 
 @asynccontextmanager
 async def lifespan(app):
-    """Verify migration 003 columns exist so stat tracking doesn't fail silently."""
+    """Verify required migrations are applied so stat tracking doesn't fail silently."""
     try:
         db = get_client()
         db.table("user_stats").select(
@@ -48,12 +76,32 @@ async def lifespan(app):
     except Exception as e:
         logger.error("SCHEMA CHECK FAILED: migration 003 columns missing! "
                      "Run supabase/migrations/003_raw_stats_columns.sql. Error: %s", e)
+    try:
+        get_client().rpc("level_for_xp", {"xp": 0}).execute()
+    except Exception as e:
+        logger.error("SCHEMA CHECK FAILED: xp_log triggers missing — total_xp will not update! "
+                     "Run supabase/migrations/006_xp_total_triggers.sql. Error: %s", e)
+    replayer = Replayer(spool, breaker, _replay_spooled_event)
+    replayer.start()
+    invalidations = InvalidationPoller(lambda after: get_profile_invalidations(get_client(), after))
+    invalidations.start()
+    if isinstance(broker, RedisBroker):   # several hosts: each one's version bumps must reach the rest
+        cache.broadcast = broker.invalidate
+        broker.on_invalidate(bump_local_version)
     yield
+    invalidations.stop()
+    replayer.stop()
+
+
+app = FastAPI(title="Game of Claude API", lifespan=lifespan, default_response_class=DefaultJSONResponse)
+
 
+@app.exception_handler(DeviceBusy)
+def _device_busy_handler(request: Request, exc: DeviceBusy):
+    # Another request for this device held its lock too long; hooks retry.
+    return JSONResponse(status_code=503, content={"detail": "Device busy, retry"},
+                        headers={"Retry-After": "1"})
 
-app = FastAPI(title="Game of Claude API", lifespan=lifespan)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 ALLOWED_ORIGINS = [
     "https://gameofclaude.online",
@@ -61,6 +109,8 @@ ALLOWED_ORIGINS = [
     "https://game-of-claude.vercel.app",
     "http://localhost:3000",
 ]
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(DecompressionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
@@ -95,128 +145,369 @@ def require_device(device_id: str = Depends(get_device_id)) -> str:
     return device_id
 
 
+# Proxies in front of the app that append to X-Forwarded-For (Railway's edge
+# is one; gunicorn.conf.py sets that). The client is the entry this many hops
+# from the right: anything further left was sent by the client and can be forged.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+
+# A per-IP bucket this many times the per-device rate backs up every device
+# limit: the device key is the unverified bearer token, so one client cycling
+# tokens would otherwise get a fresh bucket per request.
+DEVICES_PER_IP = int(os.environ.get("RATELIMIT_DEVICES_PER_IP", "20"))
+
+
+def client_ip(request: Request) -> str:
+    if TRUSTED_PROXY_HOPS:
+        hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+
+def device_limit(name: str, spec: str):
+    """
+    Per-device token bucket for authenticated routes, behind a coarse per-IP
+    one (DEVICES_PER_IP); both are checked before any DB call.
+    """
+    by_ip = ratelimit.rate_limit(f"{name}-ip", ratelimit.scale(spec, DEVICES_PER_IP), key=client_ip)
+    by_device = ratelimit.rate_limit(name, spec, key=get_device_id)
+
+    def check(_ip: None = Depends(by_ip), _device: None = Depends(by_device)) -> None:
+        pass
+
+    return Depends(check)
+
+
+def ip_limit(name: str, spec: str):
+    """Per-client-IP token bucket for unauthenticated routes."""
+    return Depends(ratelimit.rate_limit(name, spec, key=client_ip))
+
+
+def lock_device(device_id: str = Depends(require_device)):
+    """require_device, plus the device's lock for the whole request (see app/locks.py)."""
+    with device_lock(get_client(), device_id):
+        yield device_id
+
+
 # ── Register ──────────────────────────────────────────────────────────────────
 
-@app.post("/api/devices", status_code=201)
-@limiter.limit("10/minute")
+@app.post("/api/devices", status_code=201, dependencies=[ip_limit("register", "10/minute")])
 def register_device(request: Request, body: DeviceRegister):
     db = get_client()
     if get_device(db, body.device_id):
         return {"status": "already_registered"}
     db.table("devices").insert({"device_id": body.device_id, "character_name": body.character_name}).execute()
-    upsert_stats(db, body.device_id, {"total_xp": 25})
-    award_xp(db, body.device_id, "install", 25)
+    award_xp(db, body.device_id, "install", 25)   # xp_log trigger creates user_stats
     logger.info("Device registered: %s (%s)", body.device_id[:8], body.character_name)
     return {"status": "registered", "xp_awarded": 25}
 
 
 # ── Ingest events ─────────────────────────────────────────────────────────────
 
-@app.post("/api/events", status_code=200)
-@limiter.limit("60/minute")
-def ingest_event(request: Request, body: HookEvent, device_id: str = Depends(require_device)):
-    db = get_client()
+def accept_device(device_id: str = Depends(get_device_id)) -> str:
+    """
+    require_device for ingest. While the DB is unreachable the device can't be
+    looked up, so events from devices this process has already seen are
+    accepted and checked again on replay; unknown tokens get 503.
+    """
+    if breaker.state == "open":
+        return _accept_unverified(device_id)
+    try:
+        require_device(device_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        if not is_transient(e):
+            raise
+        breaker.record_failure()
+        return _accept_unverified(device_id)
+    known_devices.put(device_id, True)
+    return device_id
 
-    # tool_use_id is unique per tool call; fall back to session_id only for
-    # session-level events (SessionStart/SessionEnd) which have no tool_use_id.
-    tool_use_id = body.tool_use_id or body.session_id or "unknown"
-    source_key = make_source_key(body.session_id or "no-session", f"{body.hook_event_name}:{tool_use_id}")
-    if is_already_processed(db, source_key):
-        return {"status": "duplicate"}
 
-    log_raw_event(db, device_id, body.session_id, body.hook_event_name, body.model_dump())
+def _accept_unverified(device_id: str) -> str:
+    if not known_devices.get(device_id):
+        raise HTTPException(status_code=503, detail="DB unavailable",
+                            headers={"Retry-After": str(round(breaker.reset_after))})
+    return device_id
 
-    stats = get_stats(db, device_id)
-    today = date.today()
-    quest_progress = get_quest_progress(db, device_id)
-    completions: list[dict] = []
 
-    # One-time first-session bonus
-    if body.hook_event_name == "SessionStart" and stats.get("total_sessions", 0) == 0:
-        award_xp(db, device_id, "first_session", 10)
-        upsert_stats(db, device_id, {"total_xp": (stats.get("total_xp") or 0) + 10})
-        stats = get_stats(db, device_id)
+async def read_hook_event(request: Request) -> HookEvent:
+    """
+    The request body as a HookEvent, read in place of FastAPI's body handling
+    so it can be bounded: anything over MAX_EVENT_BYTES is refused with 413
+    before it is parsed, and validation clips long command output.
+    """
+    if int(request.headers.get("content-length") or 0) > MAX_EVENT_BYTES:
+        raise HTTPException(status_code=413, detail="Event too large")
+    raw = bytearray()
+    async for chunk in request.stream():
+        raw += chunk
+        if len(raw) > MAX_EVENT_BYTES:
+            raise HTTPException(status_code=413, detail="Event too large")
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body",), "msg": f"JSON decode error: {e}"}])
+    try:
+        return HookEvent.model_validate(data)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)])
 
-    # ── Raw stat capture: file extensions from Edit/Write ─────────────────────
-    if body.hook_event_name == "PostToolUse" and body.tool_name in ("Edit", "Write"):
-        try:
-            _track_file_extension(db, device_id, stats, body.tool_input or {})
-            stats = get_stats(db, device_id)  # refresh after potential extension update
-        except Exception as e:
-            logger.warning("Could not track file extension for %s: %s", device_id[:8], e)
 
-    xp_amount, xp_source = compute_xp(body.model_dump())
+@app.post("/api/events", status_code=200, dependencies=[device_limit("events", "60/minute")])
+def ingest_event(request: Request, body: HookEvent = Depends(read_hook_event),
+                 device_id: str = Depends(accept_device)):
+    event = body.model_dump()
+
+    # Queue behind the device's spooled events so they stay in order.
+    if spool.has_pending(device_id) or not breaker.allow():
+        return _spool_event(device_id, event)
+
+    progress: dict[str, bool] = {}
+    try:
+        result = _process_event(get_client(), device_id, body, event, progress)
+    except DeviceBusy:
+        # Already stored, just not scored yet: let the replayer finish it
+        # rather than have the hook's retry bounce off the dedup key.
+        breaker.release()
+        return _spool_event(device_id, event, progress)
+    except Exception as e:
+        if not is_transient(e):
+            breaker.release()
+            raise
+        breaker.record_failure()
+        logger.warning("DB unavailable, spooling %s for %s...: %s", body.hook_event_name, device_id[:8], e)
+        return _spool_event(device_id, event, progress)
+    breaker.record_success()
+    return result
+
+
+def _spool_event(device_id: str, event: dict, progress: dict | None = None) -> JSONResponse:
+    if not spool.append(device_id, event, progress):
+        raise HTTPException(status_code=503, detail="DB unavailable and event spool is full")
+    return JSONResponse(status_code=202, content={"status": "spooled"})
+
+
+def _replay_spooled_event(device_id: str, event: dict, progress: dict) -> None:
+    db = get_client()
+    if not get_device(db, device_id):
+        logger.warning("Dropping spooled %s for unregistered device %s...",
+                       event.get("hook_event_name"), device_id[:8])
+        return
+    body = HookEvent.model_validate(event)
+    _process_event(db, device_id, body, event, progress)
+
+
+def _process_event(db, device_id: str, body: HookEvent, event: dict, progress: dict[str, bool]) -> dict:
+    """
+    Dedup, store and score one hook event. `progress` records the steps that
+    have completed ("claimed" the dedup key, "logged" the raw event, then each
+    XP award and stats write made while scoring), so a replay after a
+    mid-request failure resumes after them instead of mistaking its own
+    earlier claim for a duplicate or awarding the same XP twice.
+    """
+    if not progress.get("claimed"):
+        # tool_use_id is unique per tool call; fall back to session_id only for
+        # session-level events (SessionStart/SessionEnd) which have no tool_use_id.
+        tool_use_id = body.tool_use_id or body.session_id or "unknown"
+        source_key = make_source_key(body.session_id or "no-session", f"{body.hook_event_name}:{tool_use_id}")
+        if is_already_processed(db, source_key):
+            return {"status": "duplicate"}
+        progress["claimed"] = True
+
+    if not progress.get("logged"):
+        log_raw_event(db, device_id, body.session_id, body.hook_event_name, event)
+        progress["logged"] = True
+
+    # Dispatch on event type so each hook only does the DB work it can affect.
+    # Most traffic is Edit/Write and non-scoring Bash, which stop after the insert above.
+    if body.hook_event_name == "PostToolUse":
+        if body.tool_name in ("Edit", "Write"):
+            return _ingest_file_edit(db, device_id, body, progress)
+        if body.tool_name == "Bash":
+            return _ingest_bash(db, device_id, body, event, progress)
+    elif body.hook_event_name == "SessionStart":
+        with device_lock(db, device_id):
+            return _ingest_session_start(db, device_id, body, progress)
+    elif body.hook_event_name == "SessionEnd":
+        with device_lock(db, device_id):
+            return _ingest_session_end(db, device_id, body, progress)
+    return _ingest_result()
+
+
+def _ingest_result(xp_amount: int = 0, completions: list[dict] | None = None) -> dict:
+    return {"status": "ok", "xp_awarded": xp_amount, "quest_completions": completions or []}
+
+
+def _ingest_file_edit(db, device_id: str, body: HookEvent, progress: dict[str, bool]) -> dict:
+    """Edit/Write never earn XP; only a first-seen file extension touches user_stats."""
+    ext = extract_file_extension((body.tool_input or {}).get("file_path", ""))
+    if not ext or known_extensions.get((device_id, ext)):
+        return _ingest_result()
+    try:
+        unique_count = _track_file_extensions(db, device_id, [ext])
+    except Exception as e:
+        logger.warning("Could not track file extension for %s: %s", device_id[:8], e)
+        return _ingest_result()
+
+    # Polyglot only needs the count the set-add returned; skip the quest lookup
+    # entirely until the device is actually within reach of the goal.
+    if not any(unique_count >= q.goal for q in quests_to_check_for_event("file_extension")):
+        return _ingest_result()
+    stats = {**get_stats(db, device_id), "unique_extensions": unique_count}
+    xp_before = stats.get("total_xp") or 0
+    completions = _check_quests(db, device_id, stats, get_quest_progress(db, device_id),
+                                "file_extension", date.today(), progress)
+    _publish_progress(device_id, "file_extension", xp_before, stats.get("total_xp") or 0, completions)
+    return _ingest_result(0, completions)
+
+
+def _ingest_bash(db, device_id: str, body: HookEvent, event: dict, progress: dict[str, bool]) -> dict:
+    xp_amount, xp_source = compute_xp(event)
+    if not xp_source:
+        return _ingest_result()   # not a commit/test/PR/branch command: nothing to score
+    with device_lock(db, device_id):
+        return _score_bash(db, device_id, body, xp_amount, xp_source, progress)
+
+
+def _score_bash(db, device_id: str, body: HookEvent, xp_amount: int, xp_source: str,
+                progress: dict[str, bool]) -> dict:
+    """Award a scoring Bash command. Runs under the device lock: reads then writes stats."""
+    stats = get_stats(db, device_id)
+    xp_before = stats.get("total_xp") or 0
+    today = date.today()
+    quest_progress = get_quest_progress(db, device_id)
 
     # Cap daily commit XP but keep xp_source so stat counters still update
     if xp_source == "commit":
         if _count_today_commits(db, device_id) >= 10:
             xp_amount = 0
 
-    # Award XP first — stat counter updates are secondary and must not block it
-    if xp_amount > 0:
+    # Award XP first — stat counter updates are secondary and must not block it.
+    # user_stats.total_xp and level follow xp_log via a DB trigger (migration 006).
+    # Steps already in `progress` were written by an earlier attempt at this
+    # event and are already in the stats read above.
+    if xp_amount > 0 and not progress.get("xp"):
         award_xp(db, device_id, xp_source, xp_amount)
-        new_total_xp = (stats.get("total_xp") or 0) + xp_amount
-        upsert_stats(db, device_id, {"total_xp": new_total_xp})
-        stats["total_xp"] = new_total_xp
+        progress["xp"] = True
+        stats["total_xp"] = xp_before + xp_amount
 
     # Update stat counters — wrapped so a missing column can't block XP above
-    if xp_source:
+    if not progress.get("totals"):
         try:
             stats = _update_running_totals(db, device_id, stats, xp_source)
         except Exception as e:
             logger.error("Could not update running totals for %s/%s: %s", device_id[:8], xp_source, e)
+        progress["totals"] = True
 
-    if xp_source:
-        completions += _check_quests(db, device_id, stats, quest_progress, xp_source, today)
-        quest_progress = get_quest_progress(db, device_id)
+    completions = _check_quests(db, device_id, stats, quest_progress, xp_source, today, progress)
 
     # ── Raw stat capture: commit insertions from git output ───────────────────
-    if xp_source == "commit":
+    if xp_source == "commit" and not progress.get("insertions"):
         try:
             _track_commit_insertions(db, device_id, stats, body.tool_response or {})
         except Exception as e:
             logger.warning("Could not track commit insertions for %s: %s", device_id[:8], e)
-
-    if body.hook_event_name == "SessionEnd":
-        completions += _handle_session_end(db, device_id, stats, body, today, quest_progress)
-
-    fresh_stats = get_stats(db, device_id)
-    new_level = compute_level(fresh_stats.get("total_xp", 0))
-    if new_level != fresh_stats.get("level", 0):
-        upsert_stats(db, device_id, {"level": new_level})
+        progress["insertions"] = True
 
     if xp_amount > 0 or completions:
         logger.info("Event %s for %s...: +%d XP, %d quests",
                     body.hook_event_name, device_id[:8], xp_amount, len(completions))
+    # stats["total_xp"] was kept current by the awards above, so no re-read is needed
+    _publish_progress(device_id, xp_source, xp_before, stats.get("total_xp") or 0, completions)
+    return _ingest_result(xp_amount, completions)
 
-    return {"status": "ok", "xp_awarded": xp_amount, "quest_completions": completions}
+
+def _ingest_session_start(db, device_id: str, body: HookEvent, progress: dict[str, bool]) -> dict:
+    if body.session_id:
+        start_session(db, device_id, body.session_id)
+
+    # One-time first-session bonus
+    stats = get_stats(db, device_id)
+    if stats.get("total_sessions", 0) == 0 and not progress.get("first_session"):
+        xp_before = stats.get("total_xp") or 0
+        award_xp(db, device_id, "first_session", 10)
+        progress["first_session"] = True
+        _publish_progress(device_id, "first_session", xp_before, xp_before + 10, [])
+    return _ingest_result()
+
+
+def _ingest_session_end(db, device_id: str, body: HookEvent, progress: dict[str, bool]) -> dict:
+    stats = get_stats(db, device_id)
+    xp_before = stats.get("total_xp") or 0
+    completions = _handle_session_end(db, device_id, stats, body, date.today(),
+                                      get_quest_progress(db, device_id), progress)
+
+    if completions:
+        logger.info("Event %s for %s...: %d quests", body.hook_event_name, device_id[:8], len(completions))
+    # Streak and session bonuses are awarded inside _handle_session_end; SessionEnd
+    # is once per session, so re-reading the total is cheap enough here.
+    _publish_progress(device_id, "SessionEnd", xp_before,
+                      get_stats(db, device_id).get("total_xp") or 0, completions)
+    return _ingest_result(0, completions)
 
 
 # ── Profile ───────────────────────────────────────────────────────────────────
 
 @app.get("/api/profile/{profile_device_id}")
-def get_profile(profile_device_id: str):
-    db = get_client()
-    device = get_device(db, profile_device_id)
+async def get_profile(
+    profile_device_id: str,
+    response: Response,
+    if_none_match: str | None = Header(None),
+):
+    """
+    Serve a device's profile with a version-based ETag.
+
+    The version is bumped by every write to the device's XP, stats or quests,
+    so a matching If-None-Match is answered with 304 without a DB round-trip,
+    and a repeat poll after a miss is served from the render cache.
+    """
+    today = date.today()
+    version = get_version(profile_device_id)
+    etag = make_etag(version, today.isoformat())
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    cache_key = (profile_device_id, version, today)
+    profile = profile_cache.get(cache_key)
+    if profile is None:
+        profile = await _render_profile(get_client(), profile_device_id, today)
+        profile_cache.put(cache_key, profile)
+
+    response.headers.update(headers)
+    return profile
+
+
+async def _render_profile(db, profile_device_id: str, today: date) -> dict:
+    # All five reads are independent: the device check is made on the results
+    # rather than up front, so a render costs one round-trip, not five.
+    device, stats, quest_progress, commits_today, sessions_today = await _gather_reads(
+        (get_device, db, profile_device_id),
+        (get_stats, db, profile_device_id),
+        (get_quest_progress, db, profile_device_id),
+        (count_today_xp_source, db, profile_device_id, "commit"),
+        (get_today_session_count, db, profile_device_id),
+    )
     if not device:
         raise HTTPException(status_code=404, detail="Profile not found")
+    return _profile_payload(device, stats, quest_progress, commits_today, sessions_today, today)
 
-    stats = get_stats(db, profile_device_id)
-    quest_progress = get_quest_progress(db, profile_device_id)
-    today = date.today()
 
+def _profile_payload(device: dict, stats: dict, quest_progress: dict, commits_today: int,
+                     sessions_today: int, today: date) -> dict:
+    """The profile response, from rows already fetched (shared by single and batch reads)."""
     total_xp = stats.get("total_xp", 0)
-    level = compute_level(total_xp)
-    current_level_xp = xp_for_level(level)
-    next_level_xp = xp_for_level(level + 1)
+    progress = level_progress(total_xp)
 
     return {
         "character_name": device.get("character_name", "Anonymous"),
-        "level": level,
-        "level_title": level_title(level),
+        "level": progress.level,
+        "level_title": progress.title,
         "total_xp": total_xp,
-        "xp_in_level": total_xp - current_level_xp,
-        "xp_to_next_level": next_level_xp - current_level_xp,
+        "xp_in_level": progress.xp_in_level,
+        "xp_to_next_level": progress.xp_to_next,
         "current_streak": stats.get("current_streak", 0),
         "longest_streak": stats.get("longest_streak", 0),
         # career stats
@@ -230,146 +521,351 @@ def get_profile(profile_device_id: str):
         "total_session_minutes": stats.get("total_session_minutes", 0),
         "unique_extensions": len(stats.get("file_extensions") or []),
         # today
-        "commits_today": count_today_xp_source(db, profile_device_id, "commit"),
-        "sessions_today": get_today_session_count(db, profile_device_id),
+        "commits_today": commits_today,
+        "sessions_today": sessions_today,
         "quests": _build_quest_states(stats, quest_progress, today),
         "member_since": device.get("created_at", ""),
     }
 
 
+@app.post("/api/profiles:batch", dependencies=[ip_limit("profiles-batch", "60/minute")])
+async def get_profiles_batch(body: ProfileBatch):
+    """
+    The get_profile payload for many devices at once, for team dashboards.
+
+    Cached renders are reused; the rest come from four set-based reads
+    whatever the team size. Unknown ids are listed under not_found.
+    """
+    today = date.today()
+    versions = {device_id: get_version(device_id) for device_id in body.device_ids}
+    profiles: dict[str, dict] = {}
+    for device_id, version in versions.items():
+        cached = profile_cache.get((device_id, version, today))
+        if cached is not None:
+            profiles[device_id] = cached
+
+    misses = [device_id for device_id in body.device_ids if device_id not in profiles]
+    if misses:
+        db = get_client()
+        devices, stats, progress, counts = await _gather_reads(
+            (get_device_batch, db, misses),
+            (get_stats_batch, db, misses),
+            (get_quest_progress_batch, db, misses),
+            (get_today_counts_batch, db, misses),
+        )
+        for device_id in misses:
+            device = devices.get(device_id)
+            if not device:
+                continue
+            commits_today, sessions_today = counts.get(device_id, (0, 0))
+            profile = _profile_payload(device, stats.get(device_id, {}), progress.get(device_id, {}),
+                                       commits_today, sessions_today, today)
+            profile_cache.put((device_id, versions[device_id], today), profile)
+            profiles[device_id] = profile
+
+    return {
+        "profiles": {device_id: profiles[device_id] for device_id in body.device_ids if device_id in profiles},
+        "not_found": [device_id for device_id in body.device_ids if device_id not in profiles],
+    }
+
+
 @app.patch("/api/profile/{profile_device_id}")
 def update_profile(profile_device_id: str, body: ProfilePatch, device_id: str = Depends(require_device)):
     if device_id != profile_device_id:
         raise HTTPException(status_code=403, detail="Cannot edit another device's profile")
     db = get_client()
     db.table("devices").update({"character_name": body.character_name}).eq("device_id", device_id).execute()
+    bump_version(device_id)
     return {"status": "updated"}
 
 
-# ── Activity heatmap ──────────────────────────────────────────────────────────
+# ── Live updates ──────────────────────────────────────────────────────────────
 
-@app.get("/api/activity/{profile_device_id}")
-def get_activity(profile_device_id: str):
-    """Return daily XP event counts for the past 365 days (for activity heatmap)."""
-    db = get_client()
-    if not get_device(db, profile_device_id):
+SSE_KEEPALIVE_SECONDS = 15
+
+
+@app.get("/api/profile/{profile_device_id}/stream")
+async def stream_profile(request: Request, profile_device_id: str):
+    """
+    Server-sent events for a device: `xp`, `level_up` and `quest_complete`,
+    pushed as ingest_event and sync_session persist them. A comment line is
+    sent every SSE_KEEPALIVE_SECONDS so idle proxies keep the connection open.
+    """
+    if not await run_in_threadpool(get_device, get_client(), profile_device_id):
         raise HTTPException(status_code=404, detail="Profile not found")
 
-    from datetime import timedelta
-    since = (datetime.utcnow() - timedelta(days=365)).date().isoformat()
-    rows = (
-        db.table("xp_log")
-        .select("created_at")
-        .eq("device_id", profile_device_id)
-        .gte("created_at", since)
-        .execute()
-    )
+    subscription = broker.subscribe(profile_device_id)
 
-    counts: dict[str, int] = {}
-    for row in rows.data:
-        day = row["created_at"][:10]
-        counts[day] = counts.get(day, 0) + 1
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event, data = await asyncio.wait_for(subscription.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event, data)
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    return {"activity": counts}
 
+# ── Activity heatmap ──────────────────────────────────────────────────────────
 
-# ── Coding stats ───────────────────────────────────────────────────────────────
+ACTIVITY_DEFAULT_DAYS = 365
+ACTIVITY_MAX_DAYS = 5 * 366
 
-@app.get("/api/stats/{profile_device_id}")
-@limiter.limit("30/minute")
-def get_coding_stats(request: Request, profile_device_id: str):
-    """Aggregate raw hook events into top projects, tool usage, and peak coding hour."""
-    db = get_client()
-    if not get_device(db, profile_device_id):
-        raise HTTPException(status_code=404, detail="Profile not found")
 
-    rows = get_recent_events(db, profile_device_id, days=30)
+@app.get("/api/activity/{profile_device_id}")
+async def get_activity(
+    profile_device_id: str,
+    start: date | None = Query(None, alias="from"),
+    end: date | None = Query(None, alias="to"),
+    year: int | None = Query(None, ge=2000, le=2100),
+    by_source: bool = False,
+):
+    """
+    Daily xp_log entry counts for the activity heatmap, by UTC day.
 
-    projects: dict[str, int] = {}
-    tools: dict[str, int] = {}
-    hours: dict[int, int] = {}
+    The range is `year`, or `from`/`to` (default: the ACTIVITY_DEFAULT_DAYS
+    ending today). `counts[i]` is day `from` + i, zeros included; with
+    `by_source` the same array is returned per source. Days before today are
+    cached per device for the rest of the day, so a repeat request only
+    reads today's bucket.
+    """
+    today = datetime.now(timezone.utc).date()
+    start, end = _activity_range(start, end, year, today)
+    history_end = min(end, today - timedelta(days=1))
+    db = get_client()
 
-    for row in rows:
-        data = row.get("data") or {}
-        received_at = row.get("received_at", "")
+    cache_key = (profile_device_id, start, history_end, today)
+    history = activity_cache.get(cache_key)
+    calls = {}
+    if history is None:
+        calls["device"] = (get_device, db, profile_device_id)
+        if history_end >= start:
+            calls["history"] = (get_activity_series, db, profile_device_id, start, history_end)
+    if start <= today <= end:
+        calls["today"] = (get_activity_day, db, profile_device_id, today)
+    results = dict(zip(calls, await _gather_reads(*calls.values())))
+    if history is None:
+        if not results["device"]:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        history = results.get("history", {})
+        activity_cache.put(cache_key, history)
+
+    days = (end - start).days + 1
+    per_source = {src: counts + [0] * (days - len(counts)) for src, counts in history.items()}
+    for src, n in results.get("today", {}).items():
+        per_source.setdefault(src, [0] * days)[(today - start).days] = n
+
+    payload = {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "counts": [sum(day) for day in zip(*per_source.values())] if per_source else [0] * days,
+    }
+    if by_source:
+        payload["by_source"] = per_source
+    return payload
+
+
+def _activity_range(start: date | None, end: date | None, year: int | None,
+                    today: date) -> tuple[date, date]:
+    if year is not None:
+        if start or end:
+            raise HTTPException(status_code=400, detail="Pass either year or from/to, not both")
+        return date(year, 1, 1), date(year, 12, 31)
+    end = end or today
+    start = start or end - timedelta(days=ACTIVITY_DEFAULT_DAYS - 1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    if (end - start).days >= ACTIVITY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {ACTIVITY_MAX_DAYS} days")
+    return start, end
 
-        cwd = data.get("cwd")
-        if cwd:
-            parts = [p for p in cwd.split("/") if p]
-            if parts:
-                project = parts[-1]
-                projects[project] = projects.get(project, 0) + 1
 
-        tool = data.get("tool_name")
-        if tool:
-            tools[tool] = tools.get(tool, 0) + 1
+# ── Coding stats ───────────────────────────────────────────────────────────────
 
-        if len(received_at) >= 13:
-            hour = int(received_at[11:13])
-            hours[hour] = hours.get(hour, 0) + 1
+@app.get("/api/stats/{profile_device_id}", dependencies=[ip_limit("coding-stats", "30/minute")])
+async def get_coding_stats(request: Request, profile_device_id: str):
+    """
+    Top projects, tool usage and peak coding hour (UTC) over the last 30 days,
+    merged from the per-day counters the events trigger keeps (migration 013).
+    """
+    db = get_client()
+    device, days = await _gather_reads(
+        (get_device, db, profile_device_id),
+        (get_coding_stats_days, db, profile_device_id),
+    )
+    if not device:
+        raise HTTPException(status_code=404, detail="Profile not found")
 
-    top_projects = sorted(projects.items(), key=lambda x: x[1], reverse=True)[:5]
-    top_tools = sorted(tools.items(), key=lambda x: x[1], reverse=True)[:5]
-    peak_hour = max(hours, key=hours.get) if hours else None
+    projects: Counter[str] = Counter()
+    tools: Counter[str] = Counter()
+    hours = [0] * 24
+    for day in days:
+        projects.update(day.get("projects") or {})
+        tools.update(day.get("tools") or {})
+        for hour, count in enumerate(day.get("hours") or []):
+            hours[hour] += count
 
     return {
-        "top_projects": [{"name": k, "count": v} for k, v in top_projects],
-        "tool_usage": [{"tool": k, "count": v} for k, v in top_tools],
-        "peak_hour": peak_hour,
+        "top_projects": [{"name": k, "count": v} for k, v in projects.most_common(5)],
+        "tool_usage": [{"tool": k, "count": v} for k, v in tools.most_common(5)],
+        "peak_hour": max(range(24), key=hours.__getitem__) if any(hours) else None,
     }
 
 
 # ── Leaderboard ───────────────────────────────────────────────────────────────
 
+LEADERBOARD_CACHE_SECONDS = float(os.environ.get("LEADERBOARD_CACHE_SECONDS", "30"))   # 0: no cache
+
+
 @app.get("/api/leaderboard")
-def get_leaderboard():
-    """Return top 20 players by total XP. Respects show_on_leaderboard opt-out."""
-    db = get_client()
-    stats_rows = (
-        db.table("user_stats")
-        .select("device_id, total_xp, level, current_streak")
-        .order("total_xp", desc=True)
-        .limit(50)
-        .execute()
-    )
-    if not stats_rows.data:
-        return {"leaderboard": []}
-
-    device_ids = [r["device_id"] for r in stats_rows.data]
-    devices_rows = (
-        db.table("devices")
-        .select("device_id, character_name, show_on_leaderboard")
-        .in_("device_id", device_ids)
-        .execute()
-    )
-    device_map = {r["device_id"]: r for r in (devices_rows.data or [])}
+def get_leaderboard(
+    period: Literal["all", "day", "week", "month"] = "all",
+    limit: int = Query(20, ge=1, le=100),
+    after: str | None = None,
+):
+    """
+    Players ranked by lifetime XP, or by XP earned this day/week/month (UTC;
+    weeks start Monday). Respects show_on_leaderboard opt-out.
 
-    result = []
-    for row in stats_rows.data:
-        dev = device_map.get(row["device_id"])
-        if not dev:
-            continue
-        if not dev.get("show_on_leaderboard", True):
-            continue
-        result.append({
+    Pages are `limit` long; pass a page's next_cursor as `after` for the next.
+    Period ranks read the per-period buckets kept by the xp_log trigger
+    (migration 012), never xp_log itself.
+    """
+    cursor = _parse_leaderboard_cursor(after)
+    start = period_start(period, datetime.now(timezone.utc).date()) if period != "all" else None
+    cached = LEADERBOARD_CACHE_SECONDS > 0
+    if cached:
+        cache_key = (period, start, after, limit, int(time.time() // LEADERBOARD_CACHE_SECONDS))
+    page = leaderboard_cache.get(cache_key) if cached else None
+    if page is None:
+        rows = get_leaderboard_page(get_client(), period, start, limit, cursor)
+        page = {
+            "period": period,
+            "period_start": start.isoformat() if start else None,
+            "leaderboard": _leaderboard_entries(rows),
+            "next_cursor": f"{rows[-1]['score']}:{rows[-1]['device_id']}" if len(rows) == limit else None,
+        }
+        if cached:
+            leaderboard_cache.put(cache_key, page)
+    return page
+
+
+def _parse_leaderboard_cursor(after: str | None) -> tuple[int, str] | None:
+    if after is None:
+        return None
+    score, _, device_id = after.partition(":")
+    if not score.lstrip("-").isdigit() or not UUID4_RE.match(device_id):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return int(score), device_id
+
+
+def _leaderboard_entries(rows: list[dict]) -> list[dict]:
+    # Lifetime rows are user_stats rows; period rows embed user_stats under devices.
+    stats = [row if "total_xp" in row else _embedded_row(row["devices"].get("user_stats")) for row in rows]
+    progress = level_progress_many(s.get("total_xp") or 0 for s in stats)
+    return [
+        {
             "device_id": row["device_id"],
-            "character_name": dev["character_name"],
-            "total_xp": row.get("total_xp", 0),
-            "level": row.get("level", 0),
-            "level_title": level_title(row.get("level", 0)),
-            "current_streak": row.get("current_streak", 0),
-        })
-        if len(result) >= 20:
-            break
+            "character_name": row["devices"]["character_name"],
+            "xp": row["score"],
+            "total_xp": s.get("total_xp") or 0,
+            "level": prog.level,
+            "level_title": prog.title,
+            "current_streak": s.get("current_streak") or 0,
+        }
+        for row, s, prog in zip(rows, stats, progress)
+    ]
+
+
+# ── Teams ─────────────────────────────────────────────────────────────────────
+
+@app.post("/api/teams", status_code=201, dependencies=[device_limit("teams", "10/hour")])
+def create_team_route(body: TeamCreate, device_id: str = Depends(require_device)):
+    """Create a team with the caller as owner and first member."""
+    team_id = str(uuid.uuid4())
+    join_code = secrets.token_urlsafe(6)
+    create_team(get_client(), team_id, body.name, join_code, device_id)
+    logger.info("Team created: %s by %s...", team_id[:8], device_id[:8])
+    return {"team_id": team_id, "join_code": join_code}
+
+
+@app.post("/api/teams/{team_id}/members", dependencies=[device_limit("teams", "10/hour")])
+def join_team(team_id: str, body: TeamJoin, device_id: str = Depends(require_device)):
+    db = get_client()
+    team = get_team(db, team_id)
+    if not team:
+        raise HTTPException(status_code=404, detail="Team not found")
+    if not secrets.compare_digest(body.join_code, team["join_code"]):
+        raise HTTPException(status_code=403, detail="Wrong join code")
+    add_team_member(db, team_id, device_id)
+    return {"status": "joined"}
+
+
+@app.delete("/api/teams/{team_id}/members/me")
+def leave_team(team_id: str, device_id: str = Depends(require_device)):
+    if not remove_team_member(get_client(), team_id, device_id):
+        raise HTTPException(status_code=404, detail="Not a member of this team")
+    return {"status": "left"}
+
+
+@app.get("/api/teams/{team_id}")
+def get_team_route(team_id: str):
+    """A team's rollups, from its single precomputed team_stats row."""
+    team = get_team(get_client(), team_id)
+    if not team:
+        raise HTTPException(status_code=404, detail="Team not found")
+    return _team_payload(team["team_id"], team["name"], _embedded_row(team["team_stats"]), date.today())
+
+
+@app.get("/api/leaderboard/teams")
+def get_team_leaderboard_route():
+    """Top 20 teams by total XP."""
+    today = date.today()
+    return {"leaderboard": [
+        _team_payload(row["team_id"], row["teams"]["name"], row, today)
+        for row in get_team_leaderboard(get_client())
+    ]}
+
+
+def _embedded_row(value) -> dict:
+    # PostgREST embeds a one-to-one child as an object, older versions as a list.
+    if isinstance(value, list):
+        return value[0] if value else {}
+    return value or {}
+
 
-    return {"leaderboard": result}
+def _team_payload(team_id: str, name: str, stats: dict, today: date) -> dict:
+    # Activity is stored as of the team's last active day; age it to today.
+    last_active = stats.get("last_active_date")
+    active_today = last_active == today.isoformat()
+    streak_alive = active_today or last_active == (today - timedelta(days=1)).isoformat()
+    return {
+        "team_id": team_id,
+        "name": name,
+        "member_count": stats.get("member_count", 0),
+        "total_xp": stats.get("total_xp", 0),
+        "total_commits": stats.get("total_commits", 0),
+        "total_test_passes": stats.get("total_test_passes", 0),
+        "active_members_today": stats.get("active_members", 0) if active_today else 0,
+        "current_streak": stats.get("current_streak", 0) if streak_alive else 0,
+        "longest_streak": stats.get("longest_streak", 0),
+    }
 
 
 # ── Reprocess ─────────────────────────────────────────────────────────────────
 
-@app.post("/api/me/reprocess", status_code=200)
-@limiter.limit("10/hour")
-def reprocess_my_events(request: Request, device_id: str = Depends(require_device)):
+@app.post("/api/me/reprocess", status_code=200, dependencies=[device_limit("reprocess", "10/hour")])
+def reprocess_my_events(request: Request, device_id: str = Depends(lock_device)):
     """
     Replay all stored raw events through the XP engine to correct any gaps in
     xp_log and user_stats.  Safe to call multiple times — only inserts missing
@@ -384,22 +880,22 @@ def reprocess_my_events(request: Request, device_id: str = Depends(require_devic
     return {"status": "ok", **result}
 
 
-def _reprocess_events(db, device_id: str) -> dict:
+def _reprocess_events(db, device_id: str, dry_run: bool = False) -> dict:
     """
-    Core reprocess logic.  Returns {xp_added, entries_added, total_xp}.
+    Core reprocess logic.  Returns {xp_added, entries_added, total_xp, stats_diff}.
+
+    With dry_run, nothing is written: the result describes what a real run
+    would insert and how user_stats would change.
     """
     from collections import defaultdict
 
-    events = get_all_events(db, device_id)
-
     # ── Existing xp_log (count per source+day so we can compute the delta) ────
-    xp_rows = (
-        db.table("xp_log").select("source, amount, created_at")
-        .eq("device_id", device_id).execute().data or []
-    )
     # "install" was awarded at registration, not from an event — leave it alone
     existing: dict[tuple, int] = defaultdict(int)
-    for row in xp_rows:
+    xp_rows_read = logged_xp = 0
+    for row in iter_xp_log(db, device_id):
+        xp_rows_read += 1
+        logged_xp += row["amount"]
         if row["source"] != "install":
             existing[(row["source"], row["created_at"][:10])] += 1
 
@@ -412,30 +908,20 @@ def _reprocess_events(db, device_id: str) -> dict:
     stat_totals: dict[str, int] = defaultdict(int)
     total_insertions = 0
     file_exts: set[str] = set()
-    session_starts: dict[str, str] = {}   # session_id -> received_at ISO
-    total_session_minutes = 0
+    events_read = 0
+
+    # Session start / duration come from the sessions table (migration 007).
+    first_session_day, total_session_minutes = _session_history(db, device_id)
 
-    for ev in events:
+    for ev in iter_events(db, device_id):
+        events_read += 1
         etype = ev.get("event_type", "")
         data  = ev.get("data") or {}
         day   = ev["received_at"][:10]
-        sid   = data.get("session_id")
-
-        if etype == "SessionStart":
-            if sid:
-                session_starts[sid] = ev["received_at"]
-            continue
 
         if etype == "SessionEnd":
             session_days.append(day)
             stat_totals["total_sessions"] += 1
-            if sid and sid in session_starts:
-                try:
-                    t0 = datetime.fromisoformat(session_starts[sid].replace("Z", "+00:00"))
-                    t1 = datetime.fromisoformat(ev["received_at"].replace("Z", "+00:00"))
-                    total_session_minutes += min(int((t1 - t0).total_seconds() / 60), 480)
-                except Exception:
-                    pass
             continue
 
         if etype != "PostToolUse":
@@ -481,9 +967,8 @@ def _reprocess_events(db, device_id: str) -> dict:
             expected.append((xp_source, xp_amount, day))
 
     # First-session bonus (one-time, on the day of first SessionStart)
-    if session_starts:
-        first_day = sorted(session_starts.values())[0][:10]
-        expected.append(("first_session", 10, first_day))
+    if first_session_day:
+        expected.append(("first_session", 10, first_session_day))
 
     # Session-commit bonuses
     for day in sorted(set(session_days)):
@@ -512,14 +997,12 @@ def _reprocess_events(db, device_id: str) -> dict:
                 to_award.append((source, amount, day))
 
     # ── Insert missing entries ─────────────────────────────────────────────────
-    for source, amount, day in to_award:
-        award_xp_at(db, device_id, source, amount, f"{day}T12:00:00+00:00")
+    if not dry_run:
+        for source, amount, day in to_award:
+            award_xp_at(db, device_id, source, amount, f"{day}T12:00:00+00:00")
 
     # ── Rebuild user_stats ─────────────────────────────────────────────────────
-    total_xp = sum(
-        r["amount"] for r in
-        (db.table("xp_log").select("amount").eq("device_id", device_id).execute().data or [])
-    )
+    total_xp = logged_xp + sum(a for _, a, _ in to_award)
 
     # Streak from session days
     final_streak = longest = streak = 0
@@ -542,8 +1025,6 @@ def _reprocess_events(db, device_id: str) -> dict:
                         "current_streak", "longest_streak")
 
     new_stats: dict[str, Any] = {
-        "total_xp":          total_xp,
-        "level":             compute_level(total_xp),
         "total_commits":     stat_totals["total_commits"],
         "total_test_passes": stat_totals["total_test_passes"],
         "total_prs":         stat_totals["total_prs"],
@@ -560,13 +1041,26 @@ def _reprocess_events(db, device_id: str) -> dict:
 
     if session_days:
         new_stats["last_session_date"] = sorted(session_days)[-1]
-    if file_exts:
-        existing_exts = set(current_stats.get("file_extensions") or [])
-        new_stats["file_extensions"] = sorted(existing_exts | file_exts)
-    elif current_stats.get("file_extensions"):
-        new_stats["file_extensions"] = current_stats["file_extensions"]
-
-    upsert_stats(db, device_id, new_stats)
+    # file_extensions is set-added server-side (migration 008) rather than
+    # rewritten here; only the resulting count is diffed.
+    existing_exts = set(current_stats.get("file_extensions") or [])
+
+    # total_xp / level are written by the xp_log trigger, not here; they are
+    # only diffed so a dry run also surfaces drift between the two.
+    derived = {**new_stats, "total_xp": total_xp, "level": compute_level(total_xp)}
+    if not file_exts <= existing_exts:
+        derived["unique_extensions"] = len(existing_exts | file_exts)
+        current_stats = {**current_stats, "unique_extensions": len(existing_exts)}
+    stats_diff = {
+        field: [current_stats.get(field), value]
+        for field, value in derived.items()
+        if current_stats.get(field) != value
+    }
+    if not dry_run:
+        upsert_stats(db, device_id, new_stats)
+        if file_exts:
+            _track_file_extensions(db, device_id, file_exts)
+        activity_cache.discard_where(lambda key: key[0] == device_id)   # past days may have gained entries
 
     # Build diagnostic info
     existing_summary = {f"{s}@{d}": c for (s, d), c in sorted(existing.items()) if c > 0}
@@ -578,9 +1072,10 @@ def _reprocess_events(db, device_id: str) -> dict:
         "xp_added":     sum(a for _, a, _ in to_award),
         "entries_added": len(to_award),
         "total_xp":     total_xp,
+        "stats_diff":   stats_diff,
         "_debug": {
-            "xp_log_rows_read": len(xp_rows),
-            "events_read": len(events),
+            "xp_log_rows_read": xp_rows_read,
+            "events_read": events_read,
             "existing": dict(existing_summary),
             "expected": dict(expected_summary),
             "to_award": [{"source": s, "amount": a, "day": d} for s, a, d in to_award],
@@ -590,9 +1085,8 @@ def _reprocess_events(db, device_id: str) -> dict:
 
 # ── Git Sync ─────────────────────────────────────────────────────────────────
 
-@app.post("/api/me/sync-git", status_code=200)
-@limiter.limit("30/hour")
-def sync_git_stats(request: Request, body: GitSync, device_id: str = Depends(require_device)):
+@app.post("/api/me/sync-git", status_code=200, dependencies=[device_limit("sync-git", "30/hour")])
+def sync_git_stats(request: Request, body: GitSync, device_id: str = Depends(lock_device)):
     """
     Merge git/GitHub-derived stats with existing event-based stats.
     Uses max(current, submitted) for each field so stats only go up.
@@ -609,17 +1103,16 @@ def sync_git_stats(request: Request, body: GitSync, device_id: str = Depends(req
             current = stats.get(field) or 0
             updates[field] = max(current, submitted)
 
-    if body.file_extensions is not None:
-        existing = set(stats.get("file_extensions") or [])
-        merged = sorted(existing | set(body.file_extensions))
-        updates["file_extensions"] = merged
-
     if updates:
         upsert_stats(db, device_id, updates)
         logger.info("Git sync for %s...: updated %s", device_id[:8], list(updates.keys()))
 
     # Check quests that may now be completed with the updated stats
     merged_stats = {**stats, **updates}
+    updated_fields = list(updates.keys())
+    if body.file_extensions:
+        merged_stats["unique_extensions"] = _track_file_extensions(db, device_id, body.file_extensions)
+        updated_fields.append("file_extensions")
     quest_progress = get_quest_progress(db, device_id)
     today = date.today()
     completions: list[dict] = []
@@ -629,26 +1122,38 @@ def sync_git_stats(request: Request, body: GitSync, device_id: str = Depends(req
 
     return {
         "status": "ok",
-        "updated_fields": list(updates.keys()),
+        "updated_fields": updated_fields,
         "quest_completions": completions,
     }
 
 
 # ── Session Sync (transcript-based) ──────────────────────────────────────────
 
-@app.post("/api/me/sync-session", status_code=200)
-@limiter.limit("60/hour")
-def sync_session(request: Request, body: SessionSummary, device_id: str = Depends(require_device)):
+@app.post("/api/me/sync-session", status_code=200, dependencies=[device_limit("sync-session", "60/hour")])
+def sync_session(request: Request, body: SessionSummary, device_id: str = Depends(lock_device)):
     """
     Accept a session summary from the transcript parser (process_session.py).
     Deduplicates by session_id — safe to call multiple times for the same session.
     Updates user_stats and awards XP for the session.
+
+    A repeat for a processed session replays the first response, with
+    already_processed set, from the result cache or session_results. This
+    runs under the device lock, so a retry can't overtake the original.
     """
     db = get_client()
+    result_key = (device_id, body.session_id)
+    result = session_results.get(result_key)
+    if result is None:
+        result = get_session_result(db, device_id, body.session_id)
+        if result is not None:
+            session_results.put(result_key, result)
+    if result is not None:
+        return {**result, "already_processed": True}
 
     # Dedup by session_id: check if we've already processed this session
     source_key = make_source_key(body.session_id, "sync-session")
     if is_already_processed(db, source_key):
+        # Synced before results were stored: there is nothing to replay.
         return {"status": "ok", "already_processed": True}
 
     stats = get_stats(db, device_id)
@@ -679,12 +1184,6 @@ def sync_session(request: Request, body: SessionSummary, device_id: str = Depend
     if body.prs_merged > 0:
         updates["total_merged_prs"] = (stats.get("total_merged_prs") or 0) + body.prs_merged
 
-    # File extensions: union merge
-    if body.file_extensions:
-        existing_exts = set(stats.get("file_extensions") or [])
-        merged_exts = sorted(existing_exts | set(body.file_extensions))
-        updates["file_extensions"] = merged_exts
-
     # ── Streak ───────────────────────────────────────────────────────────
     session_date = today
     if body.ended_at:
@@ -704,8 +1203,21 @@ def sync_session(request: Request, body: SessionSummary, device_id: str = Depend
     updates["current_streak"] = new_streak
     updates["longest_streak"] = max(stats.get("longest_streak", 0), new_streak)
 
+    # ── Session row (merges with the one the hooks wrote, if any) ────────
+    # The hook's started_at is kept; body.started_at only fills a new row.
+    session_row: dict[str, Any] = {
+        "minutes": body.duration_minutes,
+        "commits": body.commits,
+        "test_passes": body.test_passes,
+    }
+    if body.started_at:
+        session_row["started_at"] = body.started_at
+    if body.ended_at:
+        session_row["ended_at"] = body.ended_at
+    upsert_session(db, device_id, body.session_id, session_row)
+
     # ── XP ───────────────────────────────────────────────────────────────
-    total_xp = stats.get("total_xp") or 0
+    total_xp = xp_before = stats.get("total_xp") or 0
 
     # Commit XP: 15 per commit, capped at 10 commits per day
     commit_xp = min(body.commits, 10) * 15
@@ -741,12 +1253,12 @@ def sync_session(request: Request, body: SessionSummary, device_id: str = Depend
         award_xp(db, device_id, "streak", streak_xp)
         total_xp += streak_xp
 
-    updates["total_xp"] = total_xp
-    updates["level"] = compute_level(total_xp)
     upsert_stats(db, device_id, updates)
 
     # ── Quest checking ───────────────────────────────────────────────────
-    merged_stats = {**stats, **updates}
+    merged_stats = {**stats, **updates, "total_xp": total_xp}
+    if body.file_extensions:
+        merged_stats["unique_extensions"] = _track_file_extensions(db, device_id, body.file_extensions)
     for source in ("commit", "test_pass", "pr", "branch", "session_commit",
                     "streak", "file_extension"):
         completions += _check_quests(
@@ -760,17 +1272,34 @@ def sync_session(request: Request, body: SessionSummary, device_id: str = Depend
         body.session_id[:8], device_id[:8], xp_awarded,
         body.commits, body.test_passes, body.prs_created, new_streak,
     )
+    _publish_progress(device_id, "sync_session", xp_before, merged_stats["total_xp"], completions)
 
-    return {
+    result = {
         "status": "ok",
-        "already_processed": False,
         "xp_awarded": xp_awarded,
         "quest_completions": completions,
+        "total_xp": merged_stats["total_xp"],
+        "level": compute_level(merged_stats["total_xp"]),
+        "current_streak": new_streak,
     }
+    # The XP is already awarded: a failed save only costs a bare replay later.
+    try:
+        save_session_result(db, device_id, body.session_id, result)
+    except Exception as e:
+        logger.warning("Could not store sync-session result %s for %s...: %s",
+                       body.session_id[:8], device_id[:8], e)
+    session_results.put(result_key, result)
+    return {**result, "already_processed": False}
 
 
 # ── Debug / Diagnostics ──────────────────────────────────────────────────────
 
+@app.get("/api/debug/spool")
+def debug_spool():
+    """Local event spool depth and replay counters, plus the DB circuit breaker state."""
+    return {"breaker": breaker.state, **spool.metrics()}
+
+
 @app.get("/api/debug/last-event/{profile_device_id}")
 def debug_last_event(profile_device_id: str):
     """Return the timestamp of the most recently received event for diagnostics."""
@@ -791,58 +1320,86 @@ def debug_last_event(profile_device_id: str):
 
 
 @app.get("/api/debug/event-count/{profile_device_id}")
-def debug_event_count(profile_device_id: str):
-    """Return event counts by type and day for the last 7 days."""
+async def debug_event_count(profile_device_id: str):
+    """Return event counts by type and day for the last 7 days, grouped in SQL."""
     db = get_client()
-    if not get_device(db, profile_device_id):
-        raise HTTPException(status_code=404, detail="Device not found")
-
-    from datetime import timedelta
     since = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
-    res = (
-        db.table("events")
-        .select("event_type, received_at")
-        .eq("device_id", profile_device_id)
-        .gte("received_at", since)
-        .execute()
+    device, groups = await _gather_reads(
+        (get_device, db, profile_device_id),
+        (get_event_counts, db, profile_device_id, since),
     )
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
 
     by_day: dict[str, dict[str, int]] = {}
-    total = 0
-    for row in (res.data or []):
-        day = row["received_at"][:10]
-        etype = row["event_type"]
-        by_day.setdefault(day, {})
-        by_day[day][etype] = by_day[day].get(etype, 0) + 1
-        total += 1
-
-    return {"total_events": total, "by_day": by_day}
+    for g in groups:
+        by_day.setdefault(g["day"], {})[g["event_type"]] = g["events"]
+    return {
+        "total_events": sum(g["events"] for g in groups),
+        "by_day": by_day,
+        "first_event_at": min((g["first_at"] for g in groups), default=None),
+        "last_event_at": max((g["last_at"] for g in groups), default=None),
+    }
 
 
 @app.get("/api/debug/xp-log/{profile_device_id}")
-def debug_xp_log(profile_device_id: str):
-    """Return xp_log entries for debugging reprocess idempotency."""
+async def debug_xp_log(
+    profile_device_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    after: str | None = None,
+):
+    """
+    xp_log for debugging reprocess idempotency: totals and a per-source,
+    per-day summary grouped in SQL, plus one keyset page of raw entries.
+    Pass next_cursor as `after` for the next page.
+    """
+    cursor = _parse_log_cursor(after)
     db = get_client()
-    if not get_device(db, profile_device_id):
-        raise HTTPException(status_code=404, detail="Device not found")
-    rows = (
-        db.table("xp_log")
-        .select("source, amount, created_at")
-        .eq("device_id", profile_device_id)
-        .order("created_at")
-        .execute()
-        .data or []
+    device, groups, page = await _gather_reads(
+        (get_device, db, profile_device_id),
+        (get_xp_summary, db, profile_device_id),
+        (_xp_log_page, db, profile_device_id, limit, cursor),
     )
-    summary: dict[str, int] = {}
-    for r in rows:
-        key = f"{r['source']}@{r['created_at'][:10]}"
-        summary[key] = summary.get(key, 0) + 1
-    return {"total_entries": len(rows), "entries": rows, "summary": summary}
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    entries = page[:limit]
+    return {
+        "total_entries": sum(g["entries"] for g in groups),
+        "total_xp": sum(g["xp"] for g in groups),
+        "summary": {f"{g['source']}@{g['day']}": g["entries"] for g in groups},
+        "entries": entries,
+        "next_cursor": _log_cursor(entries[-1]) if len(page) > limit else None,
+    }
+
+
+def _xp_log_page(db, device_id: str, limit: int, after: tuple[str, str] | None) -> list[dict]:
+    """Up to limit + 1 entries after the cursor; the extra one only signals another page."""
+    return list(islice(iter_xp_log(db, device_id, page_size=limit + 1, after=after), limit + 1))
+
 
+def _log_cursor(row: dict) -> str:
+    """Opaque, URL-safe "created_at|id": a raw timestamp's "+00:00" would arrive as a space."""
+    raw = f"{row['created_at']}|{row['id']}".encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
 
-@app.post("/api/me/cleanup-xp", status_code=200)
-@limiter.limit("5/hour")
-def cleanup_xp_duplicates(request: Request, device_id: str = Depends(require_device)):
+
+def _parse_log_cursor(after: str | None) -> tuple[str, str] | None:
+    if after is None:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(after + "=" * (-len(after) % 4)).decode()
+        created_at, _, row_id = raw.rpartition("|")
+        datetime.fromisoformat(created_at)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not UUID4_RE.match(row_id):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, row_id
+
+
+@app.post("/api/me/cleanup-xp", status_code=200, dependencies=[device_limit("cleanup-xp", "5/hour")])
+def cleanup_xp_duplicates(request: Request, device_id: str = Depends(lock_device)):
     """
     Remove duplicate xp_log entries caused by the -0 slice bug in reprocess.
     Keeps the correct number of entries per (source, day) based on event replay,
@@ -851,24 +1408,18 @@ def cleanup_xp_duplicates(request: Request, device_id: str = Depends(require_dev
     from collections import defaultdict
 
     db = get_client()
-    events = get_all_events(db, device_id)
 
     # Replay events to get expected counts (same logic as _reprocess_events)
     expected_counts: dict[tuple, int] = defaultdict(int)
     commit_per_day: dict[str, int] = defaultdict(int)
     session_days: list[str] = []
-    session_starts: dict[str, str] = {}
+    first_session_day, _ = _session_history(db, device_id)
 
-    for ev in events:
+    for ev in iter_events(db, device_id):
         etype = ev.get("event_type", "")
         data = ev.get("data") or {}
         day = ev["received_at"][:10]
-        sid = data.get("session_id")
 
-        if etype == "SessionStart":
-            if sid:
-                session_starts[sid] = ev["received_at"]
-            continue
         if etype == "SessionEnd":
             session_days.append(day)
             continue
@@ -889,9 +1440,8 @@ def cleanup_xp_duplicates(request: Request, device_id: str = Depends(require_dev
         expected_counts[(xp_source, day)] += 1
 
     # Add bonus entries
-    if session_starts:
-        first_day = sorted(session_starts.values())[0][:10]
-        expected_counts[("first_session", first_day)] += 1
+    if first_session_day:
+        expected_counts[("first_session", first_session_day)] += 1
     for day in sorted(set(session_days)):
         if commit_per_day[day] > 0:
             expected_counts[("session_commit", day)] += 1
@@ -903,60 +1453,77 @@ def cleanup_xp_duplicates(request: Request, device_id: str = Depends(require_dev
         prev_d = d
         expected_counts[("streak", day_str)] += 1
 
-    # Fetch all xp_log entries
-    all_rows = (
-        db.table("xp_log").select("id, source, amount, created_at")
-        .eq("device_id", device_id).order("created_at").execute().data or []
-    )
-
-    # Group by (source, day), keep expected count, delete extras
-    grouped: dict[tuple, list] = defaultdict(list)
-    for row in all_rows:
-        key = (row["source"], row["created_at"][:10])
-        grouped[key].append(row)
-
+    # Stream xp_log in order: per (source, day), keep the first expected-count
+    # entries and mark the rest for deletion. quest_complete and install are kept.
+    seen: dict[tuple, int] = defaultdict(int)
     to_delete: list[str] = []
-    for key, rows_for_key in grouped.items():
-        keep = expected_counts.get(key, 0)
-        # For quest_complete and install, keep all
-        if key[0] in ("quest_complete", "install"):
-            continue
-        if len(rows_for_key) > keep:
-            excess = rows_for_key[keep:]
-            to_delete.extend(r["id"] for r in excess)
+    rows_read = total_xp = 0
+    for row in iter_xp_log(db, device_id):
+        rows_read += 1
+        key = (row["source"], row["created_at"][:10])
+        seen[key] += 1
+        if key[0] not in ("quest_complete", "install") and seen[key] > expected_counts.get(key, 0):
+            to_delete.append(row["id"])
+        else:
+            total_xp += row["amount"]
 
+    # Each delete decrements user_stats.total_xp through the xp_log trigger.
     deleted = 0
     for row_id in to_delete:
         db.table("xp_log").delete().eq("id", row_id).execute()
         deleted += 1
-
-    # Recalculate total_xp
-    total_xp = sum(
-        r["amount"] for r in
-        (db.table("xp_log").select("amount").eq("device_id", device_id).execute().data or [])
-    )
-    upsert_stats(db, device_id, {"total_xp": total_xp, "level": compute_level(total_xp)})
+    if deleted:
+        bump_version(device_id)
+        activity_cache.discard_where(lambda key: key[0] == device_id)
 
     return {
         "status": "ok",
         "deleted_entries": deleted,
-        "remaining_entries": len(all_rows) - deleted,
+        "remaining_entries": rows_read - deleted,
         "total_xp": total_xp,
     }
 
 
+# ── Export ────────────────────────────────────────────────────────────────────
+
+@app.get("/api/me/export", dependencies=[device_limit("export", "5/hour")])
+def export_me(gzip: bool = False, device_id: str = Depends(require_device)):
+    """
+    The device's full history as streaming NDJSON (see app/export.py), or a
+    .ndjson.gz file with ?gzip=true. Restore with scripts/import_device.py.
+    """
+    filename = f"game-of-claude-{device_id[:8]}.ndjson"
+    lines = iter_export(get_client(), device_id)
+    if gzip:
+        return StreamingResponse(gzipped(lines), media_type="application/gzip",
+                                 headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'})
+    return StreamingResponse(chunked(lines), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 # ── Delete ────────────────────────────────────────────────────────────────────
 
 @app.delete("/api/me", status_code=200)
 def delete_me(device_id: str = Depends(require_device)):
     db = get_client()
     db.table("devices").delete().eq("device_id", device_id).execute()
+    forget_device(device_id)
     logger.info("Device deleted: %s...", device_id[:8])
     return {"status": "deleted", "message": "All your data has been permanently deleted."}
 
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
 
+async def _gather_reads(*calls: tuple) -> list:
+    """
+    Run independent blocking DB reads, each given as (fn, *args), concurrently
+    and return their results in order. They share Starlette's bounded worker
+    threadpool with the sync endpoints, so a burst of reads queues rather than
+    opening unbounded connections.
+    """
+    return await asyncio.gather(*(run_in_threadpool(fn, *args) for fn, *args in calls))
+
+
 def _count_today_commits(db, device_id: str) -> int:
     """Count XP-earning commits logged today (for daily cap)."""
     res = db.table("xp_log").select("id", count="exact").eq(
@@ -983,15 +1550,12 @@ def _update_running_totals(db, device_id: str, stats: dict, xp_source: str) -> d
     return stats
 
 
-def _track_file_extension(db, device_id: str, stats: dict, tool_input: dict) -> None:
-    """Extract file extension from Edit/Write event and add to user's extension set."""
-    ext = extract_file_extension(tool_input.get("file_path", ""))
-    if not ext:
-        return
-    extensions = list(stats.get("file_extensions") or [])
-    if ext not in extensions:
-        extensions.append(ext)
-        upsert_stats(db, device_id, {"file_extensions": extensions})
+def _track_file_extensions(db, device_id: str, extensions) -> int:
+    """Set-add extensions server-side and remember them; returns the unique count."""
+    unique_count = add_file_extensions(db, device_id, extensions)
+    for ext in extensions:
+        known_extensions.put((device_id, ext), True)
+    return unique_count
 
 
 def _track_commit_insertions(db, device_id: str, stats: dict, tool_response: dict) -> None:
@@ -1008,7 +1572,9 @@ def _track_commit_insertions(db, device_id: str, stats: dict, tool_response: dic
         upsert_stats(db, device_id, {"total_insertions": new_total})
 
 
-def _handle_session_end(db, device_id, stats, body, today, quest_progress) -> list[dict]:
+def _handle_session_end(db, device_id, stats, body, today, quest_progress,
+                        progress: dict[str, bool] | None = None) -> list[dict]:
+    progress = {} if progress is None else progress
     completions: list[dict] = []
     session_commits = _count_today_commits(db, device_id)
 
@@ -1018,7 +1584,6 @@ def _handle_session_end(db, device_id, stats, body, today, quest_progress) -> li
 
     new_longest = max(stats.get("longest_streak", 0), new_streak)
     total_sessions = (stats.get("total_sessions") or 0) + 1
-    total_xp = stats.get("total_xp") or 0
 
     # Core stat updates — columns present since migration 001, must always succeed
     stat_updates: dict[str, Any] = {
@@ -1028,42 +1593,56 @@ def _handle_session_end(db, device_id, stats, body, today, quest_progress) -> li
         "total_sessions": total_sessions,
     }
 
-    if streak_xp > 0:
+    if streak_xp > 0 and not progress.get("streak"):
         award_xp(db, device_id, "streak", streak_xp)
-        total_xp += streak_xp
-        stat_updates["total_xp"] = total_xp
+        progress["streak"] = True
 
     if session_commits > 0:
-        award_xp(db, device_id, "session_commit", 20)
-        total_xp += 20
-        stat_updates["total_xp"] = total_xp
+        if not progress.get("session_commit"):
+            award_xp(db, device_id, "session_commit", 20)
+            progress["session_commit"] = True
         merged = {**stats, **stat_updates}
-        completions += _check_quests(db, device_id, merged, quest_progress, "session_commit", today)
-        total_xp = merged["total_xp"]
-        stat_updates["total_xp"] = total_xp
+        completions += _check_quests(db, device_id, merged, quest_progress, "session_commit", today, progress)
 
     if streak_xp > 0:
         merged = {**stats, **stat_updates}
-        completions += _check_quests(db, device_id, merged, quest_progress, "streak", today)
-        total_xp = merged["total_xp"]
-        stat_updates["total_xp"] = total_xp
+        completions += _check_quests(db, device_id, merged, quest_progress, "streak", today, progress)
 
-    upsert_stats(db, device_id, stat_updates)
+    if not progress.get("session_stats"):
+        upsert_stats(db, device_id, stat_updates)
+        progress["session_stats"] = True
 
     # Session duration — total_session_minutes added in migration 004; wrapped so
     # a missing column can't roll back the core stat_updates above.
     session_mins = _compute_session_duration(db, device_id, body.session_id)
-    if session_mins > 0:
+    if body.session_id:
+        end_session(db, device_id, body.session_id, {
+            "ended_at": datetime.now(timezone.utc).isoformat(),
+            "minutes": session_mins,
+        })
+    if session_mins > 0 and not progress.get("session_minutes"):
         try:
             upsert_stats(db, device_id, {
                 "total_session_minutes": (stats.get("total_session_minutes") or 0) + session_mins,
             })
         except Exception as e:
             logger.warning("Could not update session minutes for %s: %s", device_id[:8], e)
+        progress["session_minutes"] = True
 
     return completions
 
 
+def _session_history(db, device_id: str) -> tuple[str | None, int]:
+    """Return (day of the first hook-started session, total session minutes)."""
+    first_day: str | None = None
+    total_minutes = 0
+    for row in iter_sessions(db, device_id):
+        if first_day is None and row.get("started_by_hook"):
+            first_day = row["started_at"][:10]
+        total_minutes += row.get("minutes") or 0
+    return first_day, total_minutes
+
+
 def _compute_session_duration(db, device_id: str, session_id: str | None) -> int:
     """Return session length in minutes, capped at 8h to ignore outliers."""
     start_time = get_session_start_time(db, device_id, session_id)
@@ -1073,19 +1652,41 @@ def _compute_session_duration(db, device_id: str, session_id: str | None) -> int
     return max(0, min(minutes, 480))
 
 
-def _check_quests(db, device_id, stats, quest_progress, event_source, today) -> list[dict]:
+def _publish_progress(device_id: str, source: str, xp_before: int, xp_after: int,
+                      completions: list[dict]) -> None:
+    """Push what this request changed to the device's live viewers."""
+    if xp_after > xp_before:
+        publish(device_id, "xp", {"source": source, "amount": xp_after - xp_before, "total_xp": xp_after})
+    for completion in completions:
+        publish(device_id, "quest_complete", completion)
+    level_before, level_after = compute_level(xp_before), compute_level(xp_after)
+    if level_after > level_before:
+        publish(device_id, "level_up", {"level": level_after, "level_title": level_title(level_after)})
+
+
+def _check_quests(db, device_id, stats, quest_progress, event_source, today,
+                  progress: dict[str, bool] | None = None) -> list[dict]:
+    """
+    Advance and claim the quests this event source feeds. With `progress`
+    (hook events, see _process_event), writes an earlier attempt already
+    made are skipped on replay.
+    """
+    progress = {} if progress is None else progress
     completions = []
     for quest in quests_to_check_for_event(event_source):
+        step = f"{event_source}:{quest.id}"
         progress_row = quest_progress.get(quest.id)
-        if quest.type == "progressive" and progress_row and progress_row.get("completed_at"):
+        if (quest.type == "progressive" and progress_row and progress_row.get("completed_at")
+                and not progress.get(f"{step}:claimed")):
             continue
 
         current_val = get_counter_value(stats, progress_row, quest, today)
 
-        if quest.type == "daily":
+        if quest.type == "daily" and not progress.get(f"{step}:count"):
             is_new_day = not progress_row or progress_row.get("reset_at") != str(today)
             new_val = 1 if is_new_day else (progress_row.get("current_value", 0) + 1)
             upsert_quest_progress(db, device_id, quest.id, {"current_value": new_val, "reset_at": str(today)})
+            progress[f"{step}:count"] = True
             current_val = new_val
 
         if current_val >= quest.goal:
@@ -1093,11 +1694,17 @@ def _check_quests(db, device_id, stats, quest_progress, event_source, today) ->
                 progress_row and progress_row.get("completed_at") and
                 (quest.type == "progressive" or progress_row.get("reset_at") == str(today))
             )
-            if not already_done:
-                upsert_quest_progress(db, device_id, quest.id, {"completed_at": "now()"})
+            # claim_quest is conditional in the DB, so only one request can win
+            # even if another process evaluated the same quest concurrently.
+            # A replay that won the claim last time still owes the reward.
+            since = str(today) if quest.type == "daily" else None
+            claimed = progress.get(f"{step}:claimed") or (
+                not already_done and claim_quest(db, device_id, quest.id, since))
+            if claimed and not progress.get(f"{step}:xp"):
+                progress[f"{step}:claimed"] = True
                 award_xp(db, device_id, "quest_complete", quest.xp_reward)
+                progress[f"{step}:xp"] = True
                 stats["total_xp"] = (stats.get("total_xp") or 0) + quest.xp_reward
-                upsert_stats(db, device_id, {"total_xp": stats["total_xp"]})
                 completions.append({"quest_id": quest.id, "quest_name": quest.name, "xp_awarded": quest.xp_reward})
 
     return completions
@@ -1,3 +1,4 @@
+import os
 import re
 from pydantic import BaseModel, Field, field_validator
 from typing import Any, Optional
@@ -13,6 +14,21 @@ def _validate_uuid4(v: str) -> str:
     return v.lower()
 
 
+# Hook payloads past this size are refused (413) before they are parsed.
+MAX_EVENT_BYTES = int(float(os.environ.get("MAX_EVENT_MB", "4")) * 1024 * 1024)
+# Bash output kept per field: the head holds git commit's "N files changed"
+# line, the tail a test runner's summary. The middle is dropped.
+EVENT_OUTPUT_HEAD = int(os.environ.get("EVENT_OUTPUT_HEAD_CHARS", "4096"))
+EVENT_OUTPUT_TAIL = int(os.environ.get("EVENT_OUTPUT_TAIL_CHARS", "4096"))
+_OUTPUT_FIELDS = ("output", "stdout", "stderr")
+
+
+def clip_output(text: str, head: int = EVENT_OUTPUT_HEAD, tail: int = EVENT_OUTPUT_TAIL) -> str:
+    if len(text) <= head + tail:
+        return text
+    return f"{text[:head]}\n[... {len(text) - head - tail} chars truncated ...]\n{text[len(text) - tail:]}"
+
+
 class HookEvent(BaseModel):
     hook_event_name: str
     session_id: Optional[str] = None
@@ -22,7 +38,8 @@ class HookEvent(BaseModel):
     tool_response: Optional[dict[str, Any]] = None
     cwd: Optional[str] = None
     duration_ms: Optional[int] = None
-    model_config = {"extra": "ignore"}
+    # Frozen: one validated event is shared by dedup, storage, scoring and the spool.
+    model_config = {"extra": "ignore", "frozen": True}
 
     @field_validator("session_id")
     @classmethod
@@ -32,6 +49,15 @@ class HookEvent(BaseModel):
             raise ValueError("session_id too long")
         return v if v else None
 
+    @field_validator("tool_response")
+    @classmethod
+    def clip_tool_output(cls, v):
+        # A noisy test run can print megabytes; nothing downstream needs more
+        # than the ends, and the raw event is stored as validated.
+        if v and any(isinstance(v.get(k), str) for k in _OUTPUT_FIELDS):
+            v = {**v, **{k: clip_output(v[k]) for k in _OUTPUT_FIELDS if isinstance(v.get(k), str)}}
+        return v
+
 
 class DeviceRegister(BaseModel):
     device_id: str
@@ -47,6 +73,27 @@ class ProfilePatch(BaseModel):
     character_name: str = Field(min_length=1, max_length=30)
 
 
+MAX_BATCH_PROFILES = 200
+
+
+class ProfileBatch(BaseModel):
+    """Device ids for POST /api/profiles:batch (team dashboards)."""
+    device_ids: list[str] = Field(min_length=1, max_length=MAX_BATCH_PROFILES)
+
+    @field_validator("device_ids")
+    @classmethod
+    def validate_device_ids(cls, v):
+        return list(dict.fromkeys(_validate_uuid4(d) for d in v))   # dedupe, keep order
+
+
+class TeamCreate(BaseModel):
+    name: str = Field(min_length=1, max_length=40)
+
+
+class TeamJoin(BaseModel):
+    join_code: str = Field(min_length=1, max_length=40)
+
+
 class GitSync(BaseModel):
     """Stats derived from git log / GitHub API — supplements hook-based tracking."""
     total_commits: Optional[int] = None
@@ -0,0 +1,257 @@
+"""
+Per-device pub/sub for live profile updates.
+
+Write endpoints publish XP awards, level-ups and quest completions once they
+are persisted; the SSE stream subscribes to a single device. The default
+broker fans out in-process only. PUBSUB_URL widens it:
+    unix:///some/dir   every worker process on this host (gunicorn.conf.py
+                       sets this when there is more than one worker)
+    redis://...        every instance, across hosts (and carries profile cache
+                       invalidations between them, see cache.py)
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Messages queued for a subscriber that stops reading are dropped past this
+# point — the client refetches the profile on the next message anyway.
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Subscription:
+    """One viewer's stream of (event, data) messages for a device."""
+
+    def __init__(self, broker: "LocalBroker", device_id: str):
+        self.device_id = device_id
+        self._broker = broker
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    async def get(self) -> tuple[str, dict]:
+        return await self._queue.get()
+
+    def close(self) -> None:
+        self._broker._unsubscribe(self)
+
+    def _deliver(self, message: tuple[str, dict]) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning("Dropping %s for slow subscriber of %s...", message[0], self.device_id[:8])
+
+    def _deliver_threadsafe(self, message: tuple[str, dict]) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, message)
+        except RuntimeError:
+            pass  # loop already closed; the subscription is going away
+
+
+class LocalBroker:
+    """In-memory fan-out within this process. Safe to publish from any thread."""
+
+    def __init__(self):
+        self._subs: dict[str, set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, device_id: str) -> Subscription:
+        """Must be called from the event loop that will consume the subscription."""
+        sub = Subscription(self, device_id)
+        with self._lock:
+            self._subs.setdefault(device_id, set()).add(sub)
+        return sub
+
+    def publish(self, device_id: str, event: str, data: dict) -> None:
+        with self._lock:
+            subs = list(self._subs.get(device_id, ()))
+        for sub in subs:
+            sub._deliver_threadsafe((event, data))
+
+    def subscriber_count(self, device_id: str) -> int:
+        return len(self._subs.get(device_id, ()))
+
+    def _unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subs.get(sub.device_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.device_id]
+
+
+class RedisBroker:
+    """
+    Cross-instance fan-out over Redis pub/sub.
+
+    Publishes go to Redis; one listener thread per process (started on first
+    use, after the fork) relays every message on the channel pattern into a
+    LocalBroker, which serves this process's subscribers.
+
+    It also carries profile cache invalidations between hosts: invalidate()
+    announces a device whose version this process bumped, and every other
+    process hands it to the on_invalidate callback.
+    """
+
+    CHANNEL_PREFIX = "goc:profile:"
+    INVALIDATE_CHANNEL = "goc:invalidate"
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("PUBSUB_URL=redis://... requires the 'redis' package") from e
+        self._redis = redis.Redis.from_url(url)
+        self._local = LocalBroker()
+        self._pid: int | None = None
+        self._origin = ""
+        self._on_invalidate: Callable[[str], None] | None = None
+        self._lock = threading.Lock()
+
+    def _this_process(self) -> None:
+        with self._lock:
+            if self._pid != os.getpid():   # first use here, or state inherited across a fork
+                self._pid = os.getpid()
+                self._origin = uuid.uuid4().hex
+                self._local = LocalBroker()
+                threading.Thread(target=self._listen, name="pubsub-redis", daemon=True).start()
+
+    def subscribe(self, device_id: str) -> Subscription:
+        self._this_process()
+        return self._local.subscribe(device_id)
+
+    def publish(self, device_id: str, event: str, data: dict) -> None:
+        payload = json.dumps({"event": event, "data": data})
+        self._redis.publish(f"{self.CHANNEL_PREFIX}{device_id}", payload)
+
+    def subscriber_count(self, device_id: str) -> int:
+        return self._local.subscriber_count(device_id)
+
+    def on_invalidate(self, callback: Callable[[str], None]) -> None:
+        """Call `callback(device_id)` for every invalidation another process announces."""
+        self._on_invalidate = callback
+        self._this_process()
+
+    def invalidate(self, device_id: str) -> None:
+        self._this_process()
+        payload = json.dumps({"origin": self._origin, "device_id": device_id})
+        self._redis.publish(self.INVALIDATE_CHANNEL, payload)
+
+    def _listen(self) -> None:
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(f"{self.CHANNEL_PREFIX}*")
+        pubsub.subscribe(self.INVALIDATE_CHANNEL)
+        for message in pubsub.listen():
+            try:
+                channel = message["channel"].decode()
+                body = json.loads(message["data"])
+                if channel == self.INVALIDATE_CHANNEL:
+                    if body["origin"] != self._origin and self._on_invalidate is not None:
+                        self._on_invalidate(body["device_id"])
+                    continue
+                device_id = channel.removeprefix(self.CHANNEL_PREFIX)
+                self._local.publish(device_id, body["event"], body["data"])
+            except Exception as e:
+                logger.warning("Bad pub/sub message on %s: %s", message.get("channel"), e)
+
+
+class HostBroker:
+    """
+    Fan-out across the worker processes of one host over Unix datagram
+    sockets in a shared directory.
+
+    A process binds a socket there when it first gets a subscriber (after
+    the fork, so workers never share one) and a listener thread relays what
+    arrives into a LocalBroker. A publish is sent to every socket in the
+    directory; one whose process has exited refuses it and is removed.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._local = LocalBroker()
+        self._pid: int | None = None
+        self._sender: socket.socket | None = None
+        self._listening = False
+        self._lock = threading.Lock()
+
+    def _this_process(self) -> socket.socket:
+        with self._lock:
+            if self._pid != os.getpid():   # first use here, or state inherited across a fork
+                self._pid = os.getpid()
+                self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self._sender.setblocking(False)   # a stalled worker must not block publishers
+                self._local = LocalBroker()
+                self._listening = False
+            return self._sender
+
+    def subscribe(self, device_id: str) -> Subscription:
+        self._this_process()
+        with self._lock:
+            if not self._listening:
+                os.makedirs(self.directory, exist_ok=True)
+                listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                listener.bind(os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock"))
+                threading.Thread(target=self._listen, args=(listener,), name="pubsub-host", daemon=True).start()
+                self._listening = True
+        return self._local.subscribe(device_id)
+
+    def publish(self, device_id: str, event: str, data: dict) -> None:
+        sender = self._this_process()
+        payload = json.dumps({"device_id": device_id, "event": event, "data": data}).encode()
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return   # nobody on this host has subscribed yet
+        for name in names:
+            if not name.endswith(".sock"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                sender.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                with contextlib.suppress(OSError):
+                    os.unlink(path)   # its process exited without cleaning up
+            except BlockingIOError:
+                logger.warning("Dropping %s for %s...: %s is not reading", event, device_id[:8], name)
+
+    def subscriber_count(self, device_id: str) -> int:
+        return self._local.subscriber_count(device_id)
+
+    def _listen(self, listener: socket.socket) -> None:
+        while True:
+            message = listener.recv(65536)
+            try:
+                body = json.loads(message)
+                self._local.publish(body["device_id"], body["event"], body["data"])
+            except Exception as e:
+                logger.warning("Bad pub/sub message: %s", e)
+
+
+def _make_broker() -> LocalBroker | HostBroker | RedisBroker:
+    url = os.environ.get("PUBSUB_URL", "")
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBroker(url)
+    if url.startswith("unix://"):
+        return HostBroker(url.removeprefix("unix://"))
+    return LocalBroker()
+
+
+broker = _make_broker()
+
+
+def publish(device_id: str, event: str, data: dict) -> None:
+    """Publish to a device's viewers. Never raises — live updates are best-effort."""
+    try:
+        broker.publish(device_id, event, data)
+    except Exception as e:
+        logger.warning("Could not publish %s for %s...: %s", event, device_id[:8], e)
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
@@ -0,0 +1,191 @@
+"""
+Token-bucket rate limits, keyed per route by the authenticated device_id
+(/api/events, /api/me/*) or by client IP (unauthenticated routes).
+
+Keying by device rather than IP keeps users behind one proxy or NAT out of
+each other's buckets. The key is the bearer token itself, so a check never
+touches the database; main.device_limit adds a much wider per-IP bucket so
+made-up tokens can't mint unlimited buckets.
+
+Buckets live in the store named by RATELIMIT_STORAGE_URI:
+    memory://              per process (default; fine for a single worker)
+    sqlite:///path/to.db   shared by every worker on one host
+    redis://host:port/db   shared across hosts
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fastapi import Depends, HTTPException
+
+logger = logging.getLogger(__name__)
+
+STORAGE_URI = os.environ.get("RATELIMIT_STORAGE_URI", "memory://")
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+@dataclass(frozen=True)
+class Rate:
+    """`capacity` requests in a burst, refilled at `per_second` tokens per second."""
+    capacity: int
+    per_second: float
+
+    @classmethod
+    def parse(cls, spec: str) -> "Rate":
+        """'60/minute' -> bursts of up to 60, refilled evenly over a minute."""
+        count, _, period = spec.partition("/")
+        seconds = _PERIODS[period.strip().rstrip("s")]
+        return cls(capacity=int(count), per_second=int(count) / seconds)
+
+
+def _refill(tokens: float, last: float, now: float, rate: Rate) -> float:
+    return min(rate.capacity, tokens + max(0.0, now - last) * rate.per_second)
+
+
+def _take(tokens: float, rate: Rate) -> tuple[float, float]:
+    """Spend one token if possible. Returns (tokens left, seconds to wait if refused — else 0)."""
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate.per_second
+
+
+class MemoryStore:
+    """Per-process buckets. Least-recently-used buckets are forgotten past `maxsize`."""
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, rate: Rate) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (rate.capacity, now))
+            tokens, wait = _take(_refill(tokens, last, now, rate), rate)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)   # a forgotten bucket is simply full again
+        return wait
+
+
+class SQLiteStore:
+    """Buckets in a local SQLite file, shared by every worker process on the host."""
+
+    PRUNE_EVERY = 1000   # hits between sweeps of long-idle buckets
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+        self._hits = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():   # never share a connection across a fork
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")   # limits, not data: losing a few on crash is fine
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, ts REAL)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def hit(self, key: str, rate: Rate) -> float:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT tokens, ts FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens, last = row if row else (rate.capacity, now)
+                tokens, wait = _take(_refill(tokens, last, now, rate), rate)
+                db.execute("INSERT OR REPLACE INTO buckets (key, tokens, ts) VALUES (?, ?, ?)",
+                           (key, tokens, now))
+                self._hits += 1
+                if self._hits % self.PRUNE_EVERY == 0:
+                    db.execute("DELETE FROM buckets WHERE ts < ?", (now - _PERIODS["day"],))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return wait
+
+
+# Refill and take in one atomic step on the server. Returns the wait in
+# seconds as a string (Lua numbers are truncated to integers on return).
+_REDIS_TAKE = """
+local capacity = tonumber(ARGV[1])
+local per_second = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or capacity
+local last = tonumber(b[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * per_second)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / per_second end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / per_second) + 1)
+return tostring(wait)
+"""
+
+
+class RedisStore:
+    """Buckets in Redis, shared across hosts. Requires the `redis` package."""
+
+    def __init__(self, url: str):
+        import redis  # optional dependency, only needed for this store
+
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(_REDIS_TAKE)
+
+    def hit(self, key: str, rate: Rate) -> float:
+        wait = self._take(keys=[f"goc:rl:{key}"], args=[rate.capacity, rate.per_second, time.time()])
+        return float(wait)
+
+
+def scale(spec: str, factor: int) -> str:
+    """'60/minute' scaled by 20 -> '1200/minute'."""
+    count, _, period = spec.partition("/")
+    return f"{int(count) * factor}/{period}"
+
+
+def _make_store(uri: str):
+    if uri.startswith("sqlite:///"):
+        return SQLiteStore(uri.removeprefix("sqlite:///"))
+    if uri.startswith(("redis://", "rediss://")):
+        return RedisStore(uri)
+    if uri != "memory://":
+        logger.warning("Unknown RATELIMIT_STORAGE_URI %r, using memory://", uri)
+    return MemoryStore()
+
+
+store = _make_store(STORAGE_URI)
+
+
+def rate_limit(name: str, spec: str, key):
+    """
+    Dependency enforcing `spec` (e.g. "60/minute") on one route, with a bucket
+    per value of the `key` dependency (main.py passes get_device_id).
+    """
+    rate = Rate.parse(spec)
+
+    def check(key_value: str = Depends(key)) -> None:
+        try:
+            wait = store.hit(f"{name}:{key_value}", rate)
+        except Exception as e:
+            # A broken limiter store must not take the API down with it.
+            logger.error("Rate limit store error on %s: %s", name, e)
+            return
+        if wait > 0:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Rate limit exceeded: {spec}",
+                headers={"Retry-After": str(max(1, round(wait)))},
+            )
+
+    return check
@@ -0,0 +1,290 @@
+"""
+Local write-ahead spool for hook events while the database is unavailable.
+
+ingest_event normally writes straight to Supabase. When calls start failing
+with transient errors the circuit breaker opens, and accepted events go to an
+append-only SQLite (WAL) file instead and are acknowledged with 202. A single
+replay thread per host (elected with an flock) feeds them back through the
+normal ingest path, oldest first, once the breaker lets calls through again.
+While a device has anything spooled its new events queue behind it, so a
+device's events are always processed in arrival order.
+
+The spool is capped at SPOOL_MAX_MB; past that, events are rejected with 503
+rather than filling the disk.
+"""
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Callable
+
+import httpx
+from postgrest.exceptions import APIError
+
+logger = logging.getLogger(__name__)
+
+SPOOL_PATH = os.environ.get("SPOOL_PATH", os.path.join(tempfile.gettempdir(), "goc-spool.db"))
+SPOOL_MAX_BYTES = int(float(os.environ.get("SPOOL_MAX_MB", "256")) * 1024 * 1024)
+REPLAY_INTERVAL = float(os.environ.get("SPOOL_REPLAY_INTERVAL", "1.0"))
+REPLAY_BATCH = 100
+
+# SQLSTATE classes that mean "try again later": connection exceptions,
+# insufficient resources, operator intervention (incl. statement timeout).
+_TRANSIENT_SQLSTATE_CLASSES = ("08", "53", "57")
+_TRANSIENT_HTTP_CODES = {"500", "502", "503", "504"}
+
+
+def is_transient(exc: Exception) -> bool:
+    """True for errors where the DB, not the request, is at fault."""
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, APIError):
+        code = str(exc.code or "")
+        return code in _TRANSIENT_HTTP_CODES or code.startswith(_TRANSIENT_SQLSTATE_CLASSES)
+    return False
+
+
+class CircuitBreaker:
+    """
+    closed: calls go through. After `threshold` consecutive transient failures
+    it opens and calls are refused for `reset_after` seconds; then one trial
+    call is let through (half-open) and its outcome closes or re-opens it.
+    """
+
+    def __init__(self, threshold: int = 5, reset_after: float = 30.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_after:
+                return "half-open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_after or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.threshold:
+                if self._opened_at is None:
+                    logger.error("DB circuit breaker opened after %d failures", self._failures)
+                self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """End a call whose outcome says nothing about the DB (a busy lock, a bad
+        request): the state is unchanged, but the next call may be the trial."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class Spool:
+    """Append-only queue of (device_id, event) in a SQLite WAL file, shared by local workers."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn: sqlite3.Connection | None = None
+        self._conn_key: tuple[str, int] | None = None
+        self._lock = threading.Lock()
+        # Devices with spooled events, as of the file's data_version below.
+        self._pending: set[str] = set()
+        self._pending_version: int | None = None
+        self.counters = {"spooled": 0, "replayed": 0, "rejected_full": 0, "replay_errors": 0, "dropped": 0}
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per process: a connection must not cross a fork.
+        key = (self.path, os.getpid())
+        if self._conn_key != key:
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA journal_size_limit={8 * 1024 * 1024}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " device_id TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " progress TEXT NOT NULL DEFAULT '{}',"
+                " spooled_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS spool_device_idx ON spool (device_id)")
+            self._conn, self._conn_key = conn, key
+            self._pending_version = None
+        return self._conn
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            db = self._db()
+            pages = db.execute("PRAGMA page_count").fetchone()[0] - db.execute("PRAGMA freelist_count").fetchone()[0]
+            return pages * db.execute("PRAGMA page_size").fetchone()[0]
+
+    def append(self, device_id: str, event: dict, progress: dict | None = None) -> bool:
+        """Store an event and how far live processing got; False if the spool is full."""
+        if self.size_bytes() >= self.max_bytes:
+            self.counters["rejected_full"] += 1
+            return False
+        with self._lock:
+            self._db().execute(
+                "INSERT INTO spool (device_id, payload, progress, spooled_at) VALUES (?, ?, ?, ?)",
+                (device_id, json.dumps(event), json.dumps(progress or {}), time.time()),
+            )
+            self._pending.add(device_id)
+        self.counters["spooled"] += 1
+        return True
+
+    def has_pending(self, device_id: str) -> bool:
+        """
+        Whether the device has events spooled, by any worker on the host. Answered
+        from an in-memory set; PRAGMA data_version (no table read) tells when
+        another process has written the file and the set must be reloaded.
+        """
+        with self._lock:
+            db = self._db()
+            version = db.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._pending_version:
+                self._pending = {row[0] for row in db.execute("SELECT DISTINCT device_id FROM spool")}
+                self._pending_version = version
+            return device_id in self._pending
+
+    def oldest(self, limit: int) -> list[tuple[int, str, dict, dict]]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT seq, device_id, payload, progress FROM spool ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+        return [(seq, device_id, json.loads(payload), json.loads(progress))
+                for seq, device_id, payload, progress in rows]
+
+    def remove(self, seq: int, device_id: str) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM spool WHERE seq = ?", (seq,))
+            if db.execute("SELECT 1 FROM spool WHERE device_id = ? LIMIT 1", (device_id,)).fetchone() is None:
+                self._pending.discard(device_id)
+
+    def save_progress(self, seq: int, progress: dict) -> None:
+        """Record how far a failed replay got, so the retry doesn't redo those steps."""
+        with self._lock:
+            self._db().execute("UPDATE spool SET progress = ? WHERE seq = ?", (json.dumps(progress), seq))
+
+    def metrics(self) -> dict:
+        with self._lock:
+            depth, oldest = self._db().execute("SELECT COUNT(*), MIN(spooled_at) FROM spool").fetchone()
+        return {
+            "depth": depth,
+            "bytes": self.size_bytes(),
+            "max_bytes": self.max_bytes,
+            "oldest_age_seconds": round(time.time() - oldest, 1) if oldest else 0,
+            **self.counters,
+        }
+
+
+class Replayer:
+    """Background thread that drains the spool through `process(device_id, event, progress)`."""
+
+    def __init__(self, spool: Spool, breaker: CircuitBreaker,
+                 process: Callable[[str, dict, dict], None]):
+        self.spool = spool
+        self.breaker = breaker
+        self.process = process
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock_fd: int | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="spool-replay", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _is_leader(self) -> bool:
+        """Only one process per spool file replays, so order is kept across workers."""
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(self.spool.path + ".replay.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(REPLAY_INTERVAL):
+            try:
+                if self._is_leader():
+                    self.drain()
+            except Exception as e:
+                logger.error("Spool replay loop error: %s", e)
+
+    def drain(self) -> int:
+        """Replay spooled events in order until empty, or until the DB fails again."""
+        replayed = 0
+        while not self._stop.is_set():
+            batch = self.spool.oldest(REPLAY_BATCH)
+            if not batch or not self.breaker.allow():
+                return replayed
+            for seq, device_id, event, progress in batch:
+                try:
+                    self.process(device_id, event, progress)
+                except Exception as e:
+                    # TimeoutError covers a busy device lock: not the DB's fault,
+                    # but the event is still worth retrying.
+                    if is_transient(e) or isinstance(e, TimeoutError):
+                        if is_transient(e):
+                            self.breaker.record_failure()
+                        else:
+                            self.breaker.release()
+                        self.spool.save_progress(seq, progress)
+                        self.spool.counters["replay_errors"] += 1
+                        return replayed   # keep it; retry on the next pass
+                    # Not the DB's fault — replaying again won't help.
+                    self.breaker.release()
+                    logger.error("Dropping spooled %s for %s...: %s",
+                                 event.get("hook_event_name"), device_id[:8], e)
+                    self.spool.counters["dropped"] += 1
+                else:
+                    self.breaker.record_success()
+                    self.spool.counters["replayed"] += 1
+                    replayed += 1
+                self.spool.remove(seq, device_id)
+        return replayed
+
+
+breaker = CircuitBreaker(
+    threshold=int(os.environ.get("DB_BREAKER_THRESHOLD", "5")),
+    reset_after=float(os.environ.get("DB_BREAKER_RESET_SECONDS", "30")),
+)
+spool = Spool(SPOOL_PATH, SPOOL_MAX_BYTES)
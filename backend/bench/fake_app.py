@@ -0,0 +1,21 @@
+"""
+The real app wired to bench.fake_db instead of Supabase.
+
+    gunicorn -c gunicorn.conf.py bench.fake_app:app
+"""
+from functools import lru_cache
+
+from app import db, main
+from bench.fake_db import FakeClient
+
+
+@lru_cache(maxsize=1)
+def _fake_client() -> FakeClient:
+    return FakeClient()
+
+
+# main imported get_client by name; post_fork clears db.get_client's cache.
+main.get_client = _fake_client
+db.get_client = _fake_client
+
+app = main.app
@@ -0,0 +1,113 @@
+"""
+In-memory stand-in for the Supabase client, for benchmarks only.
+
+Implements just enough of the postgrest query builder for the hot endpoints
+(ingest, profile, activity, stats, leaderboard) to run without a database. Every execute()
+can sleep FAKE_DB_LATENCY_MS to model network round-trips; at the default
+of 0 a benchmark measures the backend's own CPU cost.
+"""
+import os
+import time
+from datetime import datetime, timezone
+
+LATENCY = float(os.environ.get("FAKE_DB_LATENCY_MS", "0")) / 1000
+
+
+class _Result:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class _Query:
+    def __init__(self, client: "FakeClient", table: str):
+        self.client = client
+        self.table = table
+        self.filters: dict = {}
+        self.op = "select"
+        self.payload = None
+        self.want_count = False
+        self.n = None
+
+    # ── builder ──
+    def select(self, *columns, count=None, head=False):
+        self.want_count = count is not None
+        return self
+
+    def insert(self, payload):
+        self.op, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload, **_):
+        self.op, self.payload = "upsert", payload
+        return self
+
+    def update(self, payload):
+        self.op, self.payload = "update", payload
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    def eq(self, col, val):
+        self.filters[col] = val
+        return self
+
+    def limit(self, n):
+        self.n = n
+        return self
+
+    def _passthrough(self, *args, **kwargs):
+        return self
+
+    gt = gte = lt = lte = neq = in_ = or_ = order = range = _passthrough
+
+    # ── execution ──
+    def execute(self):
+        if LATENCY:
+            time.sleep(LATENCY)
+        if self.op != "select":
+            return _Result([self.payload] if isinstance(self.payload, dict) else self.payload)
+        rows = self.client.rows(self.table, self.filters)
+        if self.n is not None:
+            rows = rows[: self.n]
+        return _Result(rows, count=len(rows) if self.want_count else None)
+
+
+class _Rpc:
+    _RESULTS = {"add_file_extensions": 3, "claim_quest": True, "acquire_device_lease": True,
+                "level_for_xp": 0}
+
+    def __init__(self, name):
+        self.name = name
+
+    def execute(self):
+        if LATENCY:
+            time.sleep(LATENCY)
+        return _Result(self._RESULTS.get(self.name))
+
+
+class FakeClient:
+    """Every device exists, has a mid-level stats row, and an empty history."""
+
+    def rows(self, table: str, filters: dict) -> list[dict]:
+        device_id = filters.get("device_id", "bench")
+        if table == "devices":
+            return [{"device_id": device_id, "character_name": "Bench", "created_at": "2026-01-01T00:00:00+00:00"}]
+        if table == "user_stats":
+            return [{
+                "device_id": device_id, "total_xp": 1234, "score": 1234, "level": 4, "current_streak": 3,
+                "longest_streak": 9, "total_commits": 120, "total_test_passes": 80,
+                "total_sessions": 40, "total_prs": 6, "total_merged_prs": 4, "total_branches": 12,
+                "total_insertions": 5400, "total_session_minutes": 2100,
+                "file_extensions": ["py", "js", "sql"], "last_session_date": datetime.now(timezone.utc).date().isoformat(),
+                "devices": {"character_name": "Bench", "show_on_leaderboard": True},   # embedded select
+            }]
+        return []
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def rpc(self, name: str, params: dict | None = None) -> _Rpc:
+        return _Rpc(name)
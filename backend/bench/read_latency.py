@@ -0,0 +1,98 @@
+"""
+Latency of the read endpoints against a database with simulated round-trips.
+
+Runs the real app in-process on bench.fake_db with FAKE_DB_LATENCY_MS per
+query (default 20), and for each endpoint prints the median request latency
+next to what the same reads cost when issued one after another. Independent
+reads are fanned out, so a request should cost about one round-trip, not
+one per query.
+
+    cd backend
+    python -m bench.read_latency
+    FAKE_DB_LATENCY_MS=50 python -m bench.read_latency --requests 50
+"""
+import argparse
+import logging
+import os
+import statistics
+import time
+import uuid
+from datetime import date, timedelta
+
+os.environ.setdefault("FAKE_DB_LATENCY_MS", "20")
+os.environ.setdefault("SUPABASE_URL", "http://unused")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "unused")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import db, ratelimit  # noqa: E402
+from app.cache import bump_version  # noqa: E402
+from bench.fake_app import app, _fake_client  # noqa: E402
+from bench.fake_db import LATENCY  # noqa: E402
+
+
+class _NoLimits:
+    """The coding-stats IP limit would otherwise refuse a benchmark's worth of requests."""
+    def hit(self, key, rate) -> float:
+        return 0.0
+
+
+def _sequential(device_id: str) -> dict[str, list]:
+    """The reads each endpoint makes, as they would run one after another."""
+    client = _fake_client()
+    return {
+        "/api/profile": [
+            lambda: db.get_device(client, device_id),
+            lambda: db.get_stats(client, device_id),
+            lambda: db.get_quest_progress(client, device_id),
+            lambda: db.count_today_xp_source(client, device_id, "commit"),
+            lambda: db.get_today_session_count(client, device_id),
+        ],
+        "/api/activity": [
+            lambda: db.get_device(client, device_id),
+            lambda: db.get_activity_series(client, device_id, date.today() - timedelta(days=364), date.today()),
+            lambda: db.get_activity_day(client, device_id, date.today()),
+        ],
+        "/api/stats": [
+            lambda: db.get_device(client, device_id),
+            lambda: db.get_coding_stats_days(client, device_id),
+        ],
+    }
+
+
+def _median_ms(fn, n: int) -> float:
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=30, help="requests per endpoint")
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    ratelimit.store = _NoLimits()
+    device_id = str(uuid.uuid4())
+    reads = _sequential(device_id)
+    print(f"simulated DB latency: {LATENCY * 1000:.0f} ms per query\n")
+    print(f"{'endpoint':<16}{'queries':>8}{'sequential':>12}{'endpoint':>10}{'speedup':>9}")
+    with TestClient(app) as http:
+        def get(path):
+            def request():
+                bump_version(device_id)   # defeat the profile cache: measure a full render
+                assert http.get(f"{path}/{device_id}").status_code == 200
+            return request
+
+        for path, calls in reads.items():
+            sequential = _median_ms(lambda: [call() for call in calls], args.requests)
+            served = _median_ms(get(path), args.requests)
+            print(f"{path:<16}{len(calls):>8}{sequential:>10.1f}ms{served:>8.1f}ms{sequential / served:>8.1f}x",
+                  flush=True)
+
+
+if __name__ == "__main__":
+    main()
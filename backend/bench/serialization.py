@@ -0,0 +1,118 @@
+"""
+Serialization cost and bytes on the wire for the largest JSON responses.
+
+For each payload prints the median time to render it with the stdlib
+encoder (Starlette's JSONResponse) and with orjson (the default, see
+app/encoding.py), then its size raw, gzipped and brotli-compressed at the
+levels CompressionMiddleware uses. The profile is rendered by the real app
+on bench.fake_db; the others are built at the sizes heavy accounts reach.
+
+    cd backend
+    python -m bench.serialization
+    python -m bench.serialization --repeat 500
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import time
+import uuid
+import zlib
+from datetime import date, datetime, timedelta, timezone
+
+os.environ.setdefault("FAKE_DB_LATENCY_MS", "0")
+
+from fastapi.responses import JSONResponse, ORJSONResponse  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import encoding  # noqa: E402
+from app.main import _log_cursor  # noqa: E402
+from bench.fake_app import app  # noqa: E402
+
+SOURCES = ["commit", "test_pass", "session", "pr_created", "pr_merged", "branch"]
+
+
+def _profile() -> dict:
+    with TestClient(app) as http:
+        return http.get(f"/api/profile/{uuid.uuid4()}").json()
+
+
+def _activity(days: int = 5 * 365) -> dict:
+    rng = random.Random(1)
+    by_source = {src: [rng.choice([0, 0, 1, 2, 5]) for _ in range(days)] for src in SOURCES}
+    end = date.today()
+    return {
+        "from": (end - timedelta(days=days - 1)).isoformat(),
+        "to": end.isoformat(),
+        "counts": [sum(day) for day in zip(*by_source.values())],
+        "by_source": by_source,
+    }
+
+
+def _xp_log(entries: int = 1000) -> dict:
+    rng = random.Random(2)
+    at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for _ in range(entries):
+        at += timedelta(minutes=rng.randint(1, 90))
+        rows.append({"id": str(uuid.uuid4()), "source": rng.choice(SOURCES), "amount": rng.choice([5, 15, 25, 50]),
+                     "created_at": at.isoformat()})
+    summary = {f"{s}@{d}": 3 for s in SOURCES for d in range(60)}
+    return {"total_entries": 48000, "total_xp": 910000, "summary": summary, "entries": rows,
+            "next_cursor": _log_cursor(rows[-1])}
+
+
+def _reprocess(days: int = 365) -> dict:
+    start = date(2025, 1, 1)
+    daily = {f"{s}@{start + timedelta(days=d)}": 4 for s in SOURCES for d in range(days)}
+    return {
+        "xp_added": 1200, "entries_added": 80, "total_xp": 91000,
+        "stats_diff": {"total_commits": [1200, 1210]},
+        "_debug": {
+            "xp_log_rows_read": 48000, "events_read": 250000,
+            "existing": daily, "expected": daily,
+            "to_award": [{"source": "commit", "amount": 15, "day": str(start + timedelta(days=d))}
+                         for d in range(80)],
+        },
+    }
+
+
+def _median_us(fn, n: int) -> float:
+    samples = []
+    for _ in range(n):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1e6)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=200, help="renders per payload and encoder")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    payloads = {
+        "/api/profile": _profile(),
+        "/api/activity 5y": _activity(),
+        "/api/debug/xp-log": _xp_log(),
+        "/api/me/reprocess": _reprocess(),
+    }
+    stdlib = JSONResponse(None)
+    fast = ORJSONResponse(None)
+    br = "br" if encoding.brotli else "br (n/a)"
+    print(f"{'payload':<20}{'json':>10}{'orjson':>10}{'speedup':>9}{'raw':>10}{'gzip':>9}{br:>10}")
+    for name, payload in payloads.items():
+        slow_us = _median_us(lambda: stdlib.render(payload), args.repeat)
+        fast_us = _median_us(lambda: fast.render(payload), args.repeat)
+        raw = fast.render(payload)
+        gz = zlib.compress(raw, encoding.GZIP_LEVEL)
+        brotli_size = (f"{len(encoding.brotli.compress(raw, quality=encoding.BROTLI_QUALITY)):>10,}"
+                       if encoding.brotli else f"{'-':>10}")
+        print(f"{name:<20}{slow_us:>8.0f}us{fast_us:>8.0f}us{slow_us / fast_us:>8.1f}x"
+              f"{len(raw):>10,}{len(gz):>9,}{brotli_size}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
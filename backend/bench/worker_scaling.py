@@ -0,0 +1,137 @@
+"""
+Throughput of the gunicorn serving mode at 1..N workers.
+
+Boots `gunicorn -c gunicorn.conf.py bench.fake_app:app` (the real app on an
+in-memory database) once per worker count, drives it with several client
+processes posting scoring Bash events from random devices, and prints
+requests/second for each count.
+
+    cd backend
+    python -m bench.worker_scaling                   # 1..nproc workers, 10s each
+    python -m bench.worker_scaling --max-workers 8 --seconds 20
+    FAKE_DB_LATENCY_MS=5 python -m bench.worker_scaling   # model DB round-trips
+
+With FAKE_DB_LATENCY_MS=0 this measures the backend's CPU cost per event,
+so throughput should grow close to linearly until workers exceed cores.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _event() -> dict:
+    return {
+        "hook_event_name": "PostToolUse",
+        "session_id": "bench",
+        "tool_name": "Bash",
+        "tool_use_id": uuid.uuid4().hex,
+        "tool_input": {"command": "git commit -m 'bench'"},
+        "tool_response": {"stdout": "[main 1a2b3c4] bench\n 1 file changed", "exit_code": 0},
+    }
+
+
+def _client(url: str, seconds: float, out: mp.Queue) -> None:
+    """One load-generating process: a single keep-alive connection, requests back to back."""
+    deadline = time.monotonic() + seconds
+    done = errors = 0
+    with httpx.Client(base_url=url, timeout=10) as http:
+        while time.monotonic() < deadline:
+            device = uuid.uuid4().hex   # a fresh device each time: no lock or rate-limit contention
+            try:
+                r = http.post("/api/events", json=_event(), headers={"Authorization": f"Bearer {device}"})
+                if r.status_code == 200:
+                    done += 1
+                else:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+    out.put((done, errors))
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {proc.returncode}")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("gunicorn did not become ready")
+
+
+def run(workers: int, seconds: float, clients: int) -> tuple[float, int]:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    state = tempfile.mkdtemp(prefix="goc-bench-")
+    env = {
+        **os.environ,
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(workers),
+        "GOC_STATE_DIR": state,
+        "SPOOL_PATH": os.path.join(state, "spool.db"),
+        "SUPABASE_URL": os.environ.get("SUPABASE_URL", "http://unused"),
+        "SUPABASE_SERVICE_KEY": os.environ.get("SUPABASE_SERVICE_KEY", "unused"),
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+         "--access-logfile", "/dev/null", "bench.fake_app:app"],
+        cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(url, proc)
+        out: mp.Queue = mp.Queue()
+        procs = [mp.Process(target=_client, args=(url, seconds, out)) for _ in range(clients)]
+        for p in procs:
+            p.start()
+        results = [out.get() for _ in procs]
+        for p in procs:
+            p.join()
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+        shutil.rmtree(state, ignore_errors=True)
+    done = sum(d for d, _ in results)
+    errors = sum(e for _, e in results)
+    return done / seconds, errors
+
+
+def main() -> None:
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--max-workers", type=int, default=cpus)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=None,
+                        help="load-generating processes (default: 4 per worker)")
+    args = parser.parse_args()
+
+    print(f"{'workers':>7}  {'req/s':>9}  {'speedup':>7}  {'errors':>6}")
+    base = None
+    for workers in range(1, args.max_workers + 1):
+        rps, errors = run(workers, args.seconds, args.clients or 4 * workers)
+        base = base or rps
+        print(f"{workers:>7}  {rps:>9.1f}  {rps / base:>6.2f}x  {errors:>6}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
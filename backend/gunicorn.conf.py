@@ -0,0 +1,63 @@
+"""
+Production serving: gunicorn managing uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The app is imported once in the master (preload_app) and forked, so import
+work and module-level tables are shared copy-on-write. Worker count comes
+from the CPUs this container may use; override with WEB_CONCURRENCY.
+
+Everything per-device that must agree across workers gets a host-wide
+backend by default when there is more than one worker. Explicit settings
+in the environment win:
+    CACHE_VERSIONS_PATH    profile cache versions / ETags   (app/cache.py)
+    DEVICE_LOCKS=host      per-device request ordering      (app/locks.py)
+    RATELIMIT_STORAGE_URI  token buckets                    (app/ratelimit.py)
+    PUBSUB_URL=unix://     live profile streams             (app/pubsub.py)
+The event spool (app/spool.py) is already shared through its SQLite file.
+For more than one host use DEVICE_LOCKS=db and redis:// for the rate-limit
+store and PUBSUB_URL. PUBSUB_URL=redis:// also carries profile cache version
+bumps between hosts; without it a write on one host leaves the others
+serving the old profile, so run a single host.
+
+Behind Railway's edge proxy the peer address is the proxy's, so client_ip
+(rate limits on unauthenticated routes) reads the client from the last
+X-Forwarded-For hop: TRUSTED_PROXY_HOPS=1 unless set. Uvicorn's own
+proxy-header handling stays at gunicorn's default (127.0.0.1 only); given
+forwarded_allow_ips="*" it would take the leftmost, client-supplied hop.
+"""
+import os
+import tempfile
+
+
+def _cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))   # honours cpusets / container limits
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY", _cpu_count()))
+preload_app = True
+timeout = 60            # SSE streams send a keepalive well within this
+graceful_timeout = 20
+keepalive = 5
+accesslog = "-"
+
+os.environ.setdefault("TRUSTED_PROXY_HOPS", "1")
+
+if workers > 1:
+    _state_dir = os.environ.get("GOC_STATE_DIR", tempfile.gettempdir())
+    os.environ.setdefault("CACHE_VERSIONS_PATH", os.path.join(_state_dir, "goc-cache-versions.db"))
+    os.environ.setdefault("DEVICE_LOCKS", "host")
+    os.environ.setdefault("RATELIMIT_STORAGE_URI", f"sqlite:///{os.path.join(_state_dir, 'goc-ratelimit.db')}")
+    os.environ.setdefault("PUBSUB_URL", f"unix://{os.path.join(_state_dir, 'goc-pubsub')}")
+
+
+def post_fork(server, worker):
+    # The Supabase client holds an HTTP connection pool; a pool inherited
+    # from the master would be shared by every worker. Start each one fresh.
+    from app.db import get_client
+    get_client.cache_clear()
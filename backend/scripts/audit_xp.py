@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Check every device's user_stats.total_xp / level against its xp_log.
+
+The xp_log trigger from migration 006 keeps the two in step, so any drift
+here means rows were written around it (manual SQL, a restore, or data from
+before the migration). The check is a single set-based query
+(xp_total_drift), not a per-device scan.
+
+Usage:
+    cd backend
+    SUPABASE_URL=... SUPABASE_SERVICE_KEY=... python scripts/audit_xp.py
+    SUPABASE_URL=... SUPABASE_SERVICE_KEY=... python scripts/audit_xp.py --fix
+
+Exits non-zero when drift is found and --fix was not given.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from supabase import create_client
+from app.db import invalidate_profiles
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+log = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fix", action="store_true", help="rewrite drifted totals from xp_log")
+    args = parser.parse_args()
+
+    db = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
+
+    drift = db.rpc("xp_total_drift").execute().data or []
+    if not drift:
+        log.info("✅ All devices consistent: user_stats.total_xp matches xp_log.")
+        return
+
+    log.info("%d device(s) drifted:", len(drift))
+    for row in drift:
+        log.info("  %s...  stored %d XP (level %s), xp_log sums to %d (%+d)",
+                 row["device_id"][:8], row["stored_xp"], row["stored_level"],
+                 row["logged_xp"], row["logged_xp"] - row["stored_xp"])
+
+    if not args.fix:
+        sys.exit(1)
+
+    fixed = db.rpc("resync_xp_totals").execute().data
+    invalidate_profiles(db, [row["device_id"] for row in drift])
+    log.info("\n✅ Resynced %s device(s) from xp_log.", fixed)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,10 +19,12 @@ import sys
 import logging
 from collections import defaultdict
 from datetime import date, timedelta
+from itertools import groupby
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
 from supabase import create_client
+from app.db import invalidate_profiles, iter_events, iter_xp_log
 from app.engine.xp import (
     is_commit_command,
     is_test_command,
@@ -44,49 +46,34 @@ def main():
 
     db = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
 
-    # ── Fetch raw events ──────────────────────────────────────────────────────
-    log.info("Fetching events for device %s...", device_id[:8])
-    events = (
-        db.table("events")
-        .select("event_type, received_at, data")
-        .eq("device_id", device_id)
-        .order("received_at")
-        .execute()
-        .data or []
-    )
-    log.info("  %d raw events found", len(events))
-
-    # ── Fetch existing xp_log ─────────────────────────────────────────────────
-    existing_xp_rows = (
-        db.table("xp_log")
-        .select("source, amount, created_at")
-        .eq("device_id", device_id)
-        .execute()
-        .data or []
-    )
+    # ── Count existing xp_log ─────────────────────────────────────────────────
     # How many entries per (source, YYYY-MM-DD) already exist?
     credited: dict[tuple, int] = defaultdict(int)
-    for row in existing_xp_rows:
+    existing_count = 0
+    for row in iter_xp_log(db, device_id):
         credited[(row["source"], row["created_at"][:10])] += 1
+        existing_count += 1
 
-    log.info("  %d existing xp_log entries", len(existing_xp_rows))
+    log.info("  %d existing xp_log entries", existing_count)
 
     # ── Replay events day by day ──────────────────────────────────────────────
-    by_day: dict[str, list] = defaultdict(list)
-    for ev in events:
-        by_day[ev["received_at"][:10]].append(ev)
-
+    # Events stream in received_at order, so consecutive runs share a day and
+    # only one page of history is held in memory at a time.
+    log.info("Replaying events for device %s...", device_id[:8])
     to_award: list[tuple[str, int, str]] = []  # (source, amount, day)
     session_days: list[str] = []               # days that had a SessionEnd
+    event_count = session_end_count = 0
 
-    for day in sorted(by_day):
+    for day, day_events in groupby(iter_events(db, device_id), key=lambda ev: ev["received_at"][:10]):
         commits = tests = prs = merged = 0
         had_session_end = False
 
-        for ev in by_day[day]:
+        for ev in day_events:
+            event_count += 1
             etype = ev.get("event_type", "")
             if etype == "SessionEnd":
                 had_session_end = True
+                session_end_count += 1
                 continue
             if etype != "PostToolUse":
                 continue
@@ -141,6 +128,8 @@ def main():
         if had_session_end:
             session_days.append(day)
 
+    log.info("  %d raw events replayed", event_count)
+
     # ── Streak XP backfill ────────────────────────────────────────────────────
     streak = 0
     prev: date | None = None
@@ -190,13 +179,11 @@ def main():
         .data or [{}]
     )[0]
 
-    # total_xp: existing + newly awarded
+    # total_xp / level already include the inserts above — the xp_log trigger
+    # (migration 006) applied them — so only report the change.
     missing_xp = sum(amt for _, amt, _ in to_award)
-    new_total_xp = (stats.get("total_xp") or 0) + missing_xp
-    new_level = compute_level(new_total_xp)
-
-    # total_sessions: count distinct SessionEnd events
-    session_end_count = sum(1 for ev in events if ev.get("event_type") == "SessionEnd")
+    new_total_xp = stats.get("total_xp") or 0
+    old_total_xp = new_total_xp - missing_xp
 
     # streak: replay from session_days
     final_streak = longest = 0
@@ -220,8 +207,6 @@ def main():
     last_session_date = sorted(session_days)[-1] if session_days else None
 
     stat_updates = {
-        "total_xp": new_total_xp,
-        "level": new_level,
         "total_sessions": max(stats.get("total_sessions") or 0, session_end_count),
         "current_streak": max(stats.get("current_streak") or 0, final_streak),
         "longest_streak": max(stats.get("longest_streak") or 0, longest),
@@ -230,10 +215,11 @@ def main():
         stat_updates["last_session_date"] = last_session_date
 
     db.table("user_stats").upsert({"device_id": device_id, **stat_updates}).execute()
+    invalidate_profiles(db, [device_id])
 
     log.info("\n✅ user_stats updated:")
-    log.info("  total_xp:       %d → %d", stats.get("total_xp") or 0, new_total_xp)
-    log.info("  level:          %d → %d", stats.get("level") or 0, new_level)
+    log.info("  total_xp:       %d → %d", old_total_xp, new_total_xp)
+    log.info("  level:          %d → %d", compute_level(old_total_xp), compute_level(new_total_xp))
     log.info("  total_sessions: %d → %d", stats.get("total_sessions") or 0, stat_updates["total_sessions"])
     log.info("  current_streak: %d → %d", stats.get("current_streak") or 0, stat_updates["current_streak"])
     log.info("  longest_streak: %d → %d", stats.get("longest_streak") or 0, stat_updates["longest_streak"])
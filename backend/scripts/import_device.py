@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Restore a device from a GET /api/me/export stream (NDJSON, or .ndjson.gz).
+
+Rows are written in batched upserts in the order the export lists them,
+and the database triggers rebuild total_xp, level, period totals, team
+rollups and coding-stats counters as they land. Restoring into the device
+the export came from is idempotent, so an interrupted import can be re-run.
+
+Usage:
+    cd backend
+    SUPABASE_URL=... SUPABASE_SERVICE_KEY=... python scripts/import_device.py export.ndjson.gz
+    SUPABASE_URL=... SUPABASE_SERVICE_KEY=... python scripts/import_device.py - < export.ndjson
+    ... python scripts/import_device.py export.ndjson --device-id <new uuid>   # restore as another device
+"""
+
+import argparse
+import gzip
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from supabase import create_client
+from app.export import ExportFormatError, import_device
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+log = logging.getLogger(__name__)
+
+
+def _open(path: str):
+    raw = sys.stdin.buffer if path == "-" else open(path, "rb")
+    if raw.peek(2).startswith(b"\x1f\x8b"):   # gzip magic, whatever the file is called
+        return gzip.open(raw)
+    return raw
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="export file, or - for stdin")
+    parser.add_argument("--device-id", help="restore into this device instead of the exported one")
+    parser.add_argument("--batch-size", type=int, default=500, help="rows per insert (default 500)")
+    args = parser.parse_args()
+
+    db = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
+    try:
+        with _open(args.path) as lines:
+            counts = import_device(db, lines, device_id=args.device_id, batch_size=args.batch_size)
+    except ExportFormatError as e:
+        log.error("❌ %s", e)
+        sys.exit(1)
+    for table, n in counts.items():
+        log.info("  %-15s %d rows", table, n)
+    log.info("✅ Import complete.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Replay every device's events through the current XP rules.
+
+Run this after changing engine/xp.py or docs/xp-rules.md. It pages through
+all devices in device_id order and runs the same replay as
+/api/me/reprocess for each one on a bounded worker pool. Progress is
+checkpointed after every page, so an interrupted run resumes where it
+stopped. Replays are idempotent, so re-running a page is harmless.
+
+Usage:
+    cd backend
+    SUPABASE_URL=... SUPABASE_SERVICE_KEY=... python scripts/recompute_xp.py --dry-run
+    SUPABASE_URL=... SUPABASE_SERVICE_KEY=... python scripts/recompute_xp.py --workers 8
+
+--dry-run writes nothing. It records each device whose XP or stats would
+change in the report file (JSON lines), which you can review before a real
+run. Devices whose replay raised are listed there too, with the error.
+Use --restart to ignore an existing checkpoint.
+
+A real run holds each device's lock for its replay so it never interleaves
+with that device's hook events or sync-session. It takes the lock of every
+mode (locks.offline_lock): the Postgres lease (migration 009) excludes
+servers running DEVICE_LOCKS=db, and the lock file excludes the default
+gunicorn setup, DEVICE_LOCKS=host, as long as the script runs on that host.
+A single uvicorn process (DEVICE_LOCKS=local) can't be excluded; stop it or
+run it under gunicorn first. Raise DEVICE_LEASE_TTL_MS if a single device's
+replay can outlast the lease.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from supabase import create_client
+from app.db import invalidate_profiles
+from app.locks import offline_lock
+from app.main import _reprocess_events
+
+logging.basicConfig(level=logging.INFO, format="%(message)s", force=True)  # app.main configured it first
+log = logging.getLogger(__name__)
+
+
+def iter_device_pages(db, after: str, page_size: int):
+    """Yield lists of device_ids in order, starting after the given cursor."""
+    while True:
+        query = db.table("devices").select("device_id").order("device_id").limit(page_size)
+        if after:
+            query = query.gt("device_id", after)
+        rows = query.execute().data or []
+        if not rows:
+            return
+        yield [r["device_id"] for r in rows]
+        after = rows[-1]["device_id"]
+
+
+def load_state(path: Path, dry_run: bool) -> dict:
+    fresh = {"cursor": "", "devices": 0, "changed": 0, "failed": 0, "xp_added": 0, "dry_run": dry_run}
+    if not path.exists():
+        return fresh
+    state = json.loads(path.read_text())
+    if state.get("dry_run") != dry_run:
+        sys.exit(f"{path} is from a {'dry' if state.get('dry_run') else 'real'} run; "
+                 "pass --restart or a different --state file.")
+    return state
+
+
+def recompute_one(db, device_id: str, dry_run: bool) -> dict:
+    try:
+        if dry_run:
+            result = _reprocess_events(db, device_id, dry_run=True)
+        else:
+            with offline_lock(db, device_id):
+                result = _reprocess_events(db, device_id)
+    except Exception as e:
+        return {"device_id": device_id, "error": str(e)}
+    return {
+        "device_id": device_id,
+        "xp_added": result["xp_added"],
+        "entries_added": result["entries_added"],
+        "total_xp": result["total_xp"],
+        "stats_diff": result["stats_diff"],
+        "to_award": result["_debug"]["to_award"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="concurrent devices (bounds DB load)")
+    parser.add_argument("--page-size", type=int, default=200, help="devices fetched per page")
+    parser.add_argument("--dry-run", action="store_true", help="report changes without writing")
+    parser.add_argument("--state", default="recompute_state.json", help="checkpoint file")
+    parser.add_argument("--report", default="recompute_report.jsonl", help="per-device diff report")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    db = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
+
+    state_path = Path(args.state)
+    if args.restart and state_path.exists():
+        state_path.unlink()
+    state = load_state(state_path, args.dry_run)
+    if state["cursor"]:
+        log.info("Resuming after device %s... (%d already done)", state["cursor"][:8], state["devices"])
+
+    started = time.monotonic()
+    done_this_run = 0
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool, open(args.report, "a") as report:
+        for page in iter_device_pages(db, state["cursor"], args.page_size):
+            changed = []
+            for outcome in pool.map(lambda d: recompute_one(db, d, args.dry_run), page):
+                if "error" in outcome:
+                    state["failed"] += 1
+                    log.warning("  %s...  FAILED: %s", outcome["device_id"][:8], outcome["error"])
+                elif outcome["entries_added"] or outcome["stats_diff"]:
+                    state["changed"] += 1
+                    state["xp_added"] += outcome["xp_added"]
+                    changed.append(outcome["device_id"])
+                else:
+                    continue
+                report.write(json.dumps(outcome) + "\n")
+
+            # Servers' cached profiles of the changed devices are stale now.
+            if not args.dry_run:
+                invalidate_profiles(db, changed)
+
+            # Checkpoint only once the whole page has finished.
+            state["cursor"] = page[-1]
+            state["devices"] += len(page)
+            done_this_run += len(page)
+            report.flush()
+            state_path.write_text(json.dumps(state, indent=2))
+
+            elapsed = time.monotonic() - started
+            log.info("%d devices (%d changed, %d failed, +%d XP)  %.1f devices/s",
+                     state["devices"], state["changed"], state["failed"], state["xp_added"],
+                     done_this_run / elapsed if elapsed else 0.0)
+
+    elapsed = time.monotonic() - started
+    log.info("\n%s %d devices in %.1fs (%.1f devices/s): %d changed, %d failed, +%d XP",
+             "Checked" if args.dry_run else "Recomputed",
+             done_this_run, elapsed, done_this_run / elapsed if elapsed else 0.0,
+             state["changed"], state["failed"], state["xp_added"])
+    log.info("Diff report: %s", args.report)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,20 @@ API integration tests — mocks all DB calls at the app.main import level.
 Runs without a live Supabase connection.
 """
 import uuid
-from unittest.mock import MagicMock, patch, call
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import ANY, MagicMock, patch, call
 import pytest
 from fastapi.testclient import TestClient
 
 
 @pytest.fixture
-def app_client():
+def app_client(tmp_path):
     """
     Patches every DB function imported by app.main so no real Supabase calls
     are made. Yields a dict with the TestClient and key mock handles.
     """
+    from app.spool import CircuitBreaker, Spool
+    from app.ratelimit import MemoryStore
     patches = {
         "get_client": patch("app.main.get_client"),
         "get_device": patch("app.main.get_device"),
@@ -25,6 +28,13 @@ def app_client():
         "log_raw_event": patch("app.main.log_raw_event"),
         "is_already_processed": patch("app.main.is_already_processed"),
         "make_source_key": patch("app.main.make_source_key"),
+        "add_file_extensions": patch("app.main.add_file_extensions"),
+        "claim_quest": patch("app.main.claim_quest"),
+        "get_session_result": patch("app.main.get_session_result"),
+        "save_session_result": patch("app.main.save_session_result"),
+        "spool": patch("app.main.spool", Spool(str(tmp_path / "spool.db"), 1024 * 1024)),
+        "breaker": patch("app.main.breaker", CircuitBreaker(threshold=2, reset_after=60)),
+        "ratelimit_store": patch("app.ratelimit.store", MemoryStore()),
     }
     started = {k: p.start() for k, p in patches.items()}
 
@@ -34,10 +44,19 @@ def app_client():
     started["get_quest_progress"].return_value = {}
     started["is_already_processed"].return_value = False
     started["make_source_key"].return_value = "deadbeef" * 4
+    started["add_file_extensions"].return_value = 0
+    started["claim_quest"].return_value = True
+    started["get_session_result"].return_value = None
     # Health check needs a DB call to succeed
     started["get_client"].return_value = MagicMock()
 
     from app.main import app
+    from app.cache import known_devices, known_extensions, leaderboard_cache, activity_cache, session_results
+    known_devices.clear()
+    known_extensions.clear()
+    leaderboard_cache.clear()
+    activity_cache.clear()
+    session_results.clear()
     with TestClient(app, raise_server_exceptions=False) as c:
         yield {"client": c, **started}
 
@@ -173,6 +192,351 @@ class TestEvents:
         assert res.status_code == 200
         assert res.json()["status"] == "duplicate"
 
+    def test_long_output_is_clipped_before_storage(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id)
+        output = ("[main abc1234] big\n 900 files changed, 12000 insertions(+)\n"
+                  + " create mode 100644 f.py\n" * 50_000 + "all done\n")
+        with patch("app.main._count_today_commits", return_value=0):
+            res = c.post(
+                "/api/events",
+                json={"hook_event_name": "PostToolUse", "tool_name": "Bash", "session_id": "s",
+                      "tool_use_id": "toolu_big", "tool_input": {"command": "git commit -m big"},
+                      "tool_response": {"exit_code": 0, "output": output}},
+                headers={"Authorization": f"Bearer {device_id}"},
+            )
+        assert res.status_code == 200
+        stored = app_client["log_raw_event"].call_args.args[4]["tool_response"]["output"]
+        assert len(stored) < 10_000 and stored.endswith("all done\n") and "chars truncated" in stored
+        inserted = [c.args[2]["total_insertions"] for c in app_client["upsert_stats"].call_args_list
+                    if "total_insertions" in c.args[2]]
+        assert inserted == [12000]
+
+    def test_oversized_event_refused_unparsed(self, app_client):
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        with patch("app.main.MAX_EVENT_BYTES", 1000):
+            res = app_client["client"].post(
+                "/api/events",
+                json={"hook_event_name": "PostToolUse", "tool_response": {"output": "x" * 2000}},
+                headers={"Authorization": f"Bearer {device_id}"},
+            )
+        assert res.status_code == 413
+        app_client["log_raw_event"].assert_not_called()
+
+    @pytest.mark.parametrize("raw", [b"{not json", b"[1, 2]", b'{"session_id": "s"}'])
+    def test_malformed_event_is_422(self, app_client, raw):
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        res = app_client["client"].post("/api/events", content=raw, headers={
+            "Authorization": f"Bearer {device_id}", "Content-Type": "application/json"})
+        assert res.status_code == 422
+        assert res.json()["detail"][0]["loc"][0] == "body"
+
+
+# ── Ingest fast paths ────────────────────────────────────────────────────────
+
+class TestIngestFastPaths:
+    def _post(self, c, device_id, **event):
+        return c.post(
+            "/api/events",
+            json={"hook_event_name": "PostToolUse", "session_id": str(uuid.uuid4()), **event},
+            headers={"Authorization": f"Bearer {device_id}"},
+        )
+
+    def test_edit_known_extension_is_insert_only(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["add_file_extensions"].return_value = 1
+        edit = {"tool_name": "Edit", "tool_input": {"file_path": "/src/app.py"}}
+
+        assert self._post(c, device_id, **edit).status_code == 200
+        app_client["add_file_extensions"].assert_called_once_with(ANY, device_id, ["py"])
+
+        assert self._post(c, device_id, **edit).json()["xp_awarded"] == 0
+        app_client["add_file_extensions"].assert_called_once()   # second .py edit never hits the DB
+        app_client["get_stats"].assert_not_called()
+        app_client["get_quest_progress"].assert_not_called()
+        app_client["upsert_stats"].assert_not_called()
+        assert app_client["log_raw_event"].call_count == 2
+
+    def test_fifth_extension_completes_polyglot(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id, xp=100)
+        app_client["add_file_extensions"].return_value = 5
+
+        res = self._post(c, device_id, tool_name="Write", tool_input={"file_path": "/src/q.sql"})
+        assert [q["quest_id"] for q in res.json()["quest_completions"]] == ["craft_polyglot"]
+        app_client["award_xp"].assert_called_once_with(ANY, device_id, "quest_complete", 75)
+
+    def test_non_scoring_bash_skips_stats_and_quests(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+
+        res = self._post(c, device_id, tool_name="Bash",
+                         tool_input={"command": "ls -la"}, tool_response={"exit_code": 0})
+        assert res.json() == {"status": "ok", "xp_awarded": 0, "quest_completions": []}
+        app_client["log_raw_event"].assert_called_once()
+        app_client["get_stats"].assert_not_called()
+        app_client["get_quest_progress"].assert_not_called()
+        app_client["award_xp"].assert_not_called()
+
+    def test_other_hooks_are_insert_only(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+
+        res = self._post(c, device_id, hook_event_name="UserPromptSubmit")
+        assert res.status_code == 200
+        app_client["log_raw_event"].assert_called_once()
+        app_client["get_stats"].assert_not_called()
+
+
+# ── Per-device serialization ─────────────────────────────────────────────────
+
+class TestDeviceSerialization:
+    def _pytest_event(self):
+        return {
+            "hook_event_name": "PostToolUse",
+            "tool_name": "Bash",
+            "session_id": str(uuid.uuid4()),
+            "tool_input": {"command": "pytest"},
+            "tool_response": {"exit_code": 0},
+        }
+
+    def test_busy_device_returns_503(self, app_client):
+        from app.locks import DeviceBusy
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+
+        with patch("app.main.device_lock", side_effect=DeviceBusy(device_id)):
+            res = c.post("/api/me/sync-git", json={"total_commits": 1},
+                         headers={"Authorization": f"Bearer {device_id}"})
+        assert res.status_code == 503
+        assert res.headers["retry-after"] == "1"
+
+    def test_busy_device_event_is_spooled_after_logging(self, app_client):
+        """The hook's retry would be a duplicate, so a busy event is finished from the spool."""
+        from app.locks import DeviceBusy
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+
+        with patch("app.main.device_lock", side_effect=DeviceBusy(device_id)):
+            res = c.post("/api/events", json=self._pytest_event(),
+                         headers={"Authorization": f"Bearer {device_id}"})
+        assert res.status_code == 202
+        [(_, spooled_device, _, progress)] = app_client["spool"].oldest(10)
+        assert spooled_device == device_id
+        assert progress == {"claimed": True, "logged": True}
+
+    def test_quest_claimed_elsewhere_is_not_awarded_twice(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id)
+        app_client["claim_quest"].return_value = False   # a concurrent request won
+
+        res = c.post("/api/events", json=self._pytest_event(),
+                     headers={"Authorization": f"Bearer {device_id}"})
+        assert res.json()["quest_completions"] == []
+        awards = [call.args[2] for call in app_client["award_xp"].call_args_list]
+        assert awards == ["test_pass"]
+
+
+# ── Per-device rate limits ───────────────────────────────────────────────────
+
+class TestDeviceRateLimit:
+    def test_limit_is_per_device_and_skips_db(self, app_client):
+        c = app_client["client"]
+        a, b = str(uuid.uuid4()), str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(a)
+
+        with patch("app.main.iter_events", side_effect=lambda *a, **k: iter([])), \
+             patch("app.main.iter_xp_log", side_effect=lambda *a, **k: iter([])), \
+             patch("app.main.iter_sessions", side_effect=lambda *a, **k: iter([])):
+            for _ in range(5):   # cleanup-xp allows 5/hour
+                assert c.post("/api/me/cleanup-xp", headers={"Authorization": f"Bearer {a}"}).status_code == 200
+            app_client["get_device"].reset_mock()
+
+            res = c.post("/api/me/cleanup-xp", headers={"Authorization": f"Bearer {a}"})
+            assert res.status_code == 429
+            assert int(res.headers["retry-after"]) > 0
+            app_client["get_device"].assert_not_called()   # refused before auth hits the DB
+
+            assert c.post("/api/me/cleanup-xp", headers={"Authorization": f"Bearer {b}"}).status_code == 200
+
+    def test_cycling_tokens_hits_the_ip_bucket(self, app_client):
+        from app.main import DEVICES_PER_IP
+        c = app_client["client"]
+        for _ in range(5 * DEVICES_PER_IP):   # unknown tokens: 404, but each spends an IP token
+            res = c.post("/api/me/cleanup-xp", headers={"Authorization": f"Bearer {uuid.uuid4()}"})
+            assert res.status_code == 404
+        res = c.post("/api/me/cleanup-xp", headers={"Authorization": f"Bearer {uuid.uuid4()}"})
+        assert res.status_code == 429
+
+    @pytest.mark.parametrize("hops, forwarded, expected", [
+        (0, "203.0.113.7", "10.1.2.3"),                 # no proxy configured: the peer
+        (1, "203.0.113.7", "203.0.113.7"),              # the hop the edge appended
+        (1, "6.6.6.6, 203.0.113.7", "203.0.113.7"),     # a forged left entry is ignored
+        (2, "203.0.113.7", "10.1.2.3"),                 # fewer hops than proxies: the peer
+    ])
+    def test_client_ip_reads_trusted_forwarded_hop(self, hops, forwarded, expected):
+        from starlette.requests import Request as StarletteRequest
+        from app.main import client_ip
+        request = StarletteRequest({"type": "http", "client": ("10.1.2.3", 1234),
+                                    "headers": [(b"x-forwarded-for", forwarded.encode())]})
+        with patch("app.main.TRUSTED_PROXY_HOPS", hops):
+            assert client_ip(request) == expected
+
+
+# ── Spool ────────────────────────────────────────────────────────────────────
+
+class TestSpool:
+    def _event(self):
+        return {
+            "hook_event_name": "PostToolUse",
+            "tool_name": "Bash",
+            "session_id": str(uuid.uuid4()),
+            "tool_input": {"command": "pytest"},
+            "tool_response": {"exit_code": 0},
+        }
+
+    def _db_down(self):
+        import httpx
+        return httpx.ConnectError("connection refused")
+
+    def test_transient_error_spools_and_acks(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["is_already_processed"].side_effect = self._db_down()
+
+        res = c.post("/api/events", json=self._event(), headers={"Authorization": f"Bearer {device_id}"})
+        assert res.status_code == 202
+        assert res.json() == {"status": "spooled"}
+        [(_, _, event, progress)] = app_client["spool"].oldest(10)
+        assert event["tool_input"] == {"command": "pytest"}
+        assert progress == {}   # dedup never ran, so replay starts from the top
+
+    def test_open_breaker_skips_db_entirely(self, app_client):
+        from app.cache import known_devices
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        known_devices.put(device_id, True)   # seen before the outage
+        app_client["get_device"].side_effect = self._db_down()
+        app_client["is_already_processed"].side_effect = self._db_down()
+        headers = {"Authorization": f"Bearer {device_id}"}
+
+        for _ in range(3):   # threshold=2 in the fixture: both calls fail on the first request
+            assert c.post("/api/events", json=self._event(), headers=headers).status_code == 202
+        assert app_client["get_device"].call_count == 1
+        assert app_client["is_already_processed"].call_count == 1
+        assert app_client["breaker"].state == "open"
+        assert c.get("/api/debug/spool").json()["depth"] == 3
+
+    def test_non_transient_error_is_not_spooled(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["log_raw_event"].side_effect = ValueError("bad payload")
+
+        res = c.post("/api/events", json=self._event(), headers={"Authorization": f"Bearer {device_id}"})
+        assert res.status_code == 500
+        assert not app_client["spool"].has_pending(device_id)
+
+    def test_unknown_token_refused_while_db_down(self, app_client):
+        c = app_client["client"]
+        app_client["get_device"].side_effect = self._db_down()
+        for _ in range(3):
+            res = c.post("/api/events", json=self._event(), headers={"Authorization": f"Bearer {uuid.uuid4()}"})
+            assert res.status_code == 503 and "retry-after" in res.headers
+        assert app_client["spool"].metrics()["depth"] == 0
+
+    def test_only_that_devices_events_queue_behind_its_spool(self, app_client):
+        c = app_client["client"]
+        spooled, other = str(uuid.uuid4()), str(uuid.uuid4())
+        app_client["spool"].append(spooled, self._event())
+        app_client["get_device"].side_effect = lambda db, d: _make_device(d)
+        assert c.post("/api/events", json=self._event(),
+                      headers={"Authorization": f"Bearer {spooled}"}).status_code == 202
+        assert c.post("/api/events", json=self._event(),
+                      headers={"Authorization": f"Bearer {other}"}).status_code == 200
+
+    def test_busy_device_releases_half_open_trial(self, app_client):
+        from app.locks import DeviceBusy
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        breaker = app_client["breaker"]
+        breaker.reset_after = 0
+        breaker.record_failure(), breaker.record_failure()
+        with patch("app.main._score_bash", side_effect=DeviceBusy(device_id)):
+            res = c.post("/api/events", json=self._event(), headers={"Authorization": f"Bearer {device_id}"})
+        assert res.status_code == 202
+        assert breaker.allow()
+
+    def test_replay_after_award_does_not_award_again(self, app_client):
+        """A failure after the XP insert is spooled with that step; the replay skips it."""
+        import httpx
+        from app.main import _replay_spooled_event
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id)
+
+        with patch("app.main._check_quests", side_effect=[httpx.ConnectError("refused"), []]):
+            res = c.post("/api/events", json=self._event(), headers={"Authorization": f"Bearer {device_id}"})
+            assert res.status_code == 202
+            [(_, _, event, progress)] = app_client["spool"].oldest(10)
+            assert progress["xp"] is True and progress["totals"] is True
+
+            _replay_spooled_event(device_id, event, progress)
+        assert app_client["award_xp"].call_count == 1
+        assert app_client["upsert_stats"].call_count == 1
+
+    def test_replay_resumes_after_logged_step(self, app_client):
+        from app.main import _replay_spooled_event
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id)
+
+        _replay_spooled_event(device_id, self._event(), {"claimed": True, "logged": True})
+        app_client["is_already_processed"].assert_not_called()
+        app_client["log_raw_event"].assert_not_called()
+        assert [call.args[2] for call in app_client["award_xp"].call_args_list][0] == "test_pass"
+
+    def test_replay_still_pays_quest_claimed_before_failure(self, app_client):
+        from app.main import _check_quests
+        today = date.today()
+        done = {"completed_at": today.isoformat(), "reset_at": None}
+        quest_progress = {"prog_first_blood": done}   # the claim went through last time
+        progress = {"commit:prog_first_blood:claimed": True}
+
+        completions = _check_quests(MagicMock(), "dev", {"total_commits": 1}, quest_progress,
+                                    "commit", today, progress)
+        assert "prog_first_blood" in [c["quest_id"] for c in completions]
+        assert "prog_first_blood" not in [c.args[2] for c in app_client["claim_quest"].call_args_list]
+        assert progress["commit:prog_first_blood:xp"] is True
+
+        awarded = app_client["award_xp"].call_count
+        assert _check_quests(MagicMock(), "dev", {"total_commits": 1}, quest_progress,
+                             "commit", today, progress) == []
+        assert app_client["award_xp"].call_count == awarded
+
+    def test_replay_drops_unregistered_device(self, app_client):
+        from app.main import _replay_spooled_event
+        app_client["get_device"].return_value = None
+        _replay_spooled_event(str(uuid.uuid4()), self._event(), {})
+        app_client["log_raw_event"].assert_not_called()
+
 
 # ── XP accumulation (total_xp bug regression) ────────────────────────────────
 
@@ -196,7 +560,7 @@ class TestTotalXpAccumulation:
         }
 
     def test_commit_event_updates_total_xp(self, app_client):
-        """Commit XP (+15) must be persisted to total_xp in user_stats."""
+        """Commit XP (+15) must be logged to xp_log, which drives user_stats.total_xp."""
         c = app_client["client"]
         device_id = str(uuid.uuid4())
         initial_xp = 100
@@ -214,18 +578,15 @@ class TestTotalXpAccumulation:
         assert res.status_code == 200
         assert res.json()["xp_awarded"] == 15
 
+        award_calls = [call.args[1:] for call in app_client["award_xp"].call_args_list]
+        assert (device_id, "commit", 15) in award_calls
+
+        # total_xp follows xp_log via the DB trigger — never read-modify-written here
         upsert_calls = app_client["upsert_stats"].call_args_list
-        total_xp_values = [
-            c.args[2]["total_xp"]
-            for c in upsert_calls
-            if len(c.args) > 2 and "total_xp" in c.args[2]
-        ]
-        assert any(v == initial_xp + 15 for v in total_xp_values), (
-            f"Expected total_xp={initial_xp + 15} in upsert_stats calls, got: {total_xp_values}"
-        )
+        assert not [c for c in upsert_calls if len(c.args) > 2 and "total_xp" in c.args[2]]
 
     def test_test_pass_event_updates_total_xp(self, app_client):
-        """test_pass XP (+8) must be persisted to total_xp in user_stats."""
+        """test_pass XP (+8) must be logged to xp_log, which drives user_stats.total_xp."""
         c = app_client["client"]
         device_id = str(uuid.uuid4())
         initial_xp = 50
@@ -240,15 +601,12 @@ class TestTotalXpAccumulation:
         assert res.status_code == 200
         assert res.json()["xp_awarded"] == 8
 
+        award_calls = [call.args[1:] for call in app_client["award_xp"].call_args_list]
+        assert (device_id, "test_pass", 8) in award_calls
+
+        # total_xp follows xp_log via the DB trigger — never read-modify-written here
         upsert_calls = app_client["upsert_stats"].call_args_list
-        total_xp_values = [
-            c.args[2]["total_xp"]
-            for c in upsert_calls
-            if len(c.args) > 2 and "total_xp" in c.args[2]
-        ]
-        assert any(v == initial_xp + 8 for v in total_xp_values), (
-            f"Expected total_xp={initial_xp + 8} in upsert_stats calls, got: {total_xp_values}"
-        )
+        assert not [c for c in upsert_calls if len(c.args) > 2 and "total_xp" in c.args[2]]
 
     def test_non_xp_event_does_not_set_total_xp(self, app_client):
         """SessionStart with no XP should not write total_xp (beyond existing stats)."""
@@ -302,6 +660,291 @@ class TestProfile:
         assert "xp_to_next_level" in body
         assert "current_streak" in body
 
+    def test_profile_sets_etag(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id)
+        res = c.get(f"/api/profile/{device_id}")
+        assert res.status_code == 200
+        assert res.headers["etag"].startswith('W/"')
+
+    def test_matching_etag_returns_304_without_db(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id)
+        etag = c.get(f"/api/profile/{device_id}").headers["etag"]
+        app_client["get_device"].reset_mock()
+
+        res = c.get(f"/api/profile/{device_id}", headers={"If-None-Match": etag})
+        assert res.status_code == 304
+        assert res.headers["etag"] == etag
+        app_client["get_device"].assert_not_called()
+
+    def test_repeat_poll_served_from_cache(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id)
+        first = c.get(f"/api/profile/{device_id}").json()
+        app_client["get_device"].reset_mock()
+
+        assert c.get(f"/api/profile/{device_id}").json() == first
+        app_client["get_device"].assert_not_called()
+
+    def test_version_bump_invalidates_etag(self, app_client):
+        from app.cache import bump_version
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id, xp=150)
+        etag = c.get(f"/api/profile/{device_id}").headers["etag"]
+
+        bump_version(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id, xp=300)
+        res = c.get(f"/api/profile/{device_id}", headers={"If-None-Match": etag})
+        assert res.status_code == 200
+        assert res.headers["etag"] != etag
+        assert res.json()["total_xp"] == 300
+
+
+    def test_profile_reads_run_concurrently(self, app_client):
+        """All five profile reads are in flight at once: each waits for the other four."""
+        import threading
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        barrier = threading.Barrier(5, timeout=5)
+
+        def meet(value):
+            def read(*args):
+                barrier.wait()
+                return value
+            return read
+
+        app_client["get_device"].side_effect = meet(_make_device(device_id))
+        app_client["get_stats"].side_effect = meet(_make_stats(device_id))
+        app_client["get_quest_progress"].side_effect = meet({})
+        with patch("app.main.count_today_xp_source", side_effect=meet(3)), \
+                patch("app.main.get_today_session_count", side_effect=meet(2)):
+            res = c.get(f"/api/profile/{device_id}")
+        assert res.status_code == 200
+        assert res.json()["commits_today"] == 3
+        assert res.json()["sessions_today"] == 2
+
+
+class TestProfileBatch:
+    @pytest.fixture
+    def batch(self, app_client):
+        from app.cache import profile_cache
+        profile_cache.clear()
+        ids = [str(uuid.uuid4()) for _ in range(3)]
+        found = ids[:2]
+        with patch("app.main.get_device_batch", return_value={d: _make_device(d) for d in found}) as devices, \
+                patch("app.main.get_stats_batch", return_value={d: _make_stats(d, xp=150) for d in found}), \
+                patch("app.main.get_quest_progress_batch", return_value={}), \
+                patch("app.main.get_today_counts_batch", return_value={found[0]: (2, 1)}):
+            yield {"client": app_client["client"], "ids": ids, "devices": devices}
+
+    def test_returns_profile_per_device(self, batch):
+        ids = batch["ids"]
+        res = batch["client"].post("/api/profiles:batch", json={"device_ids": ids})
+        assert res.status_code == 200
+        body = res.json()
+        assert list(body["profiles"]) == ids[:2]
+        assert body["not_found"] == [ids[2]]
+        first = body["profiles"][ids[0]]
+        assert first["total_xp"] == 150
+        assert (first["commits_today"], first["sessions_today"]) == (2, 1)
+        assert body["profiles"][ids[1]]["commits_today"] == 0
+        assert "quests" in first
+
+    def test_one_query_set_for_the_whole_batch(self, batch):
+        ids = batch["ids"]
+        batch["client"].post("/api/profiles:batch", json={"device_ids": ids})
+        batch["devices"].assert_called_once_with(ANY, ids)
+
+    def test_cached_profiles_skip_the_db(self, batch):
+        ids = batch["ids"][:2]
+        batch["client"].post("/api/profiles:batch", json={"device_ids": ids})
+        res = batch["client"].post("/api/profiles:batch", json={"device_ids": ids})
+        assert list(res.json()["profiles"]) == ids
+        assert batch["devices"].call_count == 1
+
+    def test_rejects_oversized_batch(self, app_client):
+        ids = [str(uuid.uuid4()) for _ in range(201)]
+        res = app_client["client"].post("/api/profiles:batch", json={"device_ids": ids})
+        assert res.status_code == 422
+
+    def test_rejects_invalid_id(self, app_client):
+        res = app_client["client"].post("/api/profiles:batch", json={"device_ids": ["nope"]})
+        assert res.status_code == 422
+
+
+# ── Live updates ──────────────────────────────────────────────────────────────
+
+class TestLiveUpdates:
+    def test_stream_unknown_device_returns_404(self, app_client):
+        c = app_client["client"]
+        app_client["get_device"].return_value = None
+        res = c.get(f"/api/profile/{uuid.uuid4()}/stream")
+        assert res.status_code == 404
+
+    def test_xp_award_is_published(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id, xp=40)
+
+        with patch("app.main.publish") as publish:
+            res = c.post(
+                "/api/events",
+                json={
+                    "hook_event_name": "PostToolUse",
+                    "tool_name": "Bash",
+                    "session_id": str(uuid.uuid4()),
+                    "tool_input": {"command": "pytest"},
+                    "tool_response": {"exit_code": 0},
+                },
+                headers={"Authorization": f"Bearer {device_id}"},
+            )
+        assert res.status_code == 200
+        events = {call.args[1]: call.args[2] for call in publish.call_args_list}
+        # +8 for the test pass, +10 for completing the daily Quality Check quest
+        assert events["xp"] == {"source": "test_pass", "amount": 18, "total_xp": 58}
+        assert events["quest_complete"]["quest_id"] == "daily_quality_check"
+
+    def test_level_up_is_published(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id, xp=45)
+
+        with patch("app.main.publish") as publish:
+            c.post(
+                "/api/events",
+                json={
+                    "hook_event_name": "PostToolUse",
+                    "tool_name": "Bash",
+                    "session_id": str(uuid.uuid4()),
+                    "tool_input": {"command": "pytest"},
+                    "tool_response": {"exit_code": 0},
+                },
+                headers={"Authorization": f"Bearer {device_id}"},
+            )
+        events = {call.args[1]: call.args[2] for call in publish.call_args_list}
+        assert events["level_up"]["level"] == 1
+
+
+# ── Activity heatmap ──────────────────────────────────────────────────────────
+
+class TestActivity:
+    def _get(self, app_client, device_id, history, today_counts, **params):
+        with patch("app.main.get_activity_series", return_value=history) as series, \
+                patch("app.main.get_activity_day", return_value=today_counts) as day:
+            res = app_client["client"].get(f"/api/activity/{device_id}", params=params)
+        return res, series, day
+
+    def test_dense_counts_with_today_read_live(self, app_client):
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        today = datetime.now(timezone.utc).date()
+        start = today - timedelta(days=3)
+        res, series, _ = self._get(app_client, device_id,
+                                   {"commit": [1, 0, 2], "session": [0, 0, 1]}, {"commit": 4, "test": 1},
+                                   **{"from": start.isoformat(), "by_source": "true"})
+        body = res.json()
+        assert body["from"] == start.isoformat() and body["to"] == today.isoformat()
+        assert body["counts"] == [1, 0, 3, 5]
+        assert body["by_source"] == {"commit": [1, 0, 2, 4], "session": [0, 0, 1, 0], "test": [0, 0, 0, 1]}
+        series.assert_called_once_with(ANY, device_id, start, today - timedelta(days=1))
+
+    def test_history_cached_for_the_day(self, app_client):
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        self._get(app_client, device_id, {"commit": [1] * 364}, {})
+        res, series, day = self._get(app_client, device_id, {}, {"commit": 2})
+        assert series.call_count == 0 and day.call_count == 1
+        counts = res.json()["counts"]
+        assert len(counts) == 365 and counts[0] == 1 and counts[-1] == 2
+        assert "by_source" not in res.json()
+
+    def test_write_keeps_cached_history(self, app_client):
+        from app.cache import bump_version
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        self._get(app_client, device_id, {"commit": [1] * 364}, {})
+        bump_version(device_id)   # any award or stats write: past days are unchanged
+        _, series, _ = self._get(app_client, device_id, {}, {"commit": 3})
+        assert series.call_count == 0
+
+    def test_deleted_device_is_not_served_from_cache(self, app_client):
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        assert self._get(app_client, device_id, {"commit": [1] * 364}, {})[0].status_code == 200
+
+        res = app_client["client"].delete("/api/me", headers={"Authorization": f"Bearer {device_id}"})
+        assert res.status_code == 200
+        app_client["get_device"].return_value = None
+        assert self._get(app_client, device_id, {}, {})[0].status_code == 404
+
+    def test_past_year_skips_today(self, app_client):
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        res, series, day = self._get(app_client, device_id, {}, {}, year=2024)
+        assert res.json()["from"] == "2024-01-01" and len(res.json()["counts"]) == 366
+        series.assert_called_once_with(ANY, device_id, date(2024, 1, 1), date(2024, 12, 31))
+        assert day.call_count == 0
+
+    @pytest.mark.parametrize("params", [
+        {"year": 2024, "from": "2024-01-01"},
+        {"from": "2024-02-01", "to": "2024-01-01"},
+        {"from": "2015-01-01", "to": "2024-01-01"},
+    ])
+    def test_rejects_bad_ranges(self, app_client, params):
+        res, _, _ = self._get(app_client, str(uuid.uuid4()), {}, {}, **params)
+        assert res.status_code == 400
+
+    def test_unknown_device(self, app_client):
+        res, _, _ = self._get(app_client, str(uuid.uuid4()), {}, {})
+        assert res.status_code == 404
+
+
+# ── Coding stats ──────────────────────────────────────────────────────────────
+
+def _hours(**counts):
+    return [counts.get(f"h{h}", 0) for h in range(24)]
+
+
+class TestCodingStats:
+    def test_merges_daily_buckets(self, app_client):
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        days = [
+            {"projects": {"api": 5, "web": 2}, "tools": {"Edit": 4, "Bash": 3}, "hours": _hours(h9=5, h14=2)},
+            {"projects": {"web": 6}, "tools": {"Bash": 2}, "hours": _hours(h14=6)},
+        ]
+        with patch("app.main.get_coding_stats_days", return_value=days) as get_days:
+            res = app_client["client"].get(f"/api/stats/{device_id}")
+        assert res.status_code == 200
+        body = res.json()
+        assert body["top_projects"] == [{"name": "web", "count": 8}, {"name": "api", "count": 5}]
+        assert body["tool_usage"] == [{"tool": "Bash", "count": 5}, {"tool": "Edit", "count": 4}]
+        assert body["peak_hour"] == 14
+        get_days.assert_called_once_with(ANY, device_id)
+
+    def test_no_activity(self, app_client):
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        with patch("app.main.get_coding_stats_days", return_value=[]):
+            body = app_client["client"].get(f"/api/stats/{device_id}").json()
+        assert body == {"top_projects": [], "tool_usage": [], "peak_hour": None}
+
+    def test_unknown_device(self, app_client):
+        with patch("app.main.get_coding_stats_days", return_value=[]):
+            res = app_client["client"].get(f"/api/stats/{uuid.uuid4()}")
+        assert res.status_code == 404
+
 
 # ── Leaderboard ───────────────────────────────────────────────────────────────
 
@@ -313,6 +956,181 @@ class TestLeaderboard:
         assert res.status_code == 200
         assert "leaderboard" in res.json()
 
+    def test_lifetime_page(self, app_client):
+        device_id = str(uuid.uuid4())
+        rows = [{"device_id": device_id, "score": 150, "total_xp": 150, "current_streak": 3,
+                 "devices": {"character_name": "TestHero", "show_on_leaderboard": True}}]
+        with patch("app.main.get_leaderboard_page", return_value=rows) as page:
+            res = app_client["client"].get("/api/leaderboard")
+        assert res.status_code == 200
+        body = res.json()
+        [entry] = body["leaderboard"]
+        assert (entry["character_name"], entry["xp"], entry["total_xp"]) == ("TestHero", 150, 150)
+        assert entry["level"] >= 1
+        assert body["next_cursor"] is None   # a short page is the last one
+        page.assert_called_once_with(ANY, "all", None, 20, None)
+
+    def test_weekly_page_reads_period_buckets(self, app_client):
+        from datetime import date, timedelta
+        device_id = str(uuid.uuid4())
+        rows = [{"device_id": device_id, "score": 40,
+                 "devices": {"character_name": "TestHero", "show_on_leaderboard": True,
+                             "user_stats": {"total_xp": 900, "current_streak": 2}}}]
+        with patch("app.main.get_leaderboard_page", return_value=rows) as page:
+            res = app_client["client"].get("/api/leaderboard?period=week&limit=1")
+        body = res.json()
+        _, period, start, limit, after = page.call_args.args
+        assert (period, limit, after) == ("week", 1, None)
+        assert start.weekday() == 0 and date.today() - start < timedelta(days=8)
+        assert body["period_start"] == start.isoformat()
+        [entry] = body["leaderboard"]
+        assert (entry["xp"], entry["total_xp"], entry["current_streak"]) == (40, 900, 2)
+        assert body["next_cursor"] == f"40:{device_id}"
+
+    def test_cursor_is_passed_through(self, app_client):
+        device_id = str(uuid.uuid4())
+        with patch("app.main.get_leaderboard_page", return_value=[]) as page:
+            res = app_client["client"].get(f"/api/leaderboard?period=month&after=40:{device_id}")
+        assert res.status_code == 200
+        assert page.call_args.args[4] == (40, device_id)
+
+    def test_zero_cache_seconds_reads_every_time(self, app_client):
+        from app.cache import leaderboard_cache
+        with patch("app.main.LEADERBOARD_CACHE_SECONDS", 0), \
+                patch("app.main.get_leaderboard_page", return_value=[]) as page:
+            for _ in range(2):
+                assert app_client["client"].get("/api/leaderboard").status_code == 200
+        assert page.call_count == 2 and len(leaderboard_cache) == 0
+
+    def test_bad_cursor_rejected(self, app_client):
+        res = app_client["client"].get('/api/leaderboard?after=40:x"),or(')
+        assert res.status_code == 400
+
+    def test_unknown_period_rejected(self, app_client):
+        res = app_client["client"].get("/api/leaderboard?period=year")
+        assert res.status_code == 422
+
+    def test_pages_are_cached(self, app_client):
+        with patch("app.main.get_leaderboard_page", return_value=[]) as page:
+            app_client["client"].get("/api/leaderboard?period=day")
+            app_client["client"].get("/api/leaderboard?period=day")
+        assert page.call_count == 1
+
+
+class TestPeriodStart:
+    def test_buckets(self):
+        from datetime import date
+        from app.db import period_start
+        wednesday = date(2026, 10, 21)
+        assert period_start("day", wednesday) == wednesday
+        assert period_start("week", wednesday) == date(2026, 10, 19)
+        assert period_start("month", wednesday) == date(2026, 10, 1)
+
+
+# ── Teams ─────────────────────────────────────────────────────────────────────
+
+def _team(team_id, **stats):
+    from datetime import date
+    return {
+        "team_id": team_id, "name": "Platform", "join_code": "letmein", "created_at": "2026-01-01T00:00:00",
+        "team_stats": {
+            "team_id": team_id, "member_count": 3, "total_xp": 4200, "total_commits": 90,
+            "total_test_passes": 40, "last_active_date": date.today().isoformat(),
+            "active_members": 2, "current_streak": 5, "longest_streak": 8, **stats,
+        },
+    }
+
+
+class TestTeams:
+    def test_create_team(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        with patch("app.main.create_team") as create:
+            res = c.post("/api/teams", json={"name": "Platform"}, headers={"Authorization": f"Bearer {device_id}"})
+        assert res.status_code == 201
+        body = res.json()
+        create.assert_called_once_with(ANY, body["team_id"], "Platform", body["join_code"], device_id)
+
+    def test_join_requires_code(self, app_client):
+        c = app_client["client"]
+        device_id, team_id = str(uuid.uuid4()), str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        headers = {"Authorization": f"Bearer {device_id}"}
+        with patch("app.main.get_team", return_value=_team(team_id)), \
+                patch("app.main.add_team_member") as add:
+            wrong = c.post(f"/api/teams/{team_id}/members", json={"join_code": "nope"}, headers=headers)
+            right = c.post(f"/api/teams/{team_id}/members", json={"join_code": "letmein"}, headers=headers)
+        assert wrong.status_code == 403
+        assert right.status_code == 200
+        add.assert_called_once_with(ANY, team_id, device_id)
+
+    def test_join_unknown_team(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        with patch("app.main.get_team", return_value=None):
+            res = c.post(f"/api/teams/{uuid.uuid4()}/members", json={"join_code": "x"},
+                         headers={"Authorization": f"Bearer {device_id}"})
+        assert res.status_code == 404
+
+    def test_get_team_reads_one_row(self, app_client):
+        team_id = str(uuid.uuid4())
+        with patch("app.main.get_team", return_value=_team(team_id)) as get_team:
+            res = app_client["client"].get(f"/api/teams/{team_id}")
+        assert res.status_code == 200
+        body = res.json()
+        assert body["total_xp"] == 4200
+        assert body["active_members_today"] == 2
+        assert body["current_streak"] == 5
+        get_team.assert_called_once()
+        app_client["get_stats"].assert_not_called()
+
+    def test_stale_activity_ages_out(self, app_client):
+        from datetime import date, timedelta
+        team_id = str(uuid.uuid4())
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+        long_ago = (date.today() - timedelta(days=3)).isoformat()
+        c = app_client["client"]
+        with patch("app.main.get_team", return_value=_team(team_id, last_active_date=yesterday)):
+            body = c.get(f"/api/teams/{team_id}").json()
+        assert (body["active_members_today"], body["current_streak"]) == (0, 5)
+        with patch("app.main.get_team", return_value=_team(team_id, last_active_date=long_ago)):
+            body = c.get(f"/api/teams/{team_id}").json()
+        assert (body["current_streak"], body["longest_streak"]) == (0, 8)
+
+    def test_team_leaderboard(self, app_client):
+        rows = [{**_team(str(uuid.uuid4()))["team_stats"], "teams": {"name": "Platform"}}]
+        with patch("app.main.get_team_leaderboard", return_value=rows):
+            res = app_client["client"].get("/api/leaderboard/teams")
+        assert res.status_code == 200
+        [entry] = res.json()["leaderboard"]
+        assert entry["name"] == "Platform"
+        assert entry["total_xp"] == 4200
+
+
+# ── Export ────────────────────────────────────────────────────────────────────
+
+class TestExport:
+    def test_streams_ndjson_and_gzip(self, app_client):
+        import gzip
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        lines = [b'{"format":"x"}\n', b'{"end":true}\n']
+        headers = {"Authorization": f"Bearer {device_id}"}
+        with patch("app.main.iter_export", side_effect=lambda *a: iter(lines)):
+            plain = c.get("/api/me/export", headers=headers)
+            packed = c.get("/api/me/export?gzip=true", headers=headers)
+        assert plain.headers["content-type"] == "application/x-ndjson"
+        assert plain.content == b"".join(lines)
+        assert packed.headers["content-type"] == "application/gzip"
+        assert gzip.decompress(packed.content) == b"".join(lines)
+
+    def test_requires_registered_device(self, app_client):
+        res = app_client["client"].get("/api/me/export", headers={"Authorization": f"Bearer {uuid.uuid4()}"})
+        assert res.status_code == 404
+
 
 # ── Delete ────────────────────────────────────────────────────────────────────
 
@@ -335,6 +1153,20 @@ class TestDeleteMe:
         res = c.delete("/api/me", headers={"Authorization": f"Bearer {device_id}"})
         assert res.status_code == 200
 
+    def test_delete_drops_device_cache_entries(self, app_client):
+        from app.cache import known_extensions, session_results
+        c = app_client["client"]
+        device_id, other = str(uuid.uuid4()), str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        for owner in (device_id, other):
+            known_extensions.put((owner, "py"), True)
+            session_results.put((owner, "s1"), {"xp_awarded": 10})
+
+        c.delete("/api/me", headers={"Authorization": f"Bearer {device_id}"})
+        assert known_extensions.get((device_id, "py")) is None
+        assert session_results.get((device_id, "s1")) is None
+        assert known_extensions.get((other, "py")) and session_results.get((other, "s1"))
+
 
 # ── Deduplication key uses tool_use_id ────────────────────────────────────────
 
@@ -541,11 +1373,11 @@ class TestGitSync:
         assert "updated_fields" in res.json()
 
         upsert_calls = app_client["upsert_stats"].call_args_list
-        # Find the sync-git upsert call (first one with file_extensions)
+        # Find the sync-git upsert call (first one with total_commits)
         updates = None
         for call in upsert_calls:
             args = call.args[2]
-            if "file_extensions" in args:
+            if "total_commits" in args:
                 updates = args
                 break
         assert updates is not None, "sync-git upsert call not found"
@@ -554,7 +1386,9 @@ class TestGitSync:
         assert updates["total_merged_prs"] == 10   # max(3, 10)
         assert updates["total_branches"] == 8      # max(2, 8)
         assert updates["total_insertions"] == 5000  # max(100, 5000)
-        assert set(updates["file_extensions"]) == {"py", "js", "sql", "md"}
+        # Extensions are set-added server-side, never rewritten as a whole list
+        assert "file_extensions" not in updates
+        app_client["add_file_extensions"].assert_called_once_with(ANY, device_id, ["py", "sql", "md"])
 
     def test_sync_git_requires_auth(self, app_client):
         c = app_client["client"]
@@ -629,6 +1463,43 @@ class TestSyncSession:
         assert res.status_code == 200
         assert res.json()["already_processed"] is True
 
+    def test_retry_replays_first_result_from_cache(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        app_client["get_stats"].return_value = _make_stats(device_id, xp=100)
+        summary = self._session_summary()
+        headers = {"Authorization": f"Bearer {device_id}"}
+
+        first = c.post("/api/me/sync-session", json=summary, headers=headers).json()
+        app_client["award_xp"].reset_mock()
+        app_client["get_session_result"].reset_mock()
+        app_client["is_already_processed"].reset_mock()
+        retry = c.post("/api/me/sync-session", json=summary, headers=headers).json()
+
+        assert first["already_processed"] is False and retry["already_processed"] is True
+        assert {k: v for k, v in retry.items() if k != "already_processed"} == \
+            {k: v for k, v in first.items() if k != "already_processed"}
+        assert first["total_xp"] >= 100 + first["xp_awarded"]   # plus any quest rewards
+        saved = app_client["save_session_result"].call_args.args
+        assert saved[1:3] == (device_id, summary["session_id"]) and "already_processed" not in saved[3]
+        app_client["award_xp"].assert_not_called()
+        app_client["get_session_result"].assert_not_called()
+        app_client["is_already_processed"].assert_not_called()
+
+    def test_retry_on_another_worker_reads_stored_result(self, app_client):
+        c = app_client["client"]
+        device_id = str(uuid.uuid4())
+        app_client["get_device"].return_value = _make_device(device_id)
+        stored = {"status": "ok", "xp_awarded": 77, "quest_completions": [], "total_xp": 500,
+                  "level": 3, "current_streak": 2}
+        app_client["get_session_result"].return_value = stored
+        res = c.post("/api/me/sync-session", json=self._session_summary(),
+                     headers={"Authorization": f"Bearer {device_id}"})
+        assert res.json() == {**stored, "already_processed": True}
+        app_client["is_already_processed"].assert_not_called()
+        app_client["award_xp"].assert_not_called()
+
     def test_sync_session_xp_breakdown(self, app_client):
         """Verify XP amounts: 3 commits * 15 + 5 tests * 8 + 1 PR * 12 + 1 branch * 5 + session_commit 20."""
         c = app_client["client"]
@@ -679,7 +1550,7 @@ class TestSyncSession:
         assert updates["total_sessions"] == 8  # was 7, +1
 
     def test_sync_session_merges_file_extensions(self, app_client):
-        """File extensions should be union-merged with existing ones."""
+        """File extensions are set-added server-side, not read-union-written."""
         c = app_client["client"]
         device_id = str(uuid.uuid4())
         app_client["get_device"].return_value = _make_device(device_id)
@@ -694,15 +1565,9 @@ class TestSyncSession:
             headers={"Authorization": f"Bearer {device_id}"},
         )
         assert res.status_code == 200
+        app_client["add_file_extensions"].assert_called_once_with(ANY, device_id, ["py", "sql", "md"])
         upsert_calls = app_client["upsert_stats"].call_args_list
-        updates = None
-        for call in upsert_calls:
-            args = call.args[2]
-            if "file_extensions" in args:
-                updates = args
-                break
-        assert updates is not None
-        assert set(updates["file_extensions"]) == {"py", "js", "sql", "md"}
+        assert not [c for c in upsert_calls if "file_extensions" in c.args[2]]
 
 
 # ── Debug endpoints ──────────────────────────────────────────────────────────
@@ -719,3 +1584,117 @@ class TestDebugEndpoints:
         app_client["get_device"].return_value = None
         res = c.get(f"/api/debug/event-count/{uuid.uuid4()}")
         assert res.status_code == 404
+
+    def test_event_count_groups_rows_from_rpc(self, app_client):
+        c = app_client["client"]
+        app_client["get_device"].return_value = {"device_id": "d"}
+        groups = [
+            {"day": "2026-03-01", "event_type": "PostToolUse", "events": 40,
+             "first_at": "2026-03-01T09:00:00+00:00", "last_at": "2026-03-01T18:00:00+00:00"},
+            {"day": "2026-03-01", "event_type": "Stop", "events": 2,
+             "first_at": "2026-03-01T12:00:00+00:00", "last_at": "2026-03-01T18:05:00+00:00"},
+            {"day": "2026-03-02", "event_type": "Stop", "events": 1,
+             "first_at": "2026-03-02T10:00:00+00:00", "last_at": "2026-03-02T10:00:00+00:00"},
+        ]
+        with patch("app.main.get_event_counts", return_value=groups):
+            body = c.get(f"/api/debug/event-count/{uuid.uuid4()}").json()
+        assert body["total_events"] == 43
+        assert body["by_day"] == {"2026-03-01": {"PostToolUse": 40, "Stop": 2}, "2026-03-02": {"Stop": 1}}
+        assert body["first_event_at"] == "2026-03-01T09:00:00+00:00"
+        assert body["last_event_at"] == "2026-03-02T10:00:00+00:00"
+
+    def _xp_rows(self, n):
+        return [{"id": str(uuid.UUID(int=i, version=4)), "source": "commit", "amount": 15,
+                 "created_at": f"2026-03-01T10:00:{i:02d}+00:00"} for i in range(n)]
+
+    def test_xp_log_pages_entries_and_summarises_in_sql(self, app_client):
+        c = app_client["client"]
+        app_client["get_device"].return_value = {"device_id": "d"}
+        summary = [{"day": "2026-03-01", "source": "commit", "entries": 5, "xp": 75,
+                    "first_at": "x", "last_at": "y"}]
+        with patch("app.main.get_xp_summary", return_value=summary), \
+                patch("app.main.iter_xp_log", side_effect=lambda *a, **k: iter(self._xp_rows(5))) as it:
+            body = c.get(f"/api/debug/xp-log/{uuid.uuid4()}?limit=3").json()
+        assert body["total_entries"] == 5 and body["total_xp"] == 75
+        assert body["summary"] == {"commit@2026-03-01": 5}
+        assert len(body["entries"]) == 3
+        last = body["entries"][-1]
+        from app.main import _parse_log_cursor
+        cursor = body["next_cursor"]
+        assert "+" not in cursor and "/" not in cursor and "=" not in cursor
+        assert _parse_log_cursor(cursor) == (last["created_at"], last["id"])
+        assert it.call_args.kwargs == {"page_size": 4, "after": None}
+
+    def test_xp_log_follows_cursor(self, app_client):
+        c = app_client["client"]
+        app_client["get_device"].return_value = {"device_id": "d"}
+        from app.main import _log_cursor
+        row_id = str(uuid.uuid4())
+        cursor = _log_cursor({"created_at": "2026-03-01T10:00:00+00:00", "id": row_id})
+        with patch("app.main.get_xp_summary", return_value=[]), \
+                patch("app.main.iter_xp_log", side_effect=lambda *a, **k: iter(self._xp_rows(2))) as it:
+            # Pasted into the query string as is, the way a client follows it.
+            body = c.get(f"/api/debug/xp-log/{uuid.uuid4()}?after={cursor}").json()
+        assert it.call_args.kwargs["after"] == ("2026-03-01T10:00:00+00:00", row_id)
+        assert body["next_cursor"] is None
+
+    @pytest.mark.parametrize("raw", [
+        "nope", "2026-03-01|not-a-uuid", f"yesterday|{uuid.uuid4()}", b"\xff\xfe|x",
+    ])
+    def test_xp_log_rejects_bad_cursor(self, app_client, raw):
+        import base64
+        for after in (base64.urlsafe_b64encode(raw if isinstance(raw, bytes) else raw.encode()).decode(),
+                      "not base64!"):
+            res = app_client["client"].get(f"/api/debug/xp-log/{uuid.uuid4()}", params={"after": after})
+            assert res.status_code == 400
+
+
+# ── Reprocess ────────────────────────────────────────────────────────────────
+
+class TestReprocessDryRun:
+    def _events(self):
+        return [
+            {"event_type": "SessionStart", "received_at": "2026-03-01T09:00:00+00:00",
+             "data": {"session_id": "s1"}},
+            {"event_type": "PostToolUse", "received_at": "2026-03-01T09:30:00+00:00",
+             "data": {"hook_event_name": "PostToolUse", "session_id": "s1", "tool_name": "Bash",
+                      "tool_input": {"command": "git commit -m x"},
+                      "tool_response": {"exit_code": 0}}},
+        ]
+
+    def _sessions(self):
+        return [
+            {"started_at": "2026-03-01T09:00:00+00:00", "ended_at": "2026-03-01T10:15:00+00:00",
+             "minutes": 75, "started_by_hook": True},
+        ]
+
+    def test_dry_run_reports_without_writing(self, app_client):
+        from app.main import _reprocess_events
+        app_client["get_stats"].return_value = {"total_xp": 25}
+        install = {"id": "x1", "source": "install", "amount": 25, "created_at": "2026-03-01T08:00:00+00:00"}
+
+        with patch("app.main.iter_events", return_value=iter(self._events())), \
+             patch("app.main.iter_xp_log", return_value=iter([install])), \
+             patch("app.main.iter_sessions", return_value=iter(self._sessions())), \
+             patch("app.main.award_xp_at") as award_xp_at:
+            result = _reprocess_events(MagicMock(), "dev", dry_run=True)
+
+        award_xp_at.assert_not_called()
+        app_client["upsert_stats"].assert_not_called()
+        assert result["entries_added"] == 2   # commit + first_session
+        assert result["total_xp"] == 25 + 15 + 10
+        assert result["stats_diff"]["total_commits"] == [None, 1]
+        assert result["stats_diff"]["total_session_minutes"] == [None, 75]
+
+    def test_first_session_bonus_needs_hook_start(self, app_client):
+        """A session only known from a transcript sync does not earn first_session."""
+        from app.main import _reprocess_events
+        synced = [{**self._sessions()[0], "started_by_hook": False}]
+
+        with patch("app.main.iter_events", return_value=iter(self._events()[1:])), \
+             patch("app.main.iter_xp_log", return_value=iter([])), \
+             patch("app.main.iter_sessions", return_value=iter(synced)), \
+             patch("app.main.award_xp_at"):
+            result = _reprocess_events(MagicMock(), "dev", dry_run=True)
+
+        assert [a["source"] for a in result["_debug"]["to_award"]] == ["commit"]
@@ -0,0 +1,225 @@
+"""
+Tests for the keyset pagination helpers in app.db, against a fake
+PostgREST query builder that enforces a max-rows cap like the real server,
+and for how db writes and the invalidation feed move cache versions.
+"""
+import re
+import uuid
+from unittest.mock import MagicMock
+
+from app import cache
+from app.cache import InvalidationPoller, bump_version, get_version
+from app.db import add_file_extensions, claim_quest, upsert_session, iter_events, iter_xp_log, get_quest_progress_batch
+
+MAX_ROWS = 3   # server-side cap, smaller than the requested page size
+
+
+class FakeQuery:
+    def __init__(self, rows, order_col, calls, tie_col="id"):
+        self.rows, self.order_col, self.calls, self.tie_col = rows, order_col, calls, tie_col
+        self.cursor = None
+        self.since = None
+        self.n = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, col, val):
+        self.rows = [r for r in self.rows if r[col] == val]
+        return self
+
+    def in_(self, col, vals):
+        self.rows = [r for r in self.rows if r[col] in vals]
+        return self
+
+    def gte(self, col, val):
+        self.since = val
+        return self
+
+    def or_(self, expr):
+        ts, row_id = re.search(r'\.gt\."([^"]+)",and\(.*id\.gt\."([^"]+)"\)', expr).groups()
+        self.cursor = (ts, row_id)
+        return self
+
+    def order(self, col):
+        return self
+
+    def limit(self, n):
+        self.n = n
+        return self
+
+    def execute(self):
+        self.calls.append(self.cursor)
+        key = lambda r: (r[self.order_col], r[self.tie_col])
+        rows = sorted(self.rows, key=key)
+        if self.since:
+            rows = [r for r in rows if r[self.order_col] >= self.since]
+        if self.cursor:
+            rows = [r for r in rows if key(r) > self.cursor]
+        res = MagicMock()
+        res.data = rows[:min(self.n, MAX_ROWS)]
+        return res
+
+
+def _fake_db(table_rows, order_col, tie_col="id"):
+    calls = []
+    db = MagicMock()
+    db.table.side_effect = lambda name: FakeQuery(list(table_rows), order_col, calls, tie_col)
+    return db, calls
+
+
+def _events(n, device_id="dev"):
+    # Pairs of events share a timestamp so the id tie-breaker matters.
+    return [
+        {"id": f"id{i:03d}", "device_id": device_id, "event_type": "PostToolUse",
+         "received_at": f"2026-03-01T10:00:{i // 2:02d}+00:00", "data": {}}
+        for i in range(n)
+    ]
+
+
+class TestIterEvents:
+    def test_reads_past_server_row_cap(self):
+        rows = _events(10) + _events(4, device_id="other")
+        db, _ = _fake_db(rows, "received_at")
+        got = list(iter_events(db, "dev", page_size=1000))
+        assert [r["id"] for r in got] == [f"id{i:03d}" for i in range(10)]
+
+    def test_is_lazy(self):
+        db, calls = _fake_db(_events(10), "received_at")
+        it = iter_events(db, "dev", page_size=2)
+        next(it)
+        assert len(calls) == 1
+
+    def test_since_filter(self):
+        db, _ = _fake_db(_events(10), "received_at")
+        got = list(iter_events(db, "dev", since="2026-03-01T10:00:03+00:00"))
+        assert [r["id"] for r in got] == ["id006", "id007", "id008", "id009"]
+
+    def test_empty(self):
+        db, calls = _fake_db([], "received_at")
+        assert list(iter_events(db, "dev")) == []
+        assert len(calls) == 1
+
+    def test_resumes_after_cursor(self):
+        db, _ = _fake_db(_events(10), "received_at")
+        # id004 and id005 share a timestamp; resuming after id004 must still yield id005.
+        got = list(iter_events(db, "dev", page_size=3, after=("2026-03-01T10:00:02+00:00", "id004")))
+        assert [r["id"] for r in got] == [f"id{i:03d}" for i in range(5, 10)]
+
+
+class TestIterXpLog:
+    def test_pages_in_created_at_order(self):
+        rows = [
+            {"id": f"x{i}", "device_id": "dev", "source": "commit", "amount": 15,
+             "created_at": f"2026-03-0{9 - i}T12:00:00+00:00"}
+            for i in range(7)
+        ]
+        db, _ = _fake_db(rows, "created_at")
+        got = list(iter_xp_log(db, "dev", page_size=2))
+        assert [r["created_at"][:10] for r in got] == [f"2026-03-0{d}" for d in range(3, 10)]
+
+
+class TestQuestProgressBatch:
+    def test_pages_across_devices(self):
+        rows = [
+            {"device_id": device_id, "quest_id": f"q{i}", "completed_at": None}
+            for device_id in ("a", "b", "c") for i in range(4)
+        ]
+        db, calls = _fake_db(rows, "device_id", tie_col="quest_id")
+        got = get_quest_progress_batch(db, ["a", "c", "missing"], page_size=1000)
+        assert sorted(got) == ["a", "c", "missing"]
+        assert sorted(got["a"]) == ["q0", "q1", "q2", "q3"]
+        assert sorted(got["c"]) == ["q0", "q1", "q2", "q3"]
+        assert got["missing"] == {}
+        assert len(calls) == 4   # 8 rows at 3 per page, then the empty page
+
+
+class TestClaimQuest:
+    def test_version_bumped_only_when_claimed(self):
+        db = MagicMock()
+        device_id = str(uuid.uuid4())
+        db.rpc.return_value.execute.return_value.data = False
+        before = get_version(device_id)
+        assert claim_quest(db, device_id, "first_commit") is False
+        assert get_version(device_id) == before
+
+        db.rpc.return_value.execute.return_value.data = True
+        assert claim_quest(db, device_id, "first_commit") is True
+        assert get_version(device_id) == before + 1
+
+
+class TestAddFileExtensions:
+    def test_version_bumped_only_when_the_count_grows(self):
+        db = MagicMock()
+        device_id = str(uuid.uuid4())
+        before = get_version(device_id)
+        for count, extensions in [(2, [".py", ".ts"]), (2, [".py"]), (3, [".rs"]), (3, [".ts", ".rs"])]:
+            db.rpc.return_value.execute.return_value.data = count
+            assert add_file_extensions(db, device_id, extensions) == count
+        assert get_version(device_id) == before + 2   # first call (nothing known yet) and .rs
+
+
+class TestUpsertSession:
+    def test_sync_goes_through_rpc_that_keeps_started_at(self):
+        db = MagicMock()
+        upsert_session(db, "dev", "s1", {"minutes": 30, "commits": 2, "test_passes": 1,
+                                         "started_at": "2026-01-01T23:50:00Z"})
+        name, params = db.rpc.call_args.args
+        assert name == "upsert_synced_session"
+        assert params["p_started_at"] == "2026-01-01T23:50:00Z" and params["p_ended_at"] is None
+        db.table.assert_not_called()   # a table upsert would overwrite the hook's started_at
+
+
+class TestInvalidationPoller:
+    def test_starts_at_newest_then_bumps_each_new_row(self):
+        a, b = str(uuid.uuid4()), str(uuid.uuid4())
+        feed = [{"device_id": a, "seq": 7}, {"device_id": b, "seq": 8}, {"device_id": a, "seq": 9}]
+        rows = [{"device_id": "old", "seq": 5}]
+
+        def fetch(after):
+            if after is None:
+                return rows[-1:]
+            return [r for r in rows if r["seq"] > after][:2]   # pages of two
+
+        poller = InvalidationPoller(fetch)
+        assert poller.poll() == 0 and poller.cursor == 5   # history is not replayed
+        before_a, before_b = get_version(a), get_version(b)
+        rows.extend(feed)
+        assert poller.poll() == 3
+        assert poller.cursor == 9
+        assert (get_version(a), get_version(b)) == (before_a + 2, before_b + 1)
+        assert poller.poll() == 0
+
+    def test_empty_feed_starts_from_zero(self):
+        poller = InvalidationPoller(lambda after: [])
+        poller.poll()
+        assert poller.cursor == 0
+
+    def test_feed_bumps_are_not_broadcast(self, monkeypatch):
+        sent = []
+        monkeypatch.setattr(cache, "broadcast", sent.append)
+        device = str(uuid.uuid4())
+        rows = [{"device_id": "old", "seq": 1}]
+        poller = InvalidationPoller(lambda after: [r for r in rows if after is None or r["seq"] > after])
+        poller.poll()
+        rows.append({"device_id": device, "seq": 2})
+        poller.poll()
+        assert sent == []   # every host reads the feed itself
+
+
+class TestBroadcast:
+    def test_bump_is_announced_to_other_hosts(self, monkeypatch):
+        sent = []
+        monkeypatch.setattr(cache, "broadcast", sent.append)
+        device = str(uuid.uuid4())
+        before = get_version(device)
+        assert bump_version(device) == before + 1
+        assert sent == [device]
+
+    def test_failed_broadcast_still_bumps(self, monkeypatch):
+        def down(device_id):
+            raise ConnectionError("redis unreachable")
+        monkeypatch.setattr(cache, "broadcast", down)
+        device = str(uuid.uuid4())
+        before = get_version(device)
+        assert bump_version(device) == before + 1
@@ -0,0 +1,188 @@
+"""
+Tests for app.encoding: Accept-Encoding negotiation, response compression
+and request decompression.
+"""
+import gzip
+import json
+from unittest.mock import patch
+
+import brotli
+import pytest
+import zstandard
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.encoding import (
+    BodyTooLarge, CompressionMiddleware, DecompressionMiddleware, DefaultJSONResponse, gunzip, negotiate, unzstd,
+)
+
+BIG = {"counts": list(range(2000))}
+
+
+@pytest.fixture
+def client():
+    app = FastAPI(default_response_class=DefaultJSONResponse)
+    app.add_middleware(CompressionMiddleware, minimum_size=500)
+
+    @app.get("/big")
+    def big():
+        return BIG
+
+    @app.get("/small")
+    def small():
+        return {"ok": True}
+
+    def chunks():
+        for i in range(50):
+            yield f"{i}\n".encode() * 20
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    @app.get("/sse")
+    def sse():
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.get("/gz")
+    def gz():
+        return StreamingResponse(iter([gzip.compress(b"x" * 5000)]), media_type="application/gzip")
+
+    return TestClient(app)
+
+
+def _get(client, path, accept="gzip"):
+    # Read the raw bytes: httpx would otherwise decode the body.
+    with client.stream("GET", path, headers={"Accept-Encoding": accept}) as res:
+        return res, b"".join(res.iter_raw())
+
+
+class TestNegotiate:
+    @pytest.mark.parametrize("header, expected", [
+        ("gzip, deflate", "gzip"),
+        ("", None),
+        ("identity", None),
+        ("gzip;q=0", None),
+        ("*", "gzip"),
+        ("GZIP ; q=0.5", "gzip"),
+    ])
+    def test_gzip_only(self, header, expected):
+        with patch.dict("app.encoding.ENCODERS", clear=True, gzip=object()):
+            assert negotiate(header) == expected
+
+    def test_br_offered_with_brotli_installed(self):
+        assert negotiate("br, gzip") == "br"
+
+    def test_prefers_br_then_higher_q(self):
+        encoders = {"br": object(), "gzip": object()}
+        with patch.dict("app.encoding.ENCODERS", encoders, clear=True):
+            assert negotiate("gzip, br") == "br"
+            assert negotiate("br;q=0.5, gzip") == "gzip"
+
+
+class TestCompressionMiddleware:
+    def test_large_json_is_gzipped(self, client):
+        res, raw = _get(client, "/big")
+        assert res.headers["content-encoding"] == "gzip"
+        assert res.headers["vary"] == "Accept-Encoding"
+        assert int(res.headers["content-length"]) == len(raw)
+        assert gzip.decompress(raw).startswith(b'{"counts":[0,1,2,')
+
+    def test_small_and_unaccepted_are_left_alone(self, client):
+        res, _ = _get(client, "/small")
+        assert "content-encoding" not in res.headers
+        res, raw = _get(client, "/big", accept="identity")
+        assert "content-encoding" not in res.headers and raw.startswith(b'{"counts"')
+
+    def test_stream_compressed_chunkwise(self, client):
+        res, raw = _get(client, "/stream")
+        assert res.headers["content-encoding"] == "gzip"
+        assert gzip.decompress(raw) == b"".join(f"{i}\n".encode() * 20 for i in range(50))
+
+    def test_brotli_preferred_when_accepted(self, client):
+        res, raw = _get(client, "/big", accept="gzip, deflate, br")
+        assert res.headers["content-encoding"] == "br"
+        assert int(res.headers["content-length"]) == len(raw)
+        assert json.loads(brotli.decompress(raw)) == BIG
+        res, raw = _get(client, "/big", accept="br;q=0.5, gzip")
+        assert res.headers["content-encoding"] == "gzip"
+
+    def test_brotli_stream(self, client):
+        res, raw = _get(client, "/stream", accept="br")
+        assert res.headers["content-encoding"] == "br"
+        assert brotli.decompress(raw) == b"".join(f"{i}\n".encode() * 20 for i in range(50))
+
+    @pytest.mark.parametrize("path", ["/sse", "/gz"])
+    def test_sse_and_compressed_bodies_pass_through(self, client, path):
+        res, _ = _get(client, path)
+        assert "content-encoding" not in res.headers
+
+
+@pytest.fixture
+def upload_client():
+    app = FastAPI()
+    app.add_middleware(DecompressionMiddleware, max_size=10_000)
+
+    @app.post("/echo")
+    async def echo(request: Request, body: dict):
+        return {"body": body, "content_length": request.headers["content-length"],
+                "encoding": request.headers.get("content-encoding")}
+
+    return TestClient(app)
+
+
+def _post(client, raw: bytes, encoding: str | None = "gzip"):
+    headers = {"Content-Type": "application/json"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return client.post("/echo", content=raw, headers=headers)
+
+
+class TestDecompressionMiddleware:
+    def test_gzip_body_reaches_route_as_json(self, upload_client):
+        payload = {"tool_response": {"stdout": "ok\n" * 1000}}
+        raw = json.dumps(payload).encode()
+        res = _post(upload_client, gzip.compress(raw))
+        assert res.status_code == 200
+        assert res.json() == {"body": payload, "content_length": str(len(raw)), "encoding": None}
+
+    def test_plain_body_untouched(self, upload_client):
+        assert _post(upload_client, b'{"a": 1}', encoding=None).json()["body"] == {"a": 1}
+
+    def test_bomb_is_refused(self, upload_client):
+        bomb = gzip.compress(b"[" + b"0," * 50_000 + b"0]")
+        assert len(bomb) < 1000
+        assert _post(upload_client, bomb).status_code == 413
+
+    def test_garbage_and_unknown_encodings(self, upload_client):
+        assert _post(upload_client, b"not gzip").status_code == 400
+        assert _post(upload_client, gzip.compress(b'{"a": 1}')[:-8]).status_code == 400
+        res = _post(upload_client, b"{}", encoding="compress")
+        assert res.status_code == 415 and "gzip" in res.headers["accept-encoding"]
+
+    def test_gunzip_limit_spans_members(self):
+        two = gzip.compress(b"x" * 600) + gzip.compress(b"y" * 600)
+        assert gunzip(two, 1200) == b"x" * 600 + b"y" * 600
+        with pytest.raises(BodyTooLarge):
+            gunzip(two, 1199)
+
+    def test_zstd_body_reaches_route_as_json(self, upload_client):
+        payload = {"tool_response": {"stdout": "ok\n" * 1000}}
+        raw = json.dumps(payload).encode()
+        res = _post(upload_client, zstandard.ZstdCompressor().compress(raw), encoding="zstd")
+        assert res.status_code == 200
+        assert res.json() == {"body": payload, "content_length": str(len(raw)), "encoding": None}
+
+    def test_zstd_bomb_is_refused(self, upload_client):
+        bomb = zstandard.ZstdCompressor().compress(b"[" + b"0," * 50_000 + b"0]")
+        assert len(bomb) < 1000
+        assert _post(upload_client, bomb, encoding="zstd").status_code == 413
+        assert _post(upload_client, b"not zstd", encoding="zstd").status_code == 400
+
+    def test_unzstd_limit_spans_frames(self):
+        cctx = zstandard.ZstdCompressor()
+        two = cctx.compress(b"x" * 600) + cctx.compress(b"y" * 600)
+        assert unzstd(two, 1200) == b"x" * 600 + b"y" * 600
+        with pytest.raises(BodyTooLarge):
+            unzstd(two, 1199)
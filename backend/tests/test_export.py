@@ -0,0 +1,100 @@
+"""
+Tests for app.export: the NDJSON stream, gzip framing and the batched import.
+"""
+import gzip
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.export import EXPORT_ORDER, ExportFormatError, chunked, gzipped, import_device, iter_export
+
+DEVICE = "0b7f6f8e-2c1a-4d3b-9a8e-1f2e3d4c5b6a"
+
+
+def _xp(n):
+    return [{"id": f"x{i}", "source": "commit", "amount": 15, "created_at": f"2026-03-01T10:00:{i:02d}+00:00"}
+            for i in range(n)]
+
+
+def _events(n):
+    return [{"id": f"e{i}", "session_id": "s1", "event_type": "PostToolUse", "data": {"tool_name": "Bash"},
+             "received_at": f"2026-03-01T10:00:{i:02d}+00:00"} for i in range(n)]
+
+
+@pytest.fixture
+def source_db():
+    db = MagicMock()
+    small = {
+        "devices": [{"id": "pk", "device_id": DEVICE, "character_name": "Hero"}],
+        "user_stats": [{"device_id": DEVICE, "total_xp": 75, "level": 1, "total_commits": 5}],
+        "quest_progress": [{"device_id": DEVICE, "quest_id": "first_commit", "completed_at": "2026-03-01"}],
+    }
+    db.table.side_effect = lambda name: MagicMock(**{
+        "select.return_value.eq.return_value.execute.return_value.data": small[name],
+    })
+    with patch("app.export.iter_xp_log", side_effect=lambda *a, **k: iter(_xp(5))), \
+            patch("app.export.iter_sessions", side_effect=lambda *a, **k: iter([{"session_id": "s1", "minutes": 30}])), \
+            patch("app.export.iter_events", side_effect=lambda *a, **k: iter(_events(7))):
+        yield db
+
+
+def _export(db) -> list[bytes]:
+    return list(iter_export(db, DEVICE))
+
+
+class TestExport:
+    def test_stream_layout(self, source_db):
+        lines = [json.loads(line) for line in _export(source_db)]
+        assert lines[0]["device_id"] == DEVICE
+        assert lines[-1] == {"end": True, "counts": {
+            "devices": 1, "xp_log": 5, "user_stats": 1, "quest_progress": 1, "sessions": 1, "events": 7,
+        }}
+        tables = [line["table"] for line in lines[1:-1]]
+        assert sorted(set(tables), key=tables.index) == list(EXPORT_ORDER)
+        assert all("device_id" not in line["row"] for line in lines[1:-1])
+
+    def test_gzip_round_trip(self, source_db):
+        lines = _export(source_db)
+        assert gzip.decompress(b"".join(gzipped(iter(lines)))) == b"".join(lines)
+
+    def test_chunks_coalesce_lines(self):
+        chunks = list(chunked([b"x" * 10] * 10, size=25))
+        assert [len(c) for c in chunks] == [30, 30, 30, 10]
+
+
+class TestImport:
+    def _import(self, lines, **kwargs):
+        target = MagicMock()
+        counts = import_device(target, lines, batch_size=3, **kwargs)
+        return target, counts
+
+    def test_restores_in_batches_with_derived_columns_dropped(self, source_db):
+        target, counts = self._import(_export(source_db))
+        assert counts["events"] == 7 and counts["xp_log"] == 5
+        tables = [c.args[0] for c in target.table.call_args_list]
+        # 5 xp rows and 7 events in batches of 3
+        assert tables == ["devices", "xp_log", "xp_log", "user_stats", "quest_progress", "sessions",
+                          "events", "events", "events"]
+        upserts = target.table.return_value.upsert.call_args_list
+        stats_row = upserts[3].args[0][0]
+        assert stats_row == {"device_id": DEVICE, "total_commits": 5}
+        device_row = upserts[0].args[0][0]
+        assert "id" not in device_row
+        assert upserts[1].args[0][0]["id"] == "x0"   # same device: ids kept, re-runs skip them
+        assert upserts[1].kwargs == {"on_conflict": "id", "ignore_duplicates": True}
+
+    def test_into_another_device_drops_log_ids(self, source_db):
+        other = "1c2d3e4f-5a6b-4c7d-8e9f-0a1b2c3d4e5f"
+        target, _ = self._import(_export(source_db), device_id=other)
+        inserted = target.table.return_value.insert.call_args_list
+        assert inserted and all("id" not in row for call in inserted for row in call.args[0])
+        assert all(row["device_id"] == other for call in inserted for row in call.args[0])
+
+    def test_truncated_stream_is_rejected(self, source_db):
+        with pytest.raises(ExportFormatError, match="truncated"):
+            self._import(_export(source_db)[:-1])
+
+    def test_wrong_format_is_rejected(self):
+        with pytest.raises(ExportFormatError):
+            self._import([b'{"hello": "world"}\n'])
@@ -0,0 +1,140 @@
+"""
+Tests for per-device request serialization in app.locks.
+"""
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app import locks
+from app.locks import DeviceBusy, device_lock, offline_lock
+
+
+def _run_pair(first_device, second_device, hold=0.1):
+    """Run two lock holders concurrently and return their (start, end) spans."""
+    spans = {}
+
+    def work(name, device_id):
+        with device_lock(None, device_id):
+            start = time.monotonic()
+            time.sleep(hold)
+            spans[name] = (start, time.monotonic())
+
+    threads = [threading.Thread(target=work, args=("a", first_device)),
+               threading.Thread(target=work, args=("b", second_device))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return spans
+
+
+class TestLocalLock:
+    def test_same_device_is_serialized(self):
+        spans = _run_pair("dev", "dev")
+        (a0, a1), (b0, b1) = sorted(spans.values())
+        assert b0 >= a1
+
+    def test_different_devices_run_in_parallel(self):
+        spans = _run_pair("dev-1", "dev-2")
+        (a0, a1), (b0, b1) = sorted(spans.values())
+        assert b0 < a1
+
+    def test_timeout_raises_device_busy(self):
+        held = threading.Event()
+        release = threading.Event()
+
+        def holder():
+            with device_lock(None, "dev"):
+                held.set()
+                release.wait()
+
+        t = threading.Thread(target=holder)
+        t.start()
+        held.wait()
+        try:
+            with patch.object(locks, "LOCK_TIMEOUT", 0.05):
+                with pytest.raises(DeviceBusy):
+                    with device_lock(None, "dev"):
+                        pass
+        finally:
+            release.set()
+            t.join()
+
+    def test_idle_devices_are_forgotten(self):
+        with device_lock(None, "dev"):
+            assert "dev" in locks._locks
+        assert "dev" not in locks._locks
+
+
+class TestDbLease:
+    def _db(self, grants):
+        db = MagicMock()
+        results = iter(grants)
+
+        def rpc(name, params):
+            call = MagicMock()
+            call.execute.return_value.data = next(results) if name == "acquire_device_lease" else None
+            return call
+
+        db.rpc.side_effect = rpc
+        return db
+
+    def test_waits_for_lease_then_releases(self):
+        db = self._db([False, False, True])
+        with patch.object(locks, "LOCK_MODE", "db"):
+            with device_lock(db, "dev"):
+                pass
+        names = [c.args[0] for c in db.rpc.call_args_list]
+        assert names == ["acquire_device_lease"] * 3 + ["release_device_lease"]
+        holders = {c.args[1]["p_holder"] for c in db.rpc.call_args_list}
+        assert len(holders) == 1
+
+    def test_lease_timeout_raises_device_busy(self):
+        db = self._db([False] * 100)
+        with patch.object(locks, "LOCK_MODE", "db"), patch.object(locks, "LOCK_TIMEOUT", 0.05):
+            with pytest.raises(DeviceBusy):
+                with device_lock(db, "dev"):
+                    pass
+
+
+class TestHostLock:
+    def test_serializes_across_processes(self, tmp_path):
+        """A second process can't take the device's lock while this one holds it."""
+        import multiprocessing
+
+        ctx = multiprocessing.get_context("fork")
+        result = ctx.Queue()
+
+        def try_lock():
+            with patch.object(locks, "LOCK_TIMEOUT", 0.05):
+                try:
+                    with device_lock(None, "dev"):
+                        result.put("acquired")
+                except DeviceBusy:
+                    result.put("busy")
+
+        with patch.object(locks, "LOCK_MODE", "host"), patch.object(locks, "LOCK_DIR", str(tmp_path)):
+            with device_lock(None, "dev"):
+                p = ctx.Process(target=try_lock)
+                p.start()
+                p.join()
+                assert result.get(timeout=5) == "busy"
+            p = ctx.Process(target=try_lock)
+            p.start()
+            p.join()
+            assert result.get(timeout=5) == "acquired"
+
+
+class TestOfflineLock:
+    def test_holds_the_lease_and_the_lock_file(self, tmp_path):
+        """A script excludes servers in db mode and in host mode."""
+        db = TestDbLease._db(None, [True])
+        with patch.object(locks, "LOCK_DIR", str(tmp_path)):
+            with offline_lock(db, "dev"):
+                assert [c.args[0] for c in db.rpc.call_args_list] == ["acquire_device_lease"]
+                with pytest.raises(DeviceBusy):   # flock conflicts across open files, even in one process
+                    with locks._host_lock("dev", time.monotonic() + 0.05):
+                        pass
+        assert db.rpc.call_args_list[-1].args[0] == "release_device_lease"
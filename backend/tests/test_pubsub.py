@@ -0,0 +1,127 @@
+import asyncio
+import os
+import queue
+import socket
+import sys
+import threading
+import types
+
+from app.pubsub import HostBroker, LocalBroker, RedisBroker, format_sse
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+class TestLocalBroker:
+    def test_delivers_to_subscribers_of_that_device_only(self):
+        async def scenario():
+            broker = LocalBroker()
+            mine = broker.subscribe("dev-a")
+            other = broker.subscribe("dev-b")
+            broker.publish("dev-a", "xp", {"amount": 15})
+            got = await asyncio.wait_for(mine.get(), 1)
+            assert got == ("xp", {"amount": 15})
+            assert other._queue.empty()
+
+        _run(scenario())
+
+    def test_publish_from_worker_thread(self):
+        async def scenario():
+            broker = LocalBroker()
+            sub = broker.subscribe("dev-a")
+            t = threading.Thread(target=broker.publish, args=("dev-a", "level_up", {"level": 2}))
+            t.start()
+            got = await asyncio.wait_for(sub.get(), 1)
+            t.join()
+            assert got == ("level_up", {"level": 2})
+
+        _run(scenario())
+
+    def test_close_unsubscribes(self):
+        async def scenario():
+            broker = LocalBroker()
+            sub = broker.subscribe("dev-a")
+            assert broker.subscriber_count("dev-a") == 1
+            sub.close()
+            assert broker.subscriber_count("dev-a") == 0
+            broker.publish("dev-a", "xp", {})  # no subscribers — must not raise
+
+        _run(scenario())
+
+    def test_slow_subscriber_drops_instead_of_blocking(self):
+        async def scenario():
+            broker = LocalBroker()
+            sub = broker.subscribe("dev-a")
+            for i in range(sub._queue.maxsize + 10):
+                broker.publish("dev-a", "xp", {"i": i})
+            await asyncio.sleep(0)
+            assert sub._queue.full()
+
+        _run(scenario())
+
+
+class TestHostBroker:
+    def test_publish_reaches_other_workers_subscribers(self, tmp_path):
+        async def scenario():
+            directory = str(tmp_path / "pubsub")
+            viewer, writer = HostBroker(directory), HostBroker(directory)   # two workers
+            sub = viewer.subscribe("dev-a")
+            other = viewer.subscribe("dev-b")
+            writer.publish("dev-a", "xp", {"amount": 15})
+            assert await asyncio.wait_for(sub.get(), 1) == ("xp", {"amount": 15})
+            assert other._queue.empty()
+
+        _run(scenario())
+
+    def test_dead_workers_socket_is_removed(self, tmp_path):
+        directory = tmp_path / "pubsub"
+        directory.mkdir()
+        dead = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        dead.bind(str(directory / "999-deadbeef.sock"))
+        dead.close()
+        HostBroker(str(directory)).publish("dev-a", "xp", {})
+        assert os.listdir(directory) == []
+
+    def test_publish_before_any_subscriber(self, tmp_path):
+        HostBroker(str(tmp_path / "missing")).publish("dev-a", "xp", {})   # must not raise
+
+
+class _FakeRedis:
+    """Just enough of redis-py's pub/sub for RedisBroker, shared by every client."""
+    listeners: list = []
+
+    @classmethod
+    def from_url(cls, url):
+        return cls()
+
+    def publish(self, channel, payload):
+        for inbox in self.listeners:
+            inbox.put({"channel": channel.encode(), "data": payload})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        inbox = queue.Queue()
+        self.listeners.append(inbox)
+        return types.SimpleNamespace(psubscribe=lambda pattern: None, subscribe=lambda channel: None,
+                                     listen=lambda: iter(inbox.get, None))
+
+
+class TestRedisBroker:
+    def test_invalidation_reaches_other_hosts_only(self, monkeypatch):
+        monkeypatch.setitem(sys.modules, "redis", types.SimpleNamespace(Redis=_FakeRedis))
+        monkeypatch.setattr(_FakeRedis, "listeners", [])
+        here, there = RedisBroker("redis://x"), RedisBroker("redis://x")
+        seen_here, seen_there = [], threading.Event()
+        here.on_invalidate(seen_here.append)
+        there.on_invalidate(lambda device_id: seen_there.set() if device_id == "dev-a" else None)
+        while len(_FakeRedis.listeners) < 2:   # both listener threads subscribed
+            threading.Event().wait(0.01)
+        here.invalidate("dev-a")
+        assert seen_there.wait(1)
+        there.invalidate("dev-c")
+        threading.Event().wait(0.1)   # here's own dev-a, if it were delivered, arrived before dev-c
+        assert seen_here == ["dev-c"]
+
+
+def test_format_sse():
+    assert format_sse("xp", {"amount": 8}) == 'event: xp\ndata: {"amount":8}\n\n'
@@ -0,0 +1,60 @@
+"""
+Tests for the token-bucket stores in app.ratelimit.
+"""
+from unittest.mock import patch
+
+import pytest
+
+from app.ratelimit import MemoryStore, Rate, SQLiteStore
+
+
+class TestRate:
+    def test_parse(self):
+        assert Rate.parse("60/minute") == Rate(capacity=60, per_second=1.0)
+        assert Rate.parse("10/hour").per_second == pytest.approx(10 / 3600)
+        assert Rate.parse("5 / hours").capacity == 5
+
+
+def _drain(store, key, rate, n):
+    return [store.hit(key, rate) for _ in range(n)]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStore()
+    return SQLiteStore(str(tmp_path / "rl.db"))
+
+
+class TestBuckets:
+    def test_burst_then_refuse(self, store):
+        rate = Rate(capacity=3, per_second=1.0)
+        waits = _drain(store, "k", rate, 4)
+        assert waits[:3] == [0.0, 0.0, 0.0]
+        assert waits[3] > 0
+
+    def test_keys_are_independent(self, store):
+        rate = Rate(capacity=1, per_second=0.001)
+        assert store.hit("a", rate) == 0.0
+        assert store.hit("b", rate) == 0.0
+        assert store.hit("a", rate) > 0
+
+    def test_refills_over_time(self, store):
+        rate = Rate(capacity=1, per_second=1.0)
+        clock = "time.monotonic" if isinstance(store, MemoryStore) else "time.time"
+        with patch(clock, return_value=1000.0):
+            assert store.hit("k", rate) == 0.0
+            assert store.hit("k", rate) == pytest.approx(1.0)
+        with patch(clock, return_value=1001.0):
+            assert store.hit("k", rate) == 0.0
+
+
+class TestSQLiteStore:
+    def test_shared_between_instances(self, tmp_path):
+        """Two workers on one host see the same buckets."""
+        path = str(tmp_path / "rl.db")
+        rate = Rate(capacity=2, per_second=0.001)
+        worker_a, worker_b = SQLiteStore(path), SQLiteStore(path)
+        assert worker_a.hit("k", rate) == 0.0
+        assert worker_b.hit("k", rate) == 0.0
+        assert worker_a.hit("k", rate) > 0
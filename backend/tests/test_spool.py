@@ -0,0 +1,175 @@
+"""
+Tests for the local event spool, circuit breaker and replayer in app.spool.
+"""
+import time
+
+import httpx
+import pytest
+from postgrest.exceptions import APIError
+
+from app.spool import CircuitBreaker, Replayer, Spool, is_transient
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return Spool(str(tmp_path / "spool.db"), max_bytes=1024 * 1024)
+
+
+class TestIsTransient:
+    @pytest.mark.parametrize("exc", [
+        httpx.ConnectError("refused"),
+        httpx.ReadTimeout("slow"),
+        APIError({"message": "JSON could not be generated", "code": "503"}),
+        APIError({"message": "canceling statement due to statement timeout", "code": "57014"}),
+        APIError({"message": "too many connections", "code": "53300"}),
+    ])
+    def test_db_outages_are_transient(self, exc):
+        assert is_transient(exc)
+
+    @pytest.mark.parametrize("exc", [
+        APIError({"message": "duplicate key", "code": "23505"}),
+        APIError({"message": "column does not exist", "code": "42703"}),
+        ValueError("bad payload"),
+    ])
+    def test_request_errors_are_not(self, exc):
+        assert not is_transient(exc)
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold(self):
+        b = CircuitBreaker(threshold=2, reset_after=60)
+        b.record_failure()
+        assert b.allow()
+        b.record_failure()
+        assert b.state == "open"
+        assert not b.allow()
+
+    def test_half_open_lets_one_trial_through(self):
+        b = CircuitBreaker(threshold=1, reset_after=0.01)
+        b.record_failure()
+        time.sleep(0.02)
+        assert b.state == "half-open"
+        assert b.allow()
+        assert not b.allow()      # second caller waits for the trial
+        b.record_success()
+        assert b.state == "closed"
+
+    def test_release_frees_trial_without_closing(self):
+        b = CircuitBreaker(threshold=1, reset_after=0.01)
+        b.record_failure()
+        time.sleep(0.02)
+        assert b.allow()
+        b.release()
+        assert b.state == "half-open"
+        assert b.allow()
+
+    def test_failed_trial_reopens(self):
+        b = CircuitBreaker(threshold=1, reset_after=0.01)
+        b.record_failure()
+        time.sleep(0.02)
+        assert b.allow()
+        b.record_failure()
+        assert b.state == "open"
+
+
+class TestSpool:
+    def test_fifo_roundtrip(self, spool):
+        for i in range(3):
+            assert spool.append("dev", {"n": i}, {"claimed": i == 2})
+        rows = spool.oldest(10)
+        assert [event["n"] for _, _, event, _ in rows] == [0, 1, 2]
+        assert rows[2][3] == {"claimed": True}
+        spool.remove(rows[0][0], "dev")
+        assert [event["n"] for _, _, event, _ in spool.oldest(10)] == [1, 2]
+
+    def test_pending_is_per_device_and_seen_across_processes(self, spool):
+        spool.append("a", {})
+        assert spool.has_pending("a") and not spool.has_pending("b")
+        other = Spool(spool.path, spool.max_bytes)   # another worker on the host
+        other.append("b", {})
+        assert spool.has_pending("b")
+        [(seq_a, *_), (seq_b, *_)] = spool.oldest(10)
+        spool.remove(seq_a, "a")
+        assert not spool.has_pending("a")
+        assert other.has_pending("b") and not other.has_pending("a")
+
+    def test_rejects_when_full(self, tmp_path):
+        small = Spool(str(tmp_path / "small.db"), max_bytes=64 * 1024)
+        big = {"output": "x" * 4096}
+        accepted = 0
+        while small.append("dev", big):
+            accepted += 1
+            assert accepted < 100
+        assert small.counters["rejected_full"] == 1
+        assert small.metrics()["depth"] == accepted
+
+    def test_metrics(self, spool):
+        assert spool.metrics()["depth"] == 0
+        spool.append("dev", {})
+        m = spool.metrics()
+        assert m["depth"] == 1
+        assert m["spooled"] == 1
+        assert m["bytes"] > 0
+
+
+class TestReplayer:
+    def test_drains_in_order(self, spool):
+        for i in range(5):
+            spool.append(f"dev{i % 2}", {"n": i})
+        seen = []
+        replayer = Replayer(spool, CircuitBreaker(), lambda d, e, p: seen.append(e["n"]))
+        assert replayer.drain() == 5
+        assert seen == [0, 1, 2, 3, 4]
+        assert not spool.has_pending("dev0") and not spool.has_pending("dev1")
+
+    def test_transient_failure_keeps_event_and_stops(self, spool):
+        spool.append("dev", {"n": 0})
+        spool.append("dev", {"n": 1})
+        breaker = CircuitBreaker(threshold=1, reset_after=60)
+
+        def process(device_id, event, progress):
+            raise httpx.ConnectError("refused")
+
+        assert Replayer(spool, breaker, process).drain() == 0
+        assert [e["n"] for _, _, e, _ in spool.oldest(10)] == [0, 1]
+        assert breaker.state == "open"
+        # The breaker now holds replay back until the DB has had time to recover.
+        assert Replayer(spool, breaker, lambda *a: None).drain() == 0
+
+    def test_permanent_failure_is_dropped(self, spool):
+        spool.append("dev", {"n": 0})
+        spool.append("dev", {"n": 1})
+        seen = []
+
+        def process(device_id, event, progress):
+            if event["n"] == 0:
+                raise ValueError("bad payload")
+            seen.append(event["n"])
+
+        assert Replayer(spool, CircuitBreaker(), process).drain() == 1
+        assert seen == [1]
+        assert spool.counters["dropped"] == 1
+
+    def test_failed_replay_saves_its_progress(self, spool):
+        spool.append("dev", {"n": 0}, {"claimed": True})
+
+        def process(device_id, event, progress):
+            progress["logged"] = True
+            raise httpx.ConnectError("refused")
+
+        Replayer(spool, CircuitBreaker(), process).drain()
+        [(_, _, _, progress)] = spool.oldest(10)
+        assert progress == {"claimed": True, "logged": True}
+
+    @pytest.mark.parametrize("exc", [TimeoutError("device busy"), ValueError("bad payload")])
+    def test_non_db_failure_ends_half_open_trial(self, spool, exc):
+        spool.append("dev", {"n": 0})
+        breaker = CircuitBreaker(threshold=1, reset_after=0.01)
+        breaker.record_failure()
+        time.sleep(0.02)
+
+        def process(device_id, event, progress):
+            raise exc
+
+        Replayer(spool, breaker, process).drain()
+        assert breaker.allow()   # the next caller may try; the trial isn't stuck in flight
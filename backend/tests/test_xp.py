@@ -1,6 +1,7 @@
 import pytest
 from app.engine.xp import (
     compute_xp, compute_level, xp_for_level, level_title,
+    level_progress, level_progress_many, LEVEL_CAP,
     parse_commit_stats, extract_file_extension,
 )
 
@@ -153,6 +154,14 @@ class TestComputeLevel:
         for lvl in range(1, 20):
             assert compute_level(xp_for_level(lvl)) == lvl
 
+    def test_one_below_threshold_is_previous_level(self):
+        assert compute_level(xp_for_level(7) - 1) == 6
+
+    def test_beyond_table_cap(self):
+        lvl = LEVEL_CAP + 50
+        assert compute_level(xp_for_level(lvl)) == lvl
+        assert compute_level(xp_for_level(lvl) - 1) == lvl - 1
+
 
 class TestLevelTitle:
     def test_level_0_is_new_recruit(self):
@@ -163,3 +172,22 @@ class TestLevelTitle:
 
     def test_level_30_is_legendary(self):
         assert level_title(30) == "Legendary Promptsmith"
+
+    def test_beyond_table_cap_keeps_top_title(self):
+        assert level_title(LEVEL_CAP + 1) == "Legendary Promptsmith"
+
+
+class TestLevelProgress:
+    def test_progress_within_level(self):
+        p = level_progress(150)
+        assert (p.level, p.title, p.xp_in_level, p.xp_to_next) == (1, "Prompt Padawan", 100, 150)
+
+    def test_zero_and_none(self):
+        assert level_progress(0) == level_progress(None) == (0, "New Recruit", 0, 50)
+
+    def test_many_matches_single_in_input_order(self):
+        totals = [5000, 0, 49, 50, 1250, 999_999_999, 1250, -3]
+        assert level_progress_many(totals) == [level_progress(x) for x in totals]
+
+    def test_many_empty(self):
+        assert level_progress_many([]) == []
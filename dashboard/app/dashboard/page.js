@@ -24,11 +24,10 @@ async function fetchActivity(deviceId) {
     const res = await fetch(`${API_BASE}/api/activity/${deviceId}`, {
       next: { revalidate: 60 },
     });
-    if (!res.ok) return {};
-    const data = await res.json();
-    return data.activity ?? {};
+    if (!res.ok) return null;
+    return await res.json();
   } catch {
-    return {};
+    return null;
   }
 }
 
@@ -89,7 +88,10 @@ export default async function DashboardPage({ searchParams }) {
 
   return (
     <main className="min-h-screen bg-surface px-4 py-8 max-w-2xl mx-auto">
-      <AutoRefresh intervalMs={30_000} />
+      <AutoRefresh
+        intervalMs={30_000}
+        streamUrl={`${API_BASE}/api/profile/${id}/stream`}
+      />
 
       {/* Header */}
       <div className="flex items-center gap-4 mb-6">
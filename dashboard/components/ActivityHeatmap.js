@@ -11,6 +11,15 @@ function getColorClass(count) {
   return "bg-brand";
 }
 
+const DAY_MS = 24 * 60 * 60 * 1000;
+
+// activity is the /api/activity payload: counts[i] is the day `from` + i.
+function countOn(activity, key) {
+  if (!activity?.counts) return 0;
+  const i = Math.round((Date.parse(key) - Date.parse(activity.from)) / DAY_MS);
+  return activity.counts[i] || 0;
+}
+
 function buildGrid(activity) {
   const today = new Date();
   today.setHours(0, 0, 0, 0);
@@ -26,7 +35,7 @@ function buildGrid(activity) {
       const date = new Date(today);
       date.setDate(today.getDate() - daysAgo);
       const key = date.toISOString().slice(0, 10);
-      week.push({ date: key, count: activity[key] || 0 });
+      week.push({ date: key, count: countOn(activity, key) });
     }
     grid.push(week);
   }
@@ -36,7 +45,7 @@ function buildGrid(activity) {
 
 const MONTH_LABELS = ["Jan","Feb","Mar","Apr","May","Jun","Jul","Aug","Sep","Oct","Nov","Dec"];
 
-export default function ActivityHeatmap({ activity = {} }) {
+export default function ActivityHeatmap({ activity = null }) {
   const grid = buildGrid(activity);
 
   // Find month label positions (week index where month changes)
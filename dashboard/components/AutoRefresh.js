@@ -3,18 +3,46 @@
 import { useRouter } from "next/navigation";
 import { useEffect } from "react";
 
+const LIVE_EVENTS = ["xp", "level_up", "quest_complete"];
+
 /**
- * Silently refreshes the dashboard server data every `intervalMs` milliseconds
- * by calling router.refresh() — re-runs the server component fetch without
- * a full page reload.
+ * Keeps the dashboard's server data fresh by calling router.refresh() — re-runs
+ * the server component fetch without a full page reload.
+ *
+ * With a `streamUrl`, refreshes are pushed: the backend's server-sent events
+ * stream fires whenever XP, levels or quests change. Polling every
+ * `intervalMs` is only used while the stream is unavailable.
  */
-export default function AutoRefresh({ intervalMs = 30_000 }) {
+export default function AutoRefresh({ intervalMs = 30_000, streamUrl }) {
   const router = useRouter();
 
   useEffect(() => {
-    const id = setInterval(() => router.refresh(), intervalMs);
-    return () => clearInterval(id);
-  }, [router, intervalMs]);
+    let pollId = null;
+    const startPolling = () => {
+      if (pollId === null) pollId = setInterval(() => router.refresh(), intervalMs);
+    };
+    const stopPolling = () => {
+      if (pollId !== null) clearInterval(pollId);
+      pollId = null;
+    };
+
+    if (!streamUrl || typeof EventSource === "undefined") {
+      startPolling();
+      return stopPolling;
+    }
+
+    const source = new EventSource(streamUrl);
+    const onChange = () => router.refresh();
+    LIVE_EVENTS.forEach((name) => source.addEventListener(name, onChange));
+    source.onopen = stopPolling;
+    // EventSource reconnects on its own; poll in the meantime.
+    source.onerror = startPolling;
+
+    return () => {
+      source.close();
+      stopPolling();
+    };
+  }, [router, intervalMs, streamUrl]);
 
   return null;
 }
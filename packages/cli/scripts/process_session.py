@@ -138,22 +138,34 @@ def parse_transcript(transcript_path: str) -> dict:
 
 
 def send_summary(api_base: str, device_id: str, summary: dict) -> dict | None:
-    """POST the session summary to the backend. Returns response JSON or None."""
+    """
+    POST the session summary to the backend, gzipped. Returns response JSON
+    or None. Falls back to a plain body if the server refuses the encoding.
+    """
+    import gzip
     import urllib.request
     import urllib.error
 
     url = f"{api_base}/api/me/sync-session"
     data = json.dumps(summary).encode()
-    req = urllib.request.Request(
-        url,
-        data=data,
-        headers={
-            "Authorization": f"Bearer {device_id}",
-            "Content-Type": "application/json",
-        },
-        method="POST",
-    )
+    headers = {
+        "Authorization": f"Bearer {device_id}",
+        "Content-Type": "application/json",
+    }
     try:
+        req = urllib.request.Request(
+            url,
+            data=gzip.compress(data, compresslevel=6),
+            headers={**headers, "Content-Encoding": "gzip"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=15) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            if e.code != 415:
+                raise
+        req = urllib.request.Request(url, data=data, headers=headers, method="POST")
         with urllib.request.urlopen(req, timeout=15) as resp:
             return json.loads(resp.read())
     except (urllib.error.URLError, urllib.error.HTTPError, Exception) as e:
@@ -161,6 +173,14 @@ def send_summary(api_base: str, device_id: str, summary: dict) -> dict | None:
         return None
 
 
+def sync_status(result: dict) -> str:
+    """One-line outcome of a sync. A retry of a synced session replays what it earned."""
+    if "xp_awarded" not in result:
+        return "skipped (already processed)"
+    status = "already synced" if result.get("already_processed") else "synced"
+    return f"{status} (+{result['xp_awarded']} XP)"
+
+
 def load_synced_sessions() -> set[str]:
     """Load the set of locally-known synced session IDs."""
     try:
@@ -240,8 +260,7 @@ def sync_all(api_base: str, device_id: str, dry_run: bool = False) -> None:
         result = send_summary(api_base, device_id, summary)
         if result:
             synced.add(session_id)
-            status = "skipped (already processed)" if result.get("already_processed") else "synced"
-            print(f"Session {session_id[:8]}: {status}")
+            print(f"Session {session_id[:8]}: {sync_status(result)}")
             new_count += 1
         else:
             # Don't mark as synced if the request failed — retry next time
@@ -302,8 +321,7 @@ def main():
 
     result = send_summary(api_base, device_id, summary)
     if result:
-        status = "skipped (already processed)" if result.get("already_processed") else "synced"
-        print(f"Session {summary['session_id'][:8]}: {status}")
+        print(f"Session {summary['session_id'][:8]}: {sync_status(result)}")
         # Also mark it locally
         synced = load_synced_sessions()
         synced.add(summary["session_id"])
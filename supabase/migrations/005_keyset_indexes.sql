@@ -0,0 +1,10 @@
+-- 005_keyset_indexes.sql
+-- Composite indexes backing keyset pagination over a device's history
+-- (app.db.iter_events / iter_xp_log order by (timestamp, id) per device).
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE INDEX IF NOT EXISTS events_device_received_idx
+  ON events (device_id, received_at, id);
+
+CREATE INDEX IF NOT EXISTS xp_log_device_created_idx
+  ON xp_log (device_id, created_at, id);
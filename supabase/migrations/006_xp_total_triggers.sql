@@ -0,0 +1,73 @@
+-- 006_xp_total_triggers.sql
+-- Makes xp_log the single source of truth for user_stats.total_xp / level.
+-- A row trigger applies every xp_log insert, delete or amount change to the
+-- device's user_stats row in the same transaction, so the backend never
+-- read-modify-writes total_xp itself.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+-- Mirrors app.engine.xp.compute_level: floor(sqrt(total_xp / 50))
+CREATE OR REPLACE FUNCTION level_for_xp(xp INTEGER) RETURNS INTEGER
+LANGUAGE sql IMMUTABLE AS $$
+  SELECT floor(sqrt(GREATEST(COALESCE(xp, 0), 0) / 50.0))::int
+$$;
+
+CREATE OR REPLACE FUNCTION xp_log_apply_total() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE user_stats
+       SET total_xp = COALESCE(total_xp, 0) - OLD.amount,
+           level    = level_for_xp(COALESCE(total_xp, 0) - OLD.amount)
+     WHERE device_id = OLD.device_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO user_stats AS s (device_id, total_xp, level)
+    VALUES (NEW.device_id, NEW.amount, level_for_xp(NEW.amount))
+    ON CONFLICT (device_id) DO UPDATE
+      SET total_xp = COALESCE(s.total_xp, 0) + EXCLUDED.total_xp,
+          level    = level_for_xp(COALESCE(s.total_xp, 0) + EXCLUDED.total_xp);
+    RETURN NEW;
+  END IF;
+  RETURN OLD;
+END
+$$;
+
+DROP TRIGGER IF EXISTS xp_log_total_xp ON xp_log;
+CREATE TRIGGER xp_log_total_xp
+  AFTER INSERT OR DELETE OR UPDATE OF amount ON xp_log
+  FOR EACH ROW EXECUTE FUNCTION xp_log_apply_total();
+
+-- Devices whose stored total_xp / level disagree with their xp_log, in one
+-- set-based pass. Used by scripts/audit_xp.py.
+CREATE OR REPLACE FUNCTION xp_total_drift()
+RETURNS TABLE (device_id TEXT, stored_xp INTEGER, logged_xp INTEGER, stored_level INTEGER)
+LANGUAGE sql STABLE AS $$
+  SELECT s.device_id,
+         COALESCE(s.total_xp, 0),
+         COALESCE(l.xp, 0)::int,
+         s.level
+    FROM user_stats s
+    LEFT JOIN (SELECT x.device_id, SUM(x.amount) AS xp FROM xp_log x GROUP BY x.device_id) l
+      ON l.device_id = s.device_id
+   WHERE COALESCE(s.total_xp, 0) <> COALESCE(l.xp, 0)
+      OR s.level IS DISTINCT FROM level_for_xp(COALESCE(l.xp, 0)::int)
+$$;
+
+-- Rewrites every drifted total from xp_log. Returns the number of rows fixed.
+CREATE OR REPLACE FUNCTION resync_xp_totals() RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+  fixed INTEGER;
+BEGIN
+  UPDATE user_stats s
+     SET total_xp = d.logged_xp,
+         level    = level_for_xp(d.logged_xp)
+    FROM xp_total_drift() d
+   WHERE s.device_id = d.device_id;
+  GET DIAGNOSTICS fixed = ROW_COUNT;
+  RETURN fixed;
+END
+$$;
+
+-- Start from a consistent state.
+SELECT resync_xp_totals();
@@ -0,0 +1,43 @@
+-- 007_sessions.sql
+-- One row per Claude Code session, so session start / count / duration are
+-- indexed lookups instead of scans over the events table.
+-- Written at SessionStart and SessionEnd (hooks) and by /api/me/sync-session.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE TABLE IF NOT EXISTS sessions (
+  device_id       TEXT NOT NULL REFERENCES devices(device_id) ON DELETE CASCADE,
+  session_id      TEXT NOT NULL,
+  started_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  ended_at        TIMESTAMPTZ,
+  minutes         INTEGER NOT NULL DEFAULT 0,   -- hook path caps at 480
+  commits         INTEGER NOT NULL DEFAULT 0,
+  test_passes     INTEGER NOT NULL DEFAULT 0,
+  started_by_hook BOOLEAN NOT NULL DEFAULT false, -- a SessionStart hook was seen (first-session bonus)
+  PRIMARY KEY (device_id, session_id)
+);
+
+-- Per-device, per-day lookups ("sessions started today") and keyset paging.
+CREATE INDEX IF NOT EXISTS sessions_device_started_idx
+  ON sessions (device_id, started_at, session_id);
+
+-- Backfill from the raw event history.
+INSERT INTO sessions (device_id, session_id, started_at, ended_at, minutes, started_by_hook)
+SELECT device_id,
+       session_id,
+       COALESCE(s.start_at, s.end_at),
+       s.end_at,
+       CASE WHEN s.start_at IS NOT NULL AND s.end_at IS NOT NULL
+            THEN LEAST(480, GREATEST(0, floor(extract(epoch FROM s.end_at - s.start_at) / 60)))::int
+            ELSE 0 END,
+       s.start_at IS NOT NULL
+  FROM (
+    SELECT device_id,
+           session_id,
+           MIN(received_at) FILTER (WHERE event_type = 'SessionStart') AS start_at,
+           MAX(received_at) FILTER (WHERE event_type = 'SessionEnd')   AS end_at
+      FROM events
+     WHERE session_id IS NOT NULL
+       AND event_type IN ('SessionStart', 'SessionEnd')
+     GROUP BY device_id, session_id
+  ) s
+ON CONFLICT (device_id, session_id) DO NOTHING;
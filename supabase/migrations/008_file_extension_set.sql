@@ -0,0 +1,39 @@
+-- 008_file_extension_set.sql
+-- Set-add for user_stats.file_extensions, so callers no longer read the whole
+-- list, union it in Python and write it back. One statement per call, safe
+-- under concurrent requests for the same device.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+-- Adds p_exts to the device's extension set (creating the stats row if
+-- needed) and returns the number of unique extensions afterwards — the
+-- Polyglot quest counter. The row is only rewritten when something is new.
+CREATE OR REPLACE FUNCTION add_file_extensions(p_device_id TEXT, p_exts TEXT[])
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+  n INTEGER;
+BEGIN
+  INSERT INTO user_stats AS s (device_id, file_extensions)
+  VALUES (
+    p_device_id,
+    (SELECT COALESCE(jsonb_agg(DISTINCT e ORDER BY e), '[]'::jsonb) FROM unnest(p_exts) AS e)
+  )
+  ON CONFLICT (device_id) DO UPDATE
+    SET file_extensions = (
+      SELECT COALESCE(jsonb_agg(e ORDER BY e), '[]'::jsonb)
+        FROM (
+          SELECT jsonb_array_elements_text(COALESCE(s.file_extensions, '[]'::jsonb))
+          UNION
+          SELECT unnest(p_exts)
+        ) AS u(e)
+    )
+    WHERE NOT COALESCE(s.file_extensions, '[]'::jsonb) @> to_jsonb(p_exts)
+  RETURNING jsonb_array_length(file_extensions) INTO n;
+
+  IF n IS NULL THEN   -- nothing new: the conditional update skipped the row
+    SELECT jsonb_array_length(COALESCE(file_extensions, '[]'::jsonb)) INTO n
+      FROM user_stats WHERE device_id = p_device_id;
+  END IF;
+  RETURN COALESCE(n, 0);
+END
+$$;
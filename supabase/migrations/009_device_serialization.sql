@@ -0,0 +1,58 @@
+-- 009_device_serialization.sql
+-- Cross-process ordering for per-device read-modify-write requests.
+--
+-- Parallel sessions on one machine send interleaved hooks for the same
+-- device. Within one backend process app/locks.py serializes them; with
+-- DEVICE_LOCKS=db these leases extend that across worker processes and
+-- hosts. (Session advisory locks don't survive PostgREST's one-transaction-
+-- per-request model, so the lock is a row with an expiry instead.)
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE TABLE IF NOT EXISTS device_leases (
+  device_id  TEXT PRIMARY KEY,
+  holder     TEXT NOT NULL,
+  expires_at TIMESTAMPTZ NOT NULL
+);
+
+-- Take the device's lease if it is free, expired, or already ours.
+CREATE OR REPLACE FUNCTION acquire_device_lease(p_device_id TEXT, p_holder TEXT, p_ttl_ms INTEGER)
+RETURNS BOOLEAN
+LANGUAGE plpgsql AS $$
+DECLARE
+  got BOOLEAN;
+BEGIN
+  INSERT INTO device_leases AS l (device_id, holder, expires_at)
+  VALUES (p_device_id, p_holder, NOW() + make_interval(secs => p_ttl_ms / 1000.0))
+  ON CONFLICT (device_id) DO UPDATE
+    SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+    WHERE l.expires_at < NOW() OR l.holder = p_holder
+  RETURNING true INTO got;
+  RETURN COALESCE(got, false);
+END
+$$;
+
+CREATE OR REPLACE FUNCTION release_device_lease(p_device_id TEXT, p_holder TEXT)
+RETURNS VOID
+LANGUAGE sql AS $$
+  DELETE FROM device_leases WHERE device_id = p_device_id AND holder = p_holder
+$$;
+
+-- Mark a quest complete only if it isn't already: never completed, or (for
+-- daily quests, p_since = start of today) last completed before p_since.
+-- Returns true for exactly one caller, so a quest's XP is awarded once even
+-- if two requests evaluate it at the same time.
+CREATE OR REPLACE FUNCTION claim_quest(p_device_id TEXT, p_quest_id TEXT, p_since TIMESTAMPTZ DEFAULT NULL)
+RETURNS BOOLEAN
+LANGUAGE plpgsql AS $$
+DECLARE
+  claimed BOOLEAN;
+BEGIN
+  INSERT INTO quest_progress AS q (device_id, quest_id, completed_at)
+  VALUES (p_device_id, p_quest_id, NOW())
+  ON CONFLICT (device_id, quest_id) DO UPDATE
+    SET completed_at = NOW()
+    WHERE q.completed_at IS NULL OR (p_since IS NOT NULL AND q.completed_at < p_since)
+  RETURNING true INTO claimed;
+  RETURN COALESCE(claimed, false);
+END
+$$;
@@ -0,0 +1,17 @@
+-- 010_batch_profile_counts.sql
+-- Today's commit and session counts for many devices in one call, for
+-- POST /api/profiles:batch. Devices with neither are returned with zeros.
+-- Served by the xp_log (device_id, created_at, id) and sessions
+-- (device_id, started_at, session_id) indexes from 005 and 007.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE OR REPLACE FUNCTION today_counts(p_device_ids TEXT[], p_since TIMESTAMPTZ)
+RETURNS TABLE (device_id TEXT, commits BIGINT, sessions BIGINT)
+LANGUAGE sql STABLE AS $$
+  SELECT d.device_id,
+         (SELECT COUNT(*) FROM xp_log x
+           WHERE x.device_id = d.device_id AND x.source = 'commit' AND x.created_at >= p_since),
+         (SELECT COUNT(*) FROM sessions s
+           WHERE s.device_id = d.device_id AND s.started_at >= p_since)
+  FROM unnest(p_device_ids) AS d(device_id)
+$$;
@@ -0,0 +1,201 @@
+-- 011_teams.sql
+-- Teams of devices, with rollups kept current by triggers.
+--
+-- team_stats holds one precomputed row per team, so team views and the team
+-- leaderboard never read members' rows. It is maintained in the transaction
+-- that changes the underlying data, like user_stats.total_xp (006):
+--   * user_stats insert/update/delete -> deltas of total_xp, total_commits
+--     and total_test_passes to each of the device's teams. ingest_event and
+--     sync_session write those through xp_log (trigger from 006) and
+--     upsert_stats, so both paths update their teams as they go.
+--   * team_members insert/delete -> add or subtract the member's totals.
+--   * xp_log insert -> the member is active on that day: advances the
+--     team's active-member count and day streak (a team is active on a day
+--     when any member earned XP).
+-- A device deletion cascades to both user_stats and team_members; whichever
+-- is removed first subtracts the totals, and the other finds nothing left.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE TABLE IF NOT EXISTS teams (
+  team_id         TEXT PRIMARY KEY,
+  name            TEXT NOT NULL,
+  join_code       TEXT UNIQUE NOT NULL,
+  owner_device_id TEXT REFERENCES devices(device_id) ON DELETE SET NULL,
+  created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS team_members (
+  team_id          TEXT NOT NULL REFERENCES teams(team_id) ON DELETE CASCADE,
+  device_id        TEXT NOT NULL REFERENCES devices(device_id) ON DELETE CASCADE,
+  joined_at        TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  last_active_date DATE,
+  PRIMARY KEY (team_id, device_id)
+);
+CREATE INDEX IF NOT EXISTS team_members_device_idx ON team_members (device_id);
+
+CREATE TABLE IF NOT EXISTS team_stats (
+  team_id           TEXT PRIMARY KEY REFERENCES teams(team_id) ON DELETE CASCADE,
+  member_count      INTEGER NOT NULL DEFAULT 0,
+  total_xp          BIGINT  NOT NULL DEFAULT 0,
+  total_commits     BIGINT  NOT NULL DEFAULT 0,
+  total_test_passes BIGINT  NOT NULL DEFAULT 0,
+  last_active_date  DATE,                        -- last day any member earned XP
+  active_members    INTEGER NOT NULL DEFAULT 0,  -- members who earned XP on last_active_date
+  current_streak    INTEGER NOT NULL DEFAULT 0,  -- consecutive active days ending last_active_date
+  longest_streak    INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS team_stats_xp_idx ON team_stats (total_xp DESC);
+
+CREATE OR REPLACE FUNCTION teams_create_stats() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  INSERT INTO team_stats (team_id) VALUES (NEW.team_id) ON CONFLICT DO NOTHING;
+  RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS teams_stats_row ON teams;
+CREATE TRIGGER teams_stats_row
+  AFTER INSERT ON teams
+  FOR EACH ROW EXECUTE FUNCTION teams_create_stats();
+
+-- Member stat changes -> their teams' totals.
+CREATE OR REPLACE FUNCTION user_stats_apply_teams() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  d_xp      BIGINT := 0;
+  d_commits BIGINT := 0;
+  d_tests   BIGINT := 0;
+  dev       TEXT;
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    dev := NEW.device_id;
+    d_xp := COALESCE(NEW.total_xp, 0);
+    d_commits := COALESCE(NEW.total_commits, 0);
+    d_tests := COALESCE(NEW.total_test_passes, 0);
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    dev := OLD.device_id;
+    d_xp := d_xp - COALESCE(OLD.total_xp, 0);
+    d_commits := d_commits - COALESCE(OLD.total_commits, 0);
+    d_tests := d_tests - COALESCE(OLD.total_test_passes, 0);
+  END IF;
+  IF d_xp <> 0 OR d_commits <> 0 OR d_tests <> 0 THEN
+    UPDATE team_stats t
+       SET total_xp = t.total_xp + d_xp,
+           total_commits = t.total_commits + d_commits,
+           total_test_passes = t.total_test_passes + d_tests
+      FROM team_members m
+     WHERE m.device_id = dev AND t.team_id = m.team_id;
+  END IF;
+  RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS user_stats_teams ON user_stats;
+CREATE TRIGGER user_stats_teams
+  AFTER INSERT OR DELETE OR UPDATE OF total_xp, total_commits, total_test_passes ON user_stats
+  FOR EACH ROW EXECUTE FUNCTION user_stats_apply_teams();
+
+-- Joining or leaving carries the member's totals with them.
+CREATE OR REPLACE FUNCTION team_members_apply_stats() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  dir INTEGER;
+  m   team_members;
+  s   user_stats;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    dir := 1;  m := NEW;
+  ELSE
+    dir := -1; m := OLD;
+  END IF;
+  SELECT * INTO s FROM user_stats WHERE device_id = m.device_id;
+  UPDATE team_stats
+     SET member_count = member_count + dir,
+         total_xp = total_xp + dir * COALESCE(s.total_xp, 0),
+         total_commits = total_commits + dir * COALESCE(s.total_commits, 0),
+         total_test_passes = total_test_passes + dir * COALESCE(s.total_test_passes, 0)
+   WHERE team_id = m.team_id;
+  RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS team_members_stats ON team_members;
+CREATE TRIGGER team_members_stats
+  AFTER INSERT OR DELETE ON team_members
+  FOR EACH ROW EXECUTE FUNCTION team_members_apply_stats();
+
+-- XP earned on day d marks the member active on d. Each member counts once
+-- per day; back-dated entries (reprocess backfills) never move a day back.
+CREATE OR REPLACE FUNCTION xp_log_apply_team_activity() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  d DATE := COALESCE(NEW.created_at, NOW())::date;
+BEGIN
+  WITH advanced AS (
+    UPDATE team_members
+       SET last_active_date = d
+     WHERE device_id = NEW.device_id
+       AND (last_active_date IS NULL OR last_active_date < d)
+    RETURNING team_id
+  )
+  UPDATE team_stats t
+     SET active_members = CASE WHEN t.last_active_date = d THEN t.active_members + 1 ELSE 1 END,
+         current_streak = CASE WHEN t.last_active_date = d THEN t.current_streak
+                               WHEN t.last_active_date = d - 1 THEN t.current_streak + 1
+                               ELSE 1 END,
+         longest_streak = GREATEST(t.longest_streak,
+                                   CASE WHEN t.last_active_date = d THEN t.current_streak
+                                        WHEN t.last_active_date = d - 1 THEN t.current_streak + 1
+                                        ELSE 1 END),
+         last_active_date = d
+    FROM advanced a
+   WHERE t.team_id = a.team_id
+     AND (t.last_active_date IS NULL OR t.last_active_date <= d);
+  RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS xp_log_team_activity ON xp_log;
+CREATE TRIGGER xp_log_team_activity
+  AFTER INSERT ON xp_log
+  FOR EACH ROW EXECUTE FUNCTION xp_log_apply_team_activity();
+
+-- Create a team with its owner as the first member, atomically.
+CREATE OR REPLACE FUNCTION create_team(p_team_id TEXT, p_name TEXT, p_join_code TEXT, p_owner TEXT)
+RETURNS VOID
+LANGUAGE sql AS $$
+  INSERT INTO teams (team_id, name, join_code, owner_device_id) VALUES (p_team_id, p_name, p_join_code, p_owner);
+  INSERT INTO team_members (team_id, device_id) VALUES (p_team_id, p_owner);
+$$;
+
+-- Rebuild every team's totals and member count from its members (activity
+-- and streaks are history and are left alone). Returns the number of teams.
+CREATE OR REPLACE FUNCTION resync_team_stats() RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+  fixed INTEGER;
+BEGIN
+  WITH r AS (
+    SELECT t.team_id,
+           COUNT(m.device_id) AS members,
+           COALESCE(SUM(s.total_xp), 0) AS xp,
+           COALESCE(SUM(s.total_commits), 0) AS commits,
+           COALESCE(SUM(s.total_test_passes), 0) AS tests
+      FROM team_stats t
+      LEFT JOIN team_members m ON m.team_id = t.team_id
+      LEFT JOIN user_stats s ON s.device_id = m.device_id
+     GROUP BY t.team_id
+  )
+  UPDATE team_stats t
+     SET member_count = r.members,
+         total_xp = r.xp,
+         total_commits = r.commits,
+         total_test_passes = r.tests
+    FROM r
+   WHERE t.team_id = r.team_id;
+  GET DIAGNOSTICS fixed = ROW_COUNT;
+  RETURN fixed;
+END
+$$;
@@ -0,0 +1,61 @@
+-- 012_xp_period_totals.sql
+-- Per-device XP per day / week / month, for period leaderboards.
+--
+-- Summing xp_log over every device for "this week" on each request would
+-- scan the whole period. Instead each xp_log insert, delete or amount change
+-- is applied to the device's three current buckets in the same transaction,
+-- like user_stats.total_xp (006). Buckets start on UTC day boundaries;
+-- weeks start on Monday (ISO), matching app.db.period_start.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE TABLE IF NOT EXISTS xp_period_totals (
+  device_id    TEXT NOT NULL REFERENCES devices(device_id) ON DELETE CASCADE,
+  period       TEXT NOT NULL CHECK (period IN ('day', 'week', 'month')),
+  period_start DATE NOT NULL,
+  xp           INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (device_id, period, period_start)
+);
+
+-- Top-K and keyset pages per period: (xp DESC, device_id) within one bucket.
+CREATE INDEX IF NOT EXISTS xp_period_totals_rank_idx
+  ON xp_period_totals (period, period_start, xp DESC, device_id);
+
+-- The same ordering for the all-time board.
+CREATE INDEX IF NOT EXISTS user_stats_rank_idx ON user_stats (total_xp DESC, device_id);
+
+CREATE OR REPLACE FUNCTION xp_period_add(p_device_id TEXT, p_at TIMESTAMPTZ, p_amount INTEGER)
+RETURNS VOID
+LANGUAGE sql AS $$
+  INSERT INTO xp_period_totals AS t (device_id, period, period_start, xp)
+  SELECT p_device_id, p, date_trunc(p, COALESCE(p_at, NOW()) AT TIME ZONE 'UTC')::date, p_amount
+    FROM unnest(ARRAY['day', 'week', 'month']) AS p
+  ON CONFLICT (device_id, period, period_start) DO UPDATE
+    SET xp = t.xp + EXCLUDED.xp
+$$;
+
+CREATE OR REPLACE FUNCTION xp_log_apply_periods() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM xp_period_add(OLD.device_id, OLD.created_at, -OLD.amount);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM xp_period_add(NEW.device_id, NEW.created_at, NEW.amount);
+  END IF;
+  RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS xp_log_period_totals ON xp_log;
+CREATE TRIGGER xp_log_period_totals
+  AFTER INSERT OR DELETE OR UPDATE OF amount ON xp_log
+  FOR EACH ROW EXECUTE FUNCTION xp_log_apply_periods();
+
+-- Backfill from history (safe to re-run: buckets are recomputed, not added to).
+INSERT INTO xp_period_totals AS t (device_id, period, period_start, xp)
+SELECT x.device_id, p, date_trunc(p, x.created_at AT TIME ZONE 'UTC')::date, SUM(x.amount)::int
+  FROM xp_log x
+ CROSS JOIN unnest(ARRAY['day', 'week', 'month']) AS p
+ GROUP BY 1, 2, 3
+ON CONFLICT (device_id, period, period_start) DO UPDATE
+  SET xp = EXCLUDED.xp;
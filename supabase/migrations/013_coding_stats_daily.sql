@@ -0,0 +1,90 @@
+-- 013_coding_stats_daily.sql
+-- Per-device, per-day counters behind GET /api/stats.
+--
+-- The endpoint used to re-aggregate 30 days of raw events on every request,
+-- so its cost grew with how chatty a device's agent was. Now each events
+-- insert (log_raw_event in ingest_event) bumps that day's bucket in the
+-- same transaction: project (last segment of data.cwd), tool_name, and the
+-- UTC hour it arrived. The endpoint merges at most CODING_STATS_DAYS rows.
+-- Buckets older than that are deleted when a device opens a new day's bucket.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE TABLE IF NOT EXISTS coding_stats_daily (
+  device_id TEXT NOT NULL REFERENCES devices(device_id) ON DELETE CASCADE,
+  day       DATE NOT NULL,
+  projects  JSONB NOT NULL DEFAULT '{}',                       -- project -> events
+  tools     JSONB NOT NULL DEFAULT '{}',                       -- tool_name -> events
+  hours     INTEGER[] NOT NULL DEFAULT array_fill(0, ARRAY[24]), -- events per UTC hour, [1] = 00:00
+  PRIMARY KEY (device_id, day)
+);
+
+-- Keep in step with CODING_STATS_DAYS in app/db.py.
+CREATE OR REPLACE FUNCTION coding_stats_retention_days() RETURNS INTEGER
+LANGUAGE sql IMMUTABLE AS $$ SELECT 30 $$;
+
+CREATE OR REPLACE FUNCTION jsonb_increment(counts JSONB, k TEXT) RETURNS JSONB
+LANGUAGE sql IMMUTABLE AS $$
+  SELECT CASE WHEN k IS NULL OR k = '' THEN counts
+              ELSE jsonb_set(counts, ARRAY[k], to_jsonb(COALESCE((counts ->> k)::int, 0) + 1))
+         END
+$$;
+
+CREATE OR REPLACE FUNCTION events_apply_coding_stats() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  at      TIMESTAMP := COALESCE(NEW.received_at, NOW()) AT TIME ZONE 'UTC';
+  d       DATE := at::date;
+  h       INTEGER := EXTRACT(HOUR FROM at)::int + 1;
+  project TEXT := substring(rtrim(NEW.data ->> 'cwd', '/') FROM '[^/]+$');
+  tool    TEXT := NEW.data ->> 'tool_name';
+  opened  BOOLEAN;
+BEGIN
+  INSERT INTO coding_stats_daily (device_id, day) VALUES (NEW.device_id, d)
+  ON CONFLICT DO NOTHING
+  RETURNING true INTO opened;
+
+  UPDATE coding_stats_daily
+     SET projects = jsonb_increment(projects, project),
+         tools = jsonb_increment(tools, tool),
+         hours[h] = hours[h] + 1
+   WHERE device_id = NEW.device_id AND day = d;
+
+  IF opened THEN
+    DELETE FROM coding_stats_daily
+     WHERE device_id = NEW.device_id AND day <= d - coding_stats_retention_days();
+  END IF;
+  RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS events_coding_stats ON events;
+CREATE TRIGGER events_coding_stats
+  AFTER INSERT ON events
+  FOR EACH ROW EXECUTE FUNCTION events_apply_coding_stats();
+
+-- Backfill the retention window from raw events (safe to re-run).
+INSERT INTO coding_stats_daily AS c (device_id, day, projects, tools, hours)
+SELECT e.device_id,
+       e.day,
+       COALESCE((SELECT jsonb_object_agg(project, n) FROM (
+                   SELECT substring(rtrim(x.data ->> 'cwd', '/') FROM '[^/]+$') AS project, COUNT(*) AS n
+                     FROM events x
+                    WHERE x.device_id = e.device_id AND (x.received_at AT TIME ZONE 'UTC')::date = e.day
+                    GROUP BY 1) p
+                  WHERE project IS NOT NULL AND project <> ''), '{}'),
+       COALESCE((SELECT jsonb_object_agg(tool, n) FROM (
+                   SELECT x.data ->> 'tool_name' AS tool, COUNT(*) AS n
+                     FROM events x
+                    WHERE x.device_id = e.device_id AND (x.received_at AT TIME ZONE 'UTC')::date = e.day
+                    GROUP BY 1) t
+                  WHERE tool IS NOT NULL AND tool <> ''), '{}'),
+       (SELECT array_agg(COALESCE(n, 0) ORDER BY hr) FROM generate_series(0, 23) AS hr
+          LEFT JOIN (SELECT EXTRACT(HOUR FROM x.received_at AT TIME ZONE 'UTC')::int AS hour, COUNT(*)::int AS n
+                       FROM events x
+                      WHERE x.device_id = e.device_id AND (x.received_at AT TIME ZONE 'UTC')::date = e.day
+                      GROUP BY 1) hc ON hc.hour = hr)
+  FROM (SELECT DISTINCT device_id, (received_at AT TIME ZONE 'UTC')::date AS day
+          FROM events
+         WHERE received_at >= (NOW() AT TIME ZONE 'UTC')::date - coding_stats_retention_days() + 1) e
+ON CONFLICT (device_id, day) DO UPDATE
+  SET projects = EXCLUDED.projects, tools = EXCLUDED.tools, hours = EXCLUDED.hours;
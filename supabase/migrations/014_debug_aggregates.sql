@@ -0,0 +1,28 @@
+-- 014_debug_aggregates.sql
+-- Grouped counts for the /api/debug endpoints, computed in the database.
+--
+-- The endpoints used to pull every row for a device and count in Python,
+-- which timed out on exactly the heavy accounts support needs to look at.
+-- Both functions range-scan the (device_id, timestamp, id) indexes from
+-- 005 and return one row per group. Days are UTC.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE OR REPLACE FUNCTION debug_event_counts(p_device_id TEXT, p_since TIMESTAMPTZ)
+RETURNS TABLE (day DATE, event_type TEXT, events BIGINT, first_at TIMESTAMPTZ, last_at TIMESTAMPTZ)
+LANGUAGE sql STABLE AS $$
+  SELECT (received_at AT TIME ZONE 'UTC')::date, event_type, COUNT(*), MIN(received_at), MAX(received_at)
+    FROM events
+   WHERE device_id = p_device_id AND received_at >= p_since
+   GROUP BY 1, 2
+   ORDER BY 1, 2
+$$;
+
+CREATE OR REPLACE FUNCTION debug_xp_summary(p_device_id TEXT)
+RETURNS TABLE (day DATE, source TEXT, entries BIGINT, xp BIGINT, first_at TIMESTAMPTZ, last_at TIMESTAMPTZ)
+LANGUAGE sql STABLE AS $$
+  SELECT (created_at AT TIME ZONE 'UTC')::date, source, COUNT(*), SUM(amount), MIN(created_at), MAX(created_at)
+    FROM xp_log
+   WHERE device_id = p_device_id
+   GROUP BY 1, 2
+   ORDER BY 1, 2
+$$;
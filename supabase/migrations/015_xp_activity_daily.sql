@@ -0,0 +1,68 @@
+-- 015_xp_activity_daily.sql
+-- Per-device, per-day, per-source xp_log entry counts behind GET /api/activity.
+--
+-- The heatmap used to fetch a year of xp_log timestamps and bucket them in
+-- Python, which grows with how active a device is and gets worse for every
+-- extra year shown. Each xp_log insert, delete or move is applied to its
+-- (UTC day, source) bucket in the same transaction, like xp_period_totals
+-- (012). activity_series() returns one dense array per source over a date
+-- range, so any range costs one index range read and a handful of rows.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE TABLE IF NOT EXISTS xp_activity_daily (
+  device_id TEXT NOT NULL REFERENCES devices(device_id) ON DELETE CASCADE,
+  day       DATE NOT NULL,
+  source    TEXT NOT NULL,
+  entries   INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (device_id, day, source)
+);
+
+CREATE OR REPLACE FUNCTION xp_activity_add(p_device_id TEXT, p_at TIMESTAMPTZ, p_source TEXT, p_entries INTEGER)
+RETURNS VOID
+LANGUAGE sql AS $$
+  INSERT INTO xp_activity_daily AS a (device_id, day, source, entries)
+  VALUES (p_device_id, (COALESCE(p_at, NOW()) AT TIME ZONE 'UTC')::date, p_source, p_entries)
+  ON CONFLICT (device_id, day, source) DO UPDATE
+    SET entries = a.entries + EXCLUDED.entries
+$$;
+
+CREATE OR REPLACE FUNCTION xp_log_apply_activity() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM xp_activity_add(OLD.device_id, OLD.created_at, OLD.source, -1);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM xp_activity_add(NEW.device_id, NEW.created_at, NEW.source, 1);
+  END IF;
+  RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS xp_log_activity_daily ON xp_log;
+CREATE TRIGGER xp_log_activity_daily
+  AFTER INSERT OR DELETE OR UPDATE OF source, created_at ON xp_log
+  FOR EACH ROW EXECUTE FUNCTION xp_log_apply_activity();
+
+-- One row per source seen in [p_from, p_to]: counts[1] is p_from, one
+-- element per day, zeros included.
+CREATE OR REPLACE FUNCTION activity_series(p_device_id TEXT, p_from DATE, p_to DATE)
+RETURNS TABLE (source TEXT, counts INTEGER[])
+LANGUAGE sql STABLE AS $$
+  SELECT s.source, array_agg(COALESCE(a.entries, 0) ORDER BY d.day)
+    FROM (SELECT DISTINCT source FROM xp_activity_daily
+           WHERE device_id = p_device_id AND day BETWEEN p_from AND p_to) s
+   CROSS JOIN generate_series(p_from, p_to, INTERVAL '1 day') AS d(day)
+    LEFT JOIN xp_activity_daily a
+      ON a.device_id = p_device_id AND a.day = d.day::date AND a.source = s.source
+   GROUP BY s.source
+   ORDER BY s.source
+$$;
+
+-- Backfill from history (safe to re-run: buckets are recomputed, not added to).
+INSERT INTO xp_activity_daily AS a (device_id, day, source, entries)
+SELECT device_id, (created_at AT TIME ZONE 'UTC')::date, source, COUNT(*)::int
+  FROM xp_log
+ GROUP BY 1, 2, 3
+ON CONFLICT (device_id, day, source) DO UPDATE
+  SET entries = EXCLUDED.entries;
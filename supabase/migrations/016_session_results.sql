@@ -0,0 +1,18 @@
+-- 016_session_results.sql
+-- The response POST /api/me/sync-session gave for each session it processed.
+--
+-- processed_events only records that a session was synced, so a client that
+-- retried after losing the response got {"already_processed": true} and no
+-- idea what it had earned, and every retry paid a failing insert. The route
+-- now looks here (behind a per-process LRU) before claiming the session and
+-- replays the stored result. Sessions synced before this migration still
+-- get the bare already_processed answer.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE TABLE IF NOT EXISTS session_results (
+  device_id  TEXT NOT NULL REFERENCES devices(device_id) ON DELETE CASCADE,
+  session_id TEXT NOT NULL,
+  result     JSONB NOT NULL,   -- xp_awarded, quest_completions, resulting totals
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (device_id, session_id)
+);
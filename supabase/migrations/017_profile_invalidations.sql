@@ -0,0 +1,29 @@
+-- 017_profile_invalidations.sql
+-- A feed of devices whose profile changed outside the API servers.
+--
+-- Profile ETags and render caches are keyed by version numbers that the
+-- servers bump on their own writes (app/cache.py). Scripts that write to
+-- the database directly (recompute_xp, import_device, backfill_xp,
+-- audit_xp --fix) never reach those versions, so clients kept getting 304
+-- with stale totals. Such writers now call invalidate_profiles(), and
+-- every server process polls this table (INVALIDATION_POLL_SECONDS) and
+-- bumps its local version for each device listed.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE SEQUENCE IF NOT EXISTS profile_invalidation_seq;
+
+-- No foreign key: a deleted device's cached profile must be dropped too.
+CREATE TABLE IF NOT EXISTS profile_invalidations (
+  device_id TEXT PRIMARY KEY,
+  seq       BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS profile_invalidations_seq_idx ON profile_invalidations (seq);
+
+CREATE OR REPLACE FUNCTION invalidate_profiles(p_device_ids TEXT[]) RETURNS VOID
+LANGUAGE sql AS $$
+  INSERT INTO profile_invalidations (device_id, seq)
+  SELECT d, nextval('profile_invalidation_seq')
+    FROM (SELECT DISTINCT unnest(p_device_ids) AS d) ids
+  ON CONFLICT (device_id) DO UPDATE SET seq = EXCLUDED.seq
+$$;
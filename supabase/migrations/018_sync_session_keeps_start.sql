@@ -0,0 +1,29 @@
+-- 018_sync_session_keeps_start.sql
+-- /api/me/sync-session no longer moves a session's started_at.
+--
+-- The route upserted the whole row, so the client's started_at replaced the
+-- one the SessionStart hook recorded. A session the hook saw start before
+-- midnight could move into the next day (or out of today) and change
+-- sessions_today. The hook's start time is authoritative: the synced one is
+-- only used when the session has no row yet.
+-- Run in Supabase SQL editor: Dashboard > SQL Editor > New query.
+
+CREATE OR REPLACE FUNCTION upsert_synced_session(
+  p_device_id   TEXT,
+  p_session_id  TEXT,
+  p_started_at  TIMESTAMPTZ,
+  p_ended_at    TIMESTAMPTZ,
+  p_minutes     INTEGER,
+  p_commits     INTEGER,
+  p_test_passes INTEGER
+) RETURNS VOID
+LANGUAGE sql AS $$
+  INSERT INTO sessions AS s (device_id, session_id, started_at, ended_at, minutes, commits, test_passes)
+  VALUES (p_device_id, p_session_id, COALESCE(p_started_at, NOW()), p_ended_at,
+          p_minutes, p_commits, p_test_passes)
+  ON CONFLICT (device_id, session_id) DO UPDATE
+    SET ended_at    = COALESCE(EXCLUDED.ended_at, s.ended_at),
+        minutes     = EXCLUDED.minutes,
+        commits     = EXCLUDED.commits,
+        test_passes = EXCLUDED.test_passes
+$$;